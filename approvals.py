@@ -0,0 +1,247 @@
+import sqlite3
+import time
+import uuid
+from typing import Literal
+
+from pydantic import BaseModel
+
+APPROVAL_TIMEOUT_REASON = "The user did not approve the tool call in time."
+APPROVAL_CANCELLED_REASON = (
+    "The user moved on without answering the approval request for this tool call."
+)
+
+
+class PendingApproval(BaseModel):
+    """A tool call waiting for a human decision, as stored by the `ApprovalBroker`."""
+
+    approval_id: str
+    session_id: str
+    batch_id: str
+    tool_id: str
+    tool_name: str
+    tool_kwargs: dict
+    created_at: float
+    expires_at: float | None = None
+    status: Literal["pending", "approved", "rejected", "expired"] = "pending"
+    reason: str | None = None
+
+
+class ApprovalBroker:
+    """
+    Persists the tool calls that wait for human approval, so a turn waiting on them
+    ends instead of holding a running workflow per waiting user.
+
+    The workflow parks the calls that need approval under their batch and stops; the
+    decisions arrive later through `resolve`, and once every call of a batch is decided
+    (or expired) `take_batch` hands them to a run that resumes the session. Approvals
+    expire after `timeout` seconds unless the tool's `ToolPolicy.approval_timeout` says
+    otherwise. Expiry uses wall-clock time, so it holds across restarts.
+    """
+
+    def __init__(self, path: str = ":memory:", timeout: float | None = None):
+        self.path = path
+        self.timeout = timeout
+        self._conn = sqlite3.connect(path, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS approvals ("
+            "approval_id TEXT PRIMARY KEY, session_id TEXT NOT NULL, "
+            "batch_id TEXT NOT NULL, status TEXT NOT NULL, expires_at REAL, "
+            "data TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS approvals_session "
+            "ON approvals (session_id, batch_id)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS approvals_expiry ON approvals (status, expires_at)"
+        )
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM approvals").fetchone()[0]
+
+    def park(
+        self,
+        session_id: str,
+        batch_id: str,
+        tool_calls: list[tuple[str, str, dict]],
+        timeouts: dict[str, float | None] | None = None,
+    ) -> list[PendingApproval]:
+        """
+        Stores `(tool_id, tool_name, tool_kwargs)` calls waiting for approval.
+        `timeouts` overrides the broker timeout per tool name.
+        """
+        timeouts = timeouts or {}
+        now = time.time()
+        approvals = []
+        for tool_id, tool_name, tool_kwargs in tool_calls:
+            timeout = timeouts.get(tool_name, self.timeout)
+            approvals.append(
+                PendingApproval(
+                    approval_id=uuid.uuid4().hex,
+                    session_id=session_id,
+                    batch_id=batch_id,
+                    tool_id=tool_id,
+                    tool_name=tool_name,
+                    tool_kwargs=tool_kwargs,
+                    created_at=now,
+                    expires_at=now + timeout if timeout is not None else None,
+                )
+            )
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT INTO approvals VALUES (?, ?, ?, ?, ?, ?)",
+                [self._row(approval) for approval in approvals],
+            )
+        return approvals
+
+    def get(self, approval_id: str) -> PendingApproval | None:
+        row = self._conn.execute(
+            "SELECT data FROM approvals WHERE approval_id = ?", (approval_id,)
+        ).fetchone()
+        return PendingApproval.model_validate_json(row[0]) if row else None
+
+    def pending(self, session_id: str | None = None) -> list[PendingApproval]:
+        """The approvals still waiting for a decision, of one session or of all."""
+        self.expire()
+        query = "SELECT data FROM approvals WHERE status = 'pending'"
+        params: tuple = ()
+        if session_id is not None:
+            query += " AND session_id = ?"
+            params = (session_id,)
+        return [
+            PendingApproval.model_validate_json(data)
+            for (data,) in self._conn.execute(query, params)
+        ]
+
+    def resolve(
+        self, approval_id: str, approved: bool, reason: str | None = None
+    ) -> PendingApproval | None:
+        """Records a decision. Returns None if the approval is unknown or already decided."""
+        return self.resolve_many({approval_id: approved}, reason).get(approval_id)
+
+    def resolve_many(
+        self, decisions: dict[str, bool], reason: str | None = None
+    ) -> dict[str, PendingApproval]:
+        """Records several decisions at once, e.g. every pending call of a batch."""
+        self.expire()
+        resolved = {}
+        with self._conn:
+            self._conn.execute("BEGIN")
+            for approval_id, approved in decisions.items():
+                row = self._conn.execute(
+                    "SELECT data FROM approvals "
+                    "WHERE approval_id = ? AND status = 'pending'",
+                    (approval_id,),
+                ).fetchone()
+                if row is None:
+                    continue
+                approval = PendingApproval.model_validate_json(row[0])
+                approval.status = "approved" if approved else "rejected"
+                approval.reason = None if approved else reason
+                self._conn.execute(
+                    "UPDATE approvals SET status = ?, data = ? WHERE approval_id = ?",
+                    (approval.status, approval.model_dump_json(), approval_id),
+                )
+                resolved[approval_id] = approval
+        return resolved
+
+    def expire(self, now: float | None = None) -> int:
+        """Marks the approvals past their deadline as expired and returns how many."""
+        now = time.time() if now is None else now
+        rows = self._conn.execute(
+            "SELECT data FROM approvals WHERE status = 'pending' AND expires_at <= ?",
+            (now,),
+        ).fetchall()
+        if not rows:
+            return 0
+        with self._conn:
+            self._conn.execute("BEGIN")
+            for (data,) in rows:
+                approval = PendingApproval.model_validate_json(data)
+                approval.status = "expired"
+                approval.reason = APPROVAL_TIMEOUT_REASON
+                self._conn.execute(
+                    "UPDATE approvals SET status = ?, data = ? WHERE approval_id = ?",
+                    (approval.status, approval.model_dump_json(), approval.approval_id),
+                )
+        return len(rows)
+
+    def ready_batches(
+        self, session_id: str | None = None, expired: bool = False
+    ) -> list[tuple[str, str]]:
+        """
+        The `(session_id, batch_id)` of the batches with every call decided or expired;
+        with `expired`, only those where some call expired.
+        """
+        self.expire()
+        query = "SELECT session_id, batch_id FROM approvals"
+        params: tuple = ()
+        if session_id is not None:
+            query += " WHERE session_id = ?"
+            params = (session_id,)
+        query += " GROUP BY session_id, batch_id HAVING SUM(status = 'pending') = 0"
+        if expired:
+            query += " AND SUM(status = 'expired') > 0"
+        return self._conn.execute(query, params).fetchall()
+
+    def take_batch(
+        self, session_id: str, batch_id: str
+    ) -> list[PendingApproval] | None:
+        """
+        Removes and returns the decided approvals of a batch, in the order they were
+        parked, or returns None while some of them are still pending.
+        """
+        self.expire()
+        with self._conn:
+            self._conn.execute("BEGIN")
+            rows = self._conn.execute(
+                "SELECT data FROM approvals "
+                "WHERE session_id = ? AND batch_id = ? ORDER BY rowid",
+                (session_id, batch_id),
+            ).fetchall()
+            approvals = [PendingApproval.model_validate_json(data) for (data,) in rows]
+            if not approvals or any(a.status == "pending" for a in approvals):
+                return None
+            self._conn.execute(
+                "DELETE FROM approvals WHERE session_id = ? AND batch_id = ?",
+                (session_id, batch_id),
+            )
+        return approvals
+
+    def cancel_session(self, session_id: str) -> list[PendingApproval]:
+        """
+        Removes every approval of `session_id`, e.g. when the user sends a new message
+        instead of answering. Approvals that were not decided yet are returned rejected.
+        """
+        with self._conn:
+            self._conn.execute("BEGIN")
+            rows = self._conn.execute(
+                "SELECT data FROM approvals WHERE session_id = ? ORDER BY rowid",
+                (session_id,),
+            ).fetchall()
+            self._conn.execute(
+                "DELETE FROM approvals WHERE session_id = ?", (session_id,)
+            )
+        approvals = [PendingApproval.model_validate_json(data) for (data,) in rows]
+        for approval in approvals:
+            if approval.status == "pending":
+                approval.status = "rejected"
+                approval.reason = APPROVAL_CANCELLED_REASON
+        return approvals
+
+    def close(self) -> None:
+        self._conn.close()
+
+    @staticmethod
+    def _row(approval: PendingApproval) -> tuple:
+        return (
+            approval.approval_id,
+            approval.session_id,
+            approval.batch_id,
+            approval.status,
+            approval.expires_at,
+            approval.model_dump_json(),
+        )
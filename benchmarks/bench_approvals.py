@@ -0,0 +1,167 @@
+"""
+Measures the memory held by sessions waiting on a tool approval: workflow runs kept
+open until an approval handler answers, turns parked in an `ApprovalBroker` with
+their contexts in memory, and parked turns whose contexts are evicted and restored
+from a checkpoint when the approval arrives. Python allocations are traced with
+`tracemalloc`; the broker and checkpoint databases are reported as disk usage.
+
+    python -m benchmarks.bench_approvals --sessions 10000
+"""
+
+import argparse
+import asyncio
+import gc
+import os
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+from approvals import ApprovalBroker
+from benchmarks.mock_llm import MockFunctionCallingLLM
+from benchmarks.stub_server import UserInfoStub
+from checkpoint import SQLiteCheckpointer
+from main import get_agent_configs, get_health_coach_tools
+from serving import SessionManager
+from workflow import AgentConfig, SystemAgent, ToolRequestEvent
+
+USER_MSG = "I want to start health coaching"
+
+
+def traced_memory() -> int:
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def disk_usage(directory: str) -> int:
+    for name in os.listdir(directory):
+        if name.endswith(".db"):
+            # fold the write-ahead log into the database file
+            with sqlite3.connect(os.path.join(directory, name)) as conn:
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return sum(
+        os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)
+    )
+
+
+def report(name: str, num_sessions: int, memory: int, elapsed: float, **extra) -> None:
+    print(
+        f"{name:<30}: {memory / num_sessions / 1024:6.1f}KiB/session "
+        f"({memory / 2**20:5.0f}MiB), resumed in {elapsed:5.1f}s"
+        + "".join(f", {key}={value}" for key, value in extra.items())
+    )
+
+
+def agent_configs(url: str) -> list[AgentConfig]:
+    agent_configs = get_agent_configs()
+    agent_configs[0].tools = get_health_coach_tools(user_info_url=url)
+    return agent_configs
+
+
+async def live_runs(args: argparse.Namespace, url: str) -> None:
+    """Every waiting session keeps its workflow run open until it is approved."""
+    approve = asyncio.Event()
+    waiting = 0
+
+    async def approval_handler(session_id: str, event: ToolRequestEvent) -> bool:
+        nonlocal waiting
+        waiting += 1
+        await approve.wait()
+        return True
+
+    manager = SessionManager(
+        SystemAgent(timeout=None),
+        agent_configs(url),
+        MockFunctionCallingLLM(),
+        max_concurrent_turns=args.sessions,
+        idle_timeout=None,
+        approval_handler=approval_handler,
+    )
+    baseline = traced_memory()
+    turns = [
+        asyncio.create_task(manager.chat(f"session-{i}", USER_MSG))
+        for i in range(args.sessions)
+    ]
+    while waiting < args.sessions:
+        await asyncio.sleep(0.1)
+    memory = traced_memory() - baseline
+    num_tasks = len(asyncio.all_tasks())
+
+    start = time.perf_counter()
+    approve.set()
+    await asyncio.gather(*turns)
+    report(
+        "live runs",
+        args.sessions,
+        memory,
+        time.perf_counter() - start,
+        tasks=num_tasks,
+    )
+    await manager.stop()
+
+
+async def parked_runs(args: argparse.Namespace, url: str, evict: bool) -> None:
+    """Waiting sessions are parked in the broker; with `evict`, only on disk."""
+    with tempfile.TemporaryDirectory() as tmp:
+        broker = ApprovalBroker(os.path.join(tmp, "approvals.db"))
+        checkpointer = SQLiteCheckpointer(os.path.join(tmp, "checkpoints.db"))
+        manager = SessionManager(
+            SystemAgent(
+                timeout=None, approval_broker=broker, checkpointer=checkpointer
+            ),
+            agent_configs(url),
+            MockFunctionCallingLLM(),
+            max_concurrent_turns=args.concurrency,
+            idle_timeout=None,
+        )
+        baseline = traced_memory()
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def park(session_id: str) -> None:
+            async with semaphore:
+                assert await manager.chat(session_id, USER_MSG) is None
+                if evict:
+                    manager.close_session(session_id)
+
+        session_ids = [f"session-{i}" for i in range(args.sessions)]
+        await asyncio.gather(*(park(session_id) for session_id in session_ids))
+        assert len(broker) == args.sessions
+        memory = traced_memory() - baseline
+        num_tasks = len(asyncio.all_tasks())
+        parked_on_disk = disk_usage(tmp)
+
+        # everyone answers at once: one batched decision per session
+        start = time.perf_counter()
+
+        async def approve(session_id: str) -> None:
+            async with semaphore:
+                assert await manager.resolve_approvals(session_id, True)
+
+        await asyncio.gather(*(approve(session_id) for session_id in session_ids))
+        report(
+            "parked, evicted to disk" if evict else "parked, contexts in memory",
+            args.sessions,
+            memory,
+            time.perf_counter() - start,
+            tasks=num_tasks,
+            disk=f"{parked_on_disk / args.sessions / 1024:.1f}KiB/session",
+        )
+        await manager.stop()
+        broker.close()
+        checkpointer.close()
+
+
+async def main(args: argparse.Namespace) -> None:
+    tracemalloc.start()
+    print(f"sessions={args.sessions} waiting on one tool approval each")
+    with UserInfoStub(latency=0) as stub:
+        await live_runs(args, stub.url)
+        await parked_runs(args, stub.url, evict=False)
+        await parked_runs(args, stub.url, evict=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=10_000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,188 @@
+"""
+Measures session checkpointing with `SQLiteCheckpointer` at 10k sessions: the stored
+size per session against pickling the conversation, the latency of the incremental
+checkpoint written after each step, and the latency of restoring a session into a
+fresh context after a restart.
+
+    python -m benchmarks.bench_checkpoint --sessions 10000 --turns 6
+"""
+
+import argparse
+import asyncio
+import os
+import pickle
+import random
+import sqlite3
+import tempfile
+import time
+
+from llama_index.core.llms import ChatMessage
+from llama_index.core.workflow import Context
+
+from benchmarks.stats import format_latencies
+from checkpoint import SQLiteCheckpointer, message_to_dict
+from conversation import ConversationStore
+from prompts import set_user_state
+from session_state import get_session_state
+from workflow import SystemAgent
+
+WORDS = (
+    "walk steps water sleep protein vegetables fruit sugar run stretch rest heart "
+    "rate calories breakfast dinner lunch plan goal week today tomorrow feel tired "
+    "energy weight height coach task progress habit morning evening"
+).split()
+
+
+def sentence(rng: random.Random, num_words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(num_words)).capitalize() + "."
+
+
+def turn_steps(rng: random.Random, session: int, turn: int) -> list[list[ChatMessage]]:
+    """The messages a turn appends, grouped by the workflow step that appends them."""
+    tool_id = f"call_{session}_{turn}"
+    return [
+        [ChatMessage(role="user", content=sentence(rng, 25))],
+        [
+            ChatMessage(
+                role="assistant",
+                content=None,
+                additional_kwargs={
+                    "tool_calls": [
+                        {
+                            "id": tool_id,
+                            "type": "function",
+                            "function": {
+                                "name": "get_user_information",
+                                "arguments": "{}",
+                            },
+                        }
+                    ]
+                },
+            )
+        ],
+        [
+            ChatMessage(
+                role="tool",
+                content=sentence(rng, 40),
+                additional_kwargs={
+                    "name": "get_user_information",
+                    "tool_call_id": tool_id,
+                },
+            )
+        ],
+        [ChatMessage(role="assistant", content=sentence(rng, 80))],
+    ]
+
+
+async def write_sessions(
+    args: argparse.Namespace, workflow: SystemAgent, checkpointer: SQLiteCheckpointer
+) -> tuple[list[float], list[int], list[int]]:
+    rng = random.Random(0)
+    save_latencies, step_bytes, pickled_sizes = [], [], []
+    for session in range(args.sessions):
+        session_id = f"session-{session}"
+        ctx = Context(workflow)
+        conversation = ConversationStore()
+        state = await get_session_state(ctx)
+        state.conversation = conversation
+        state.set_active_speaker("Health Coach Agent")
+        await set_user_state(
+            ctx,
+            {
+                "user_persona": {"age": 20 + session % 50, "weight": 70, "height": 180},
+                "user_tasks": ["Walk 1000 steps everyday", "Eat more vegetables"],
+            },
+        )
+        for turn in range(args.turns):
+            steps = turn_steps(rng, session, turn)
+            for i, messages in enumerate(steps):
+                for message in messages:
+                    if i == 0:
+                        conversation.begin_turn(message)
+                    else:
+                        conversation.append(message)
+                start = time.perf_counter()
+                written = await checkpointer.save(
+                    ctx, session_id, turn_complete=i == len(steps) - 1
+                )
+                save_latencies.append(time.perf_counter() - start)
+                step_bytes.append(written)
+        pickled_sizes.append(
+            len(pickle.dumps([message_to_dict(m) for m in conversation.messages]))
+        )
+    return save_latencies, step_bytes, pickled_sizes
+
+
+async def restore_sessions(
+    args: argparse.Namespace, workflow: SystemAgent, checkpointer: SQLiteCheckpointer
+) -> list[float]:
+    rng = random.Random(1)
+    latencies = []
+    for session in rng.sample(range(args.sessions), min(args.restores, args.sessions)):
+        ctx = Context(workflow)
+        start = time.perf_counter()
+        assert await checkpointer.restore(ctx, f"session-{session}")
+        latencies.append(time.perf_counter() - start)
+        conversation = (await get_session_state(ctx)).conversation
+        assert len(conversation) == 4 * args.turns
+    return latencies
+
+
+async def main(args: argparse.Namespace) -> None:
+    workflow = SystemAgent()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "checkpoints.db")
+
+        checkpointer = SQLiteCheckpointer(path)
+        start = time.perf_counter()
+        save_latencies, step_bytes, pickled_sizes = await write_sessions(
+            args, workflow, checkpointer
+        )
+        elapsed = time.perf_counter() - start
+        checkpointer.close()
+
+        db_size = sum(
+            os.path.getsize(os.path.join(tmp, name)) for name in os.listdir(tmp)
+        )
+        with sqlite3.connect(path) as conn:
+            stored = sum(
+                conn.execute(f"SELECT SUM(LENGTH({column})) FROM {table}").fetchone()[0]
+                for table, column in [("messages", "data"), ("sessions", "head")]
+            )
+        # a worker restart: nothing in memory, every session read back from disk
+        checkpointer = SQLiteCheckpointer(path)
+        restore_latencies = await restore_sessions(args, workflow, checkpointer)
+        checkpointer.close()
+
+    pickled = sum(pickled_sizes) / len(pickled_sizes)
+    stored /= args.sessions
+    print(
+        f"sessions={args.sessions} turns={args.turns} "
+        f"messages/session={4 * args.turns} checkpoints={len(save_latencies)}"
+    )
+    print(f"pickled conversation / session : {pickled / 1024:7.1f}KiB")
+    print(
+        f"checkpoint / session           : {stored / 1024:7.1f}KiB "
+        f"({pickled / stored:.1f}x smaller)"
+    )
+    print(
+        f"database file / session        : {db_size / args.sessions / 1024:7.1f}KiB "
+        f"({db_size / 2**20:.0f}MiB total)"
+    )
+    print(
+        f"bytes written per step         : {sum(step_bytes) / len(step_bytes):7.0f}B "
+        f"(rewriting the whole checkpoint: {stored / 2:.0f}B on average)"
+    )
+    print(
+        f"checkpoint per step            : {format_latencies(save_latencies)} "
+        f"({len(save_latencies) / elapsed:.0f}/s)"
+    )
+    print(f"restore after restart          : {format_latencies(restore_latencies)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=10_000)
+    parser.add_argument("--turns", type=int, default=6)
+    parser.add_argument("--restores", type=int, default=1_000)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,82 @@
+"""
+Measures how many upstream LLM calls request coalescing saves under load. Sessions
+arrive at random (Poisson) times; every one opens with the same greeting, so their
+orchestrator and sub-agent prompts are byte-identical, then asks its own question.
+The same load is run with coalescing off, on, and on with a temperature-0 response
+cache, and the LLM calls, coalescing ratio and turn latency are reported.
+
+    python -m benchmarks.bench_coalescing --sessions 2000 --rate 500
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks.mock_llm import MockFunctionCallingLLM
+from benchmarks.stats import format_latencies
+from cache import LRUCache
+from llm_gateway import LLMGateway
+from main import get_agent_configs
+from serving import SessionManager
+from workflow import SystemAgent
+
+
+async def run(name: str, args: argparse.Namespace, gateway: LLMGateway) -> None:
+    llm = MockFunctionCallingLLM(latency=args.llm_latency, jitter=args.llm_latency / 4)
+    workflow = SystemAgent(timeout=None, stream=args.stream, llm_gateway=gateway)
+    rng = random.Random(0)
+    first_turn: list[float] = []
+    other_turns: list[float] = []
+
+    async def session(i: int) -> None:
+        for turn, user_msg in enumerate(
+            ["Hello!", f"Is eating {i} apples a week healthy?"]
+        ):
+            start = time.perf_counter()
+            await manager.chat(f"session-{i}", user_msg)
+            (other_turns if turn else first_turn).append(time.perf_counter() - start)
+        manager.close_session(f"session-{i}")
+
+    async with SessionManager(workflow, get_agent_configs(), llm) as manager:
+        start = time.perf_counter()
+        sessions = []
+        for i in range(args.sessions):
+            sessions.append(asyncio.create_task(session(i)))
+            await asyncio.sleep(rng.expovariate(args.rate))
+        await asyncio.gather(*sessions)
+        elapsed = time.perf_counter() - start
+
+    stats = gateway.stats()
+    print(
+        f"{name:<20}: llm calls={llm.num_calls:5d} "
+        f"({llm.num_calls / stats['requests']:.2f}/request), "
+        f"coalescing ratio={stats['coalescing_ratio']:.2f}, "
+        f"cache hits={stats['cache_hits']:4d}, {elapsed:.1f}s"
+    )
+    print(f"{'':<20}  first turn  {format_latencies(first_turn)}")
+    print(f"{'':<20}  second turn {format_latencies(other_turns)}")
+
+
+async def main(args: argparse.Namespace) -> None:
+    print(
+        f"sessions={args.sessions} arriving at {args.rate:.0f}/s, "
+        f"llm latency={args.llm_latency * 1000:.0f}ms, stream={args.stream}"
+    )
+    await run("no coalescing", args, LLMGateway(coalesce=False))
+    await run("coalescing", args, LLMGateway())
+    await run(
+        "coalescing + cache",
+        args,
+        LLMGateway(response_cache=LRUCache(max_size=1024, ttl=args.cache_ttl)),
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=500.0)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--cache-ttl", type=float, default=60.0)
+    parser.add_argument("--stream", action="store_true")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,96 @@
+"""
+Compares the latency of a question spanning two agents answered with a fan-out, in
+one turn, against the serial path, where the user asks each agent in its own turn
+and the second question goes through a transfer.
+
+    python -m benchmarks.bench_fan_out --sessions 50 --llm-latency 0.3
+"""
+
+import argparse
+import asyncio
+import time
+
+from llama_index.core.workflow import Context
+
+from benchmarks.mock_llm import DEFAULT_ROUTES, MockFunctionCallingLLM
+from benchmarks.stats import format_latencies
+from benchmarks.stub_server import UserInfoStub
+from fanout import FanOutPolicy
+from main import get_agent_configs, get_health_coach_tools
+from scheduler import ToolPolicy
+from workflow import AgentConfig, SystemAgent
+
+ROUTES = {**DEFAULT_ROUTES, "vitamin": "Information Agent"}
+SERIAL_TURNS = ["Can you coach me?", "Tell me about vitamin D."]
+FAN_OUT_TURNS = ["Can you coach me and tell me about vitamin D?"]
+
+
+async def run_session(
+    workflow: SystemAgent,
+    llm: MockFunctionCallingLLM,
+    agent_configs: list[AgentConfig],
+    turns: list[str],
+    session: int,
+) -> float:
+    """Time until the user has the answers to all `turns`."""
+    ctx = Context(workflow)
+    start = time.perf_counter()
+    for user_msg in turns:
+        # distinct messages, so the gateway does not coalesce the sessions' calls
+        await workflow.run(
+            ctx=ctx,
+            user_msg=f"{user_msg} ({session})",
+            agent_configs=agent_configs,
+            llm=llm,
+        )
+    return time.perf_counter() - start
+
+
+async def main(args: argparse.Namespace) -> None:
+    with UserInfoStub(latency=args.tool_latency) as stub:
+        agent_configs = get_agent_configs()
+        agent_configs[0].tools = get_health_coach_tools(user_info_url=stub.url)
+        # fan-out branches cannot ask for approval
+        agent_configs[0].tool_policies = {
+            "get_user_information": ToolPolicy(auto_approve=True)
+        }
+        print(
+            f"sessions={args.sessions} llm latency={args.llm_latency * 1000:.0f}ms "
+            f"tool latency={args.tool_latency * 1000:.0f}ms merge={args.merge}"
+        )
+        modes = [
+            ("serial", None, SERIAL_TURNS),
+            (
+                "fan-out",
+                FanOutPolicy(
+                    merge=args.merge,
+                    max_concurrent_branches=args.max_concurrent_branches,
+                ),
+                FAN_OUT_TURNS,
+            ),
+        ]
+        for label, fan_out, turns in modes:
+            llm = MockFunctionCallingLLM(latency=args.llm_latency, routes=ROUTES)
+            workflow = SystemAgent(timeout=None, fan_out=fan_out)
+            latencies = await asyncio.gather(
+                *[
+                    run_session(workflow, llm, agent_configs, turns, session)
+                    for session in range(args.sessions)
+                ]
+            )
+            await workflow.aclose()
+            print(
+                f"{label:<8} turns={len(turns)} "
+                f"llm calls/session={llm.num_calls / args.sessions:.1f} "
+                f"{format_latencies(latencies)}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--tool-latency", type=float, default=0.1)
+    parser.add_argument("--merge", choices=["llm", "concat"], default="llm")
+    parser.add_argument("--max-concurrent-branches", type=int, default=None)
+    asyncio.run(main(parser.parse_args()))
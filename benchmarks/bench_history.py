@@ -0,0 +1,68 @@
+"""
+Runs a long synthetic conversation through `SystemAgent` with and without a
+`HistoryManager` and compares prompt tokens and turn latency as the history grows.
+
+    python -m benchmarks.bench_history --turns 200 --token-budget 2000
+"""
+
+import argparse
+import asyncio
+import time
+
+from benchmarks.mock_llm import MockFunctionCallingLLM
+from history import HistoryManager
+from main import get_agent_configs
+from serving import SessionManager
+from workflow import SystemAgent
+
+TOPICS = ["sleep", "hydration", "walking", "vegetables", "stretching", "stress"]
+
+
+async def run_conversation(
+    num_turns: int, history_manager: HistoryManager | None
+) -> tuple[MockFunctionCallingLLM, list[float], list[int]]:
+    llm = MockFunctionCallingLLM(
+        latency=0.005, prefill_latency=0.00002, answer_words=80
+    )
+    workflow = SystemAgent(timeout=None, history_manager=history_manager)
+    latencies = []
+    calls_per_turn = []
+    async with SessionManager(workflow, get_agent_configs(), llm) as manager:
+        for i in range(num_turns):
+            topic = TOPICS[i % len(TOPICS)]
+            num_calls = len(llm.prompt_tokens)
+            start = time.perf_counter()
+            await manager.chat("session", f"Turn {i}: tell me more about {topic}.")
+            latencies.append(time.perf_counter() - start)
+            calls_per_turn.append(len(llm.prompt_tokens) - num_calls)
+    return llm, latencies, calls_per_turn
+
+
+def mean(values: list[float]) -> float:
+    return sum(values) / len(values) if values else 0.0
+
+
+async def main(num_turns: int, token_budget: int) -> None:
+    print(f"turns={num_turns} token budget={token_budget}")
+    for name, history_manager in [
+        ("unbounded history", None),
+        ("history manager", HistoryManager(token_budget=token_budget)),
+    ]:
+        llm, latencies, calls_per_turn = await run_conversation(
+            num_turns, history_manager
+        )
+        tail = llm.prompt_tokens[-sum(calls_per_turn[-10:]) :]
+        print(
+            f"{name:<18} total prompt tokens={sum(llm.prompt_tokens):<9} "
+            f"prompt tokens/call (last 10 turns)={mean(tail):<8.0f} "
+            f"turn latency first 10={mean(latencies[:10]) * 1000:.1f}ms "
+            f"last 10={mean(latencies[-10:]) * 1000:.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--token-budget", type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(main(args.turns, args.token_budget))
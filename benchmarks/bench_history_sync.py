@@ -0,0 +1,78 @@
+"""
+Per-turn host-side cost of keeping the conversation in sync, as the history grows:
+the old `main.py` loop over `ChatMemoryBuffer` versus the `ConversationStore` delta log.
+
+    python -m benchmarks.bench_history_sync
+"""
+
+import argparse
+import time
+
+from llama_index.core.llms import ChatMessage
+from llama_index.core.memory import ChatMemoryBuffer
+
+from conversation import ConversationStore
+
+
+def make_messages(num_messages: int) -> list[ChatMessage]:
+    return [
+        ChatMessage(
+            role="user" if i % 2 == 0 else "assistant",
+            content=f"message {i} about healthy habits and daily routines",
+        )
+        for i in range(num_messages)
+    ]
+
+
+def legacy_turn(memory: ChatMemoryBuffer, chat_history: list[ChatMessage]) -> None:
+    """What `main.py` did after every turn: re-scan the history, then re-send it."""
+    for i, msg in enumerate(chat_history):
+        if i >= len(memory.get()):
+            memory.put(msg)
+    memory.get()
+
+
+def legacy_cost(history_length: int) -> float:
+    memory = ChatMemoryBuffer.from_defaults(token_limit=10_000_000)
+    chat_history = make_messages(history_length)
+    memory.set(list(chat_history))
+    chat_history += make_messages(2)
+
+    start = time.perf_counter()
+    legacy_turn(memory, chat_history)
+    return time.perf_counter() - start
+
+
+def store_cost(history_length: int, num_turns: int = 1000) -> float:
+    conversation = ConversationStore(make_messages(history_length))
+    user_msg, response = make_messages(2)
+
+    start = time.perf_counter()
+    for _ in range(num_turns):
+        conversation.begin_turn(user_msg)
+        conversation.append(response)
+        conversation.turn_delta()
+        conversation.snapshot()
+    return (time.perf_counter() - start) / num_turns
+
+
+def main(history_lengths: list[int], legacy_max: int) -> None:
+    print(f"{'history':>8} {'legacy sync/turn':>18} {'ConversationStore/turn':>24}")
+    for history_length in history_lengths:
+        legacy = (
+            f"{legacy_cost(history_length) * 1e3:.2f}ms"
+            if history_length <= legacy_max
+            else "skipped"
+        )
+        store = f"{store_cost(history_length) * 1e6:.2f}us"
+        print(f"{history_length:>8} {legacy:>18} {store:>24}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--history-lengths", type=int, nargs="+", default=[10, 100, 400, 1000, 10_000]
+    )
+    parser.add_argument("--legacy-max", type=int, default=400)
+    args = parser.parse_args()
+    main(args.history_lengths, args.legacy_max)
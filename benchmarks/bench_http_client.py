@@ -0,0 +1,74 @@
+"""
+Compares concurrent user-info lookups made through a blocking `requests.get` call
+against the workflow's pooled `AsyncHttpClient`.
+
+    python -m benchmarks.bench_http_client --sessions 50 --latency 0.1
+"""
+
+import argparse
+import asyncio
+import time
+
+import requests
+from llama_index.core.workflow import Context
+
+from benchmarks.stub_server import UserInfoStub
+from main import get_health_coach_tools
+from utils import FunctionToolWithContext
+from workflow import SystemAgent
+
+
+def get_blocking_tool(user_info_url: str) -> FunctionToolWithContext:
+    async def get_user_information(ctx: Context) -> str:
+        """Get the user information from API"""
+        user_info = requests.get(user_info_url).json()
+        user_state = await ctx.get("user_state")
+        user_state["user_persona"] = user_info["user_persona"]
+        user_state["user_tasks"] = user_info["user_tasks"]
+        await ctx.set("user_state", user_state)
+        return f"The user information is {user_state['user_persona']}."
+
+    return FunctionToolWithContext.from_defaults(async_fn=get_user_information)
+
+
+async def run_sessions(
+    workflow: SystemAgent, tool: FunctionToolWithContext, num_sessions: int
+) -> float:
+    contexts = [Context(workflow) for _ in range(num_sessions)]
+    for ctx in contexts:
+        await ctx.set("user_state", {})
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *[tool.acall(ctx, http=workflow.http_client) for ctx in contexts]
+    )
+    return time.perf_counter() - start
+
+
+async def main(num_sessions: int, latency: float) -> None:
+    workflow = SystemAgent(timeout=None)
+
+    with UserInfoStub(latency=latency) as stub:
+        blocking = await run_sessions(
+            workflow, get_blocking_tool(stub.url), num_sessions
+        )
+        pooled_tool = get_health_coach_tools(user_info_url=stub.url)[0]
+        # the first round opens the pooled connections, the second reuses them
+        cold = await run_sessions(workflow, pooled_tool, num_sessions)
+        warm = await run_sessions(workflow, pooled_tool, num_sessions)
+
+    await workflow.aclose()
+
+    print(f"sessions={num_sessions} stub latency={latency * 1000:.0f}ms")
+    print(f"blocking requests.get : {blocking:.3f}s")
+    print(f"AsyncHttpClient (cold): {cold:.3f}s")
+    print(f"AsyncHttpClient (warm): {warm:.3f}s")
+    print(f"speedup (warm)        : {blocking / warm:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.1)
+    args = parser.parse_args()
+    asyncio.run(main(args.sessions, args.latency))
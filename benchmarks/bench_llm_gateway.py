@@ -0,0 +1,160 @@
+"""
+Measures LLM calls against a mock provider that, like a real one under load, answers
+429 beyond its concurrency limit, fails a share of calls with a 503 and has a slow
+tail. Calls made directly are compared with calls through an `LLMGateway` that only
+retries, that also caps concurrency at the provider limit, and that also hedges slow
+calls; then a session flooding the gateway is run next to light sessions, with the
+fair queue and with a single FIFO queue.
+
+    python -m benchmarks.bench_llm_gateway --sessions 200 --requests 5
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Hashable
+
+from llama_index.core.llms import ChatMessage
+
+from benchmarks.mock_llm import MockFunctionCallingLLM
+from benchmarks.stats import format_latencies
+from llm_gateway import LLMGateway
+
+
+def mock_provider(args: argparse.Namespace) -> MockFunctionCallingLLM:
+    return MockFunctionCallingLLM(
+        latency=args.latency,
+        jitter=args.latency / 4,
+        tail_probability=args.tail_probability,
+        tail_latency=args.tail_latency,
+        max_concurrency=args.provider_concurrency,
+        error_rate=args.error_rate,
+        error_latency=0.02,
+    )
+
+
+async def call(
+    llm: MockFunctionCallingLLM, gateway: LLMGateway | None, session: Hashable
+) -> None:
+    chat_history = [ChatMessage(role="user", content=f"How are you, {session}?")]
+    if gateway is None:
+        await llm.achat_with_tools([], chat_history=chat_history)
+    else:
+        await gateway.achat_with_tools(llm, [], chat_history, session=session)
+
+
+async def run_sessions(
+    name: str,
+    args: argparse.Namespace,
+    num_sessions: int,
+    gateway: LLMGateway | None,
+) -> None:
+    """Each session sends `--requests` calls one after the other."""
+    llm = mock_provider(args)
+    latencies: list[float] = []
+    failed = 0
+
+    async def session(i: int) -> None:
+        nonlocal failed
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            try:
+                await call(llm, gateway, f"session-{i}")
+            except Exception:
+                failed += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(session(i) for i in range(num_sessions)))
+    elapsed = time.perf_counter() - start
+    stats = gateway.stats() if gateway is not None else {}
+    print(
+        f"{name:<28}: {len(latencies) / elapsed:6.1f} ok/s, failed={failed:4d}, "
+        f"429s={llm.errors[429]:5d}, 503s={llm.errors[503]:3d}, "
+        f"retries={stats.get('retries', 0):5d}, "
+        f"hedged={stats.get('hedged', 0)}/{stats.get('hedges_won', 0)} won, "
+        f"{format_latencies(latencies)}"
+    )
+
+
+async def run_flood(args: argparse.Namespace, fair: bool) -> None:
+    """One session sends a burst of calls at once while light sessions chat."""
+    llm = mock_provider(args)
+    gateway = LLMGateway(max_concurrency=args.provider_concurrency)
+    light_latencies: list[float] = []
+
+    async def light_session(i: int) -> None:
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            await call(llm, gateway, f"light-{i}" if fair else None)
+            light_latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    flood = [call(llm, gateway, "heavy" if fair else None) for _ in range(args.flood)]
+    # the light sessions arrive right after the burst is queued
+    await asyncio.gather(
+        *flood, *(light_session(i) for i in range(args.light_sessions))
+    )
+    print(
+        f"{'flood, fair queue' if fair else 'flood, FIFO queue':<28}: "
+        f"light sessions {format_latencies(light_latencies)}, "
+        f"all done in {time.perf_counter() - start:.1f}s"
+    )
+
+
+def gateways(args: argparse.Namespace) -> dict[str, LLMGateway | None]:
+    return {
+        "direct": None,
+        "gateway, retries": LLMGateway(max_retries=args.max_retries),
+        "gateway, limit + retries": LLMGateway(
+            max_concurrency=args.provider_concurrency, max_retries=args.max_retries
+        ),
+        "gateway, limit + hedging": LLMGateway(
+            max_concurrency=args.provider_concurrency,
+            max_retries=args.max_retries,
+            hedge_quantile=0.95,
+        ),
+    }
+
+
+async def main(args: argparse.Namespace) -> None:
+    print(
+        f"provider: concurrency limit {args.provider_concurrency}, "
+        f"latency {args.latency * 1000:.0f}ms, "
+        f"{args.tail_probability:.0%} of calls +{args.tail_latency:.1f}s, "
+        f"{args.error_rate:.0%} 503s"
+    )
+    print(f"saturated: {args.sessions} sessions x {args.requests} requests")
+    for name, gateway in gateways(args).items():
+        await run_sessions(name, args, args.sessions, gateway)
+
+    # hedges only run on spare capacity, so they pay off below saturation
+    light = args.provider_concurrency // 2
+    print(f"below saturation: {light} sessions x {args.requests * 4} requests")
+    args.requests *= 4
+    for name, gateway in list(gateways(args).items())[2:]:
+        await run_sessions(name, args, light, gateway)
+    args.requests //= 4
+
+    print(
+        f"flood: 1 session x {args.flood} requests at once, "
+        f"{args.light_sessions} sessions x {args.requests} requests"
+    )
+    await run_flood(args, fair=False)
+    await run_flood(args, fair=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=5)
+    parser.add_argument("--provider-concurrency", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--tail-probability", type=float, default=0.02)
+    parser.add_argument("--tail-latency", type=float, default=2.0)
+    parser.add_argument("--error-rate", type=float, default=0.01)
+    parser.add_argument("--max-retries", type=int, default=5)
+    parser.add_argument("--flood", type=int, default=300)
+    parser.add_argument("--light-sessions", type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,90 @@
+"""
+Replays the conversations of `benchmarks/traces.json` with the Health Coach Agent
+answering with its coaching JSON, a `--malformed-rate` share of it malformed, once
+without and once with the agent's output schema, and counts the answers a client
+parsing the JSON would reject, i.e. the full turns it would retry.
+
+    python -m benchmarks.bench_output_repair --malformed-rate 0.2 --llm-latency 0.3
+"""
+
+import argparse
+import asyncio
+import random
+
+from benchmarks.replay import TRACES_PATH, Replay
+from benchmarks.stats import format_latencies
+from benchmarks.stub_server import UserInfoStub
+
+
+async def run(args: argparse.Namespace, url: str) -> Replay:
+    random.seed(0)
+    replay = Replay(args, url)
+    await replay.run(args.sessions, args.concurrency)
+    await replay.manager.stop()
+    return replay
+
+
+async def main(args: argparse.Namespace) -> None:
+    print(
+        f"sessions={args.sessions} llm latency={args.llm_latency * 1000:.0f}ms "
+        f"malformed rate={args.malformed_rate:.0%}"
+    )
+    rejected = {}
+    with UserInfoStub(latency=args.tool_latency) as stub:
+        for validate in (False, True):
+            setup = argparse.Namespace(
+                **{**vars(args), "no_output_schema": not validate}
+            )
+            replay = await run(setup, stub.url)
+            rejected[validate] = replay.invalid_outputs
+            latencies = [x for values in replay.latencies.values() for x in values]
+            print(f"{'output schema' if validate else 'no validation'}:")
+            print(
+                f"  coaching JSON answers={replay.structured_outputs} "
+                f"rejected by the client={replay.invalid_outputs} "
+                f"({replay.invalid_outputs / replay.structured_outputs:.1%})"
+            )
+            print(
+                f"  health_coaching turns {format_latencies(replay.latencies['health_coaching'])}"
+            )
+            print(
+                f"  all turns {format_latencies(latencies)}, "
+                f"llm calls per turn={replay.num_calls / replay.num_turns:.3f}, "
+                f"prompt tokens per turn={replay.prompt_tokens / replay.num_turns:.0f}"
+            )
+            if replay.output_schema is not None:
+                stats = replay.output_schema.stats()
+                print(
+                    f"  checked={stats['checked']} valid={stats['valid']} "
+                    f"repaired locally={stats['repaired_locally']} "
+                    f"by the LLM={stats['repaired_by_llm']} failed={stats['failed']} "
+                    f"repair rate={stats['repair_rate']:.1%}"
+                )
+                print(
+                    "  repairs: "
+                    + ", ".join(
+                        f"{key.removeprefix('repair: ')}={value}"
+                        for key, value in sorted(stats.items())
+                        if key.startswith("repair: ")
+                    )
+                )
+    print(f"full-turn retries avoided: {rejected[False] - rejected[True]}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--malformed-rate", type=float, default=0.2)
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    parser.add_argument("--tool-latency", type=float, default=0.0)
+    parser.add_argument("--traces", default=TRACES_PATH)
+    # the replay's other setups
+    parser.set_defaults(
+        speculate=0,
+        speculation_tpm=None,
+        no_sticky=False,
+        tiered=False,
+    )
+    asyncio.run(main(parser.parse_args()))
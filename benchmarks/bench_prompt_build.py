@@ -0,0 +1,106 @@
+"""
+Measures the per-turn CPU overhead of building the sub-agent and orchestrator LLM
+inputs, up to the request payload the OpenAI integration sends, with the previous
+per-turn construction and with the precompiled `AgentConfig` prompts and tool specs.
+
+    python -m benchmarks.bench_prompt_build --turns 2000
+"""
+
+import argparse
+import asyncio
+import time
+
+from llama_index.core.llms import ChatMessage
+from llama_index.core.program.function_program import get_function_tool
+from llama_index.core.workflow import Context
+from llama_index.llms.openai import OpenAI
+
+from main import get_agent_configs
+from prompts import get_user_state_prompt, set_user_state
+from workflow import DEFAULT_ORCHESTRATOR_PROMPT, SystemAgent, TransferToAgent
+
+USER_STATE = {
+    "user_persona": {"age": 25, "weight": 70, "height": 180},
+    "user_tasks": ["Walk 1000 steps everyday", "Eat more green vegetables"],
+}
+
+
+def legacy_turn(llm: OpenAI, agent_configs: dict, user_state: dict) -> None:
+    """The per-turn prompt and tool construction before precompilation."""
+    agent_config = agent_configs["Health Coach Agent"]
+    user_state_str = "\n".join([f"{k}: {v}" for k, v in user_state.items()])
+    system_prompt = (
+        agent_config.system_prompt.strip()
+        + f"\n\nHere is the current user state:\n{user_state_str}"
+    )
+    llm._prepare_chat_with_tools(
+        agent_config.tools,
+        chat_history=[ChatMessage(role="system", content=system_prompt)],
+    )
+
+    agent_context_str = ""
+    for agent_name, agent_config in agent_configs.items():
+        agent_context_str += f"{agent_name}: {agent_config.description}\n"
+    system_prompt = DEFAULT_ORCHESTRATOR_PROMPT.format(
+        agent_context_str=agent_context_str, user_state_str=user_state_str
+    )
+    llm._prepare_chat_with_tools(
+        [get_function_tool(TransferToAgent)],
+        chat_history=[ChatMessage(role="system", content=system_prompt)],
+    )
+
+
+async def compiled_turn(
+    workflow: SystemAgent, ctx: Context, llm: OpenAI, agent_configs: dict
+) -> None:
+    """The same construction with precompiled prompts and tool specs."""
+    agent_config = agent_configs["Health Coach Agent"]
+    state_prompt = await get_user_state_prompt(ctx)
+    llm._prepare_chat_with_tools(
+        agent_config.tools,
+        chat_history=[
+            ChatMessage(role="system", content=agent_config.static_system_prompt),
+            ChatMessage(role="system", content=state_prompt),
+        ],
+    )
+
+    user_state = await ctx.get("user_state")
+    system_prompt = workflow._get_orchestrator_prompt(agent_configs).format(
+        "\n".join(f"{k}: {v}" for k, v in user_state.items())
+    )
+    llm._prepare_chat_with_tools(
+        [workflow._transfer_tool],
+        chat_history=[ChatMessage(role="system", content=system_prompt)],
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    llm = OpenAI(model="gpt-4o", api_key="sk-benchmark")
+    workflow = SystemAgent()
+
+    agent_configs = {ac.name: ac for ac in get_agent_configs()}
+    start = time.perf_counter()
+    for _ in range(args.turns):
+        legacy_turn(llm, agent_configs, USER_STATE)
+    legacy = (time.perf_counter() - start) / args.turns
+
+    agent_configs = {ac.name: ac.compile() for ac in get_agent_configs()}
+    ctx = Context(workflow)
+    await set_user_state(ctx, dict(USER_STATE))
+    start = time.perf_counter()
+    for turn in range(args.turns):
+        if args.state_change_every and turn % args.state_change_every == 0:
+            await set_user_state(ctx, {**USER_STATE, "turn": turn})
+        await compiled_turn(workflow, ctx, llm, agent_configs)
+    compiled = (time.perf_counter() - start) / args.turns
+
+    print(f"turns={args.turns} state change every {args.state_change_every} turns")
+    print(f"per turn, rebuilt    : {legacy * 1e6:8.1f}us")
+    print(f"per turn, precompiled: {compiled * 1e6:8.1f}us ({legacy / compiled:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=2000)
+    parser.add_argument("--state-change-every", type=int, default=10)
+    asyncio.run(main(parser.parse_args()))
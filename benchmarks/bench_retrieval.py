@@ -0,0 +1,169 @@
+"""
+Reports indexing throughput and query latency of the retrieval tools on a synthetic
+corpus, 100k chunks by default, with the offline `HashingEmbedding`.
+
+Also reports how long the event loop stalls while queries run, with the search
+offloaded by the `Retriever` and with the same search run inline on the loop.
+
+    python -m benchmarks.bench_retrieval --chunks 100000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.stats import format_latencies
+from retrieval import (
+    HashingEmbedding,
+    Retriever,
+    VectorIndex,
+    chunk_text,
+    ingest,
+    load_retriever,
+)
+
+CHUNK_SIZE = 128
+CHUNK_OVERLAP = 16
+CHUNKS_PER_DOCUMENT = 10
+TOPIC_WORDS = 20
+# share of the words of a document drawn from its topic
+TOPIC_SHARE = 0.3
+
+
+def make_corpus(
+    num_chunks: int, num_topics: int, seed: int = 0
+) -> tuple[list[tuple[str, str]], list[list[str]]]:
+    """Documents of random common words mixed with the words of their topic."""
+    rng = random.Random(seed)
+    syllables = ["ba", "ko", "mi", "ra", "te", "lu", "so", "vi", "ne", "da", "po", "fe"]
+
+    def word() -> str:
+        return "".join(rng.choices(syllables, k=rng.randint(2, 4)))
+
+    common = [word() for _ in range(5000)]
+    topics = [[word() + "x" for _ in range(TOPIC_WORDS)] for _ in range(num_topics)]
+    num_words = (CHUNK_SIZE - CHUNK_OVERLAP) * CHUNKS_PER_DOCUMENT + CHUNK_OVERLAP
+    documents = []
+    for doc in range(max(1, num_chunks // CHUNKS_PER_DOCUMENT)):
+        topic = topics[doc % num_topics]
+        words = [
+            rng.choice(topic) if rng.random() < TOPIC_SHARE else rng.choice(common)
+            for _ in range(num_words)
+        ]
+        documents.append((f"topic-{doc % num_topics}/doc-{doc}.txt", " ".join(words)))
+    return documents, topics
+
+
+def make_queries(topics: list[list[str]], num_queries: int) -> list[tuple[int, str]]:
+    rng = random.Random(1)
+    queries = []
+    for _ in range(num_queries):
+        topic = rng.randrange(len(topics))
+        queries.append((topic, "what about " + " ".join(rng.sample(topics[topic], 3))))
+    return queries
+
+
+async def timed_queries(
+    retriever: Retriever, queries: list[tuple[int, str]]
+) -> tuple[list[float], float]:
+    """Latencies of sequential queries, and the share whose best chunk is on topic."""
+    latencies, correct = [], 0
+    for topic, query in queries:
+        start = time.perf_counter()
+        chunks = await retriever.aretrieve(query)
+        latencies.append(time.perf_counter() - start)
+        correct += bool(chunks) and chunks[0].source.startswith(f"topic-{topic}/")
+    return latencies, correct / len(queries)
+
+
+async def loop_lag(run_queries) -> float:
+    """The longest stall of a 1ms ticker while `run_queries` runs."""
+    lags = []
+    done = False
+
+    async def ticker() -> None:
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - start - 0.001)
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+    await run_queries()
+    done = True
+    await task
+    return max(lags)
+
+
+async def main(args: argparse.Namespace) -> None:
+    documents, topics = make_corpus(args.chunks, args.topics)
+    queries = make_queries(topics, args.queries)
+    num_chunks = sum(
+        len(chunk_text(text, CHUNK_SIZE, CHUNK_OVERLAP)) for _, text in documents
+    )
+
+    with tempfile.TemporaryDirectory() as path:
+        embed_model = HashingEmbedding(dim=args.dim)
+        index = VectorIndex.create(path, args.dim, embed_model.model_name)
+        start = time.perf_counter()
+        added = await ingest(
+            documents,
+            index,
+            embed_model,
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+            batch_size=args.batch_size,
+        )
+        elapsed = time.perf_counter() - start
+        assert added == num_chunks == len(index)
+        size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+        print(f"chunks={added} dim={args.dim} batch size={args.batch_size}")
+        print(
+            f"indexing       : {elapsed:.1f}s, {added / elapsed:,.0f} chunks/s, "
+            f"{size / 2**20:.0f}MiB on disk"
+        )
+
+        start = time.perf_counter()
+        retriever = load_retriever(path, top_k=args.top_k)
+        opened = time.perf_counter() - start
+        latencies, accuracy = await timed_queries(retriever, queries)
+        print(f"open (mmap)    : {opened * 1000:.2f}ms")
+        print(f"query, uncached: {format_latencies(latencies)}")
+        print(f"top-1 on topic : {accuracy:.1%}")
+        latencies, _ = await timed_queries(retriever, queries)
+        print(f"query, cached  : {format_latencies(latencies)}")
+
+        fresh = load_retriever(path, top_k=args.top_k)
+        concurrent = queries[: args.concurrency]
+
+        async def offloaded() -> None:
+            await asyncio.gather(*[fresh.aretrieve(query) for _, query in concurrent])
+
+        async def inline() -> None:
+            for _, query in concurrent:
+                fresh._search(embed_model.embed([query])[0], args.top_k)
+                await asyncio.sleep(0)
+
+        start = time.perf_counter()
+        lag = await loop_lag(offloaded)
+        throughput = len(concurrent) / (time.perf_counter() - start)
+        print(
+            f"{len(concurrent)} concurrent  : {throughput:,.0f} queries/s, "
+            f"max loop stall {lag * 1000:.1f}ms"
+        )
+        print(f"inline search  : max loop stall {await loop_lag(inline) * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--topics", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--concurrency", type=int, default=32)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,123 @@
+"""
+Replays a log of opening messages through `SystemAgent` and counts the orchestrator
+LLM round trips with and without a `RoutingCache`.
+
+    python -m benchmarks.bench_routing_cache --messages 500
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+from llama_index.core.workflow import Event
+
+from benchmarks.mock_llm import MockFunctionCallingLLM
+from benchmarks.stub_server import UserInfoStub
+from main import get_agent_configs, get_health_coach_tools
+from routing import KeywordRouter, RoutingCache
+from serving import SessionManager
+from workflow import ProgressEvent, SystemAgent, ToolRequestEvent
+
+OPENING_MESSAGES = [
+    "I want to start health coaching",
+    "Can you coach me to get healthier?",
+    "I need a coach for my fitness plan",
+    "Start my health coaching session",
+    "Is eating a lot of apples considered healthy?",
+    "How much water should I drink a day?",
+    "What are the benefits of walking?",
+    "Is coffee bad for my health?",
+    "How many hours of sleep do adults need?",
+]
+
+ROUTER_EXAMPLES = {
+    "Health Coach Agent": [
+        "I want to start health coaching",
+        "coach me to reach my fitness goal",
+        "recommend tasks for my health plan",
+    ],
+    "Information Agent": [
+        "is this food healthy",
+        "is it bad or good for my health",
+        "how much should I drink eat or sleep",
+        "what are the benefits of this",
+    ],
+}
+
+
+def build_log(num_messages: int, seed: int = 0) -> list[str]:
+    """Opening messages with the casing/punctuation noise of real user input."""
+    rng = random.Random(seed)
+    log = []
+    for _ in range(num_messages):
+        msg = rng.choice(OPENING_MESSAGES)
+        msg = rng.choice(
+            [msg, msg.lower(), msg.upper(), f"  {msg}  ", msg.rstrip("?!")]
+        )
+        log.append(msg)
+    return log
+
+
+async def auto_approve(session_id: str, event: ToolRequestEvent) -> bool:
+    return True
+
+
+async def replay(
+    log: list[str], user_info_url: str, routing_cache: RoutingCache | None
+) -> tuple[MockFunctionCallingLLM, dict[str, str], float]:
+    llm = MockFunctionCallingLLM(latency=0.02)
+    agent_configs = get_agent_configs()
+    agent_configs[0].tools = get_health_coach_tools(user_info_url=user_info_url)
+    workflow = SystemAgent(timeout=None, routing_cache=routing_cache)
+    routes = {}
+
+    def record_route(session_id: str, event: Event) -> None:
+        if isinstance(event, ProgressEvent) and event.msg.startswith("Transferring"):
+            routes[session_id] = event.msg.removeprefix("Transferring to agent ")
+
+    start = time.perf_counter()
+    async with SessionManager(
+        workflow,
+        agent_configs,
+        llm,
+        approval_handler=auto_approve,
+        event_handler=record_route,
+    ) as manager:
+        for i, msg in enumerate(log):
+            await manager.chat(f"session-{i}", msg)
+            manager.close_session(f"session-{i}")
+    return llm, routes, time.perf_counter() - start
+
+
+async def main(num_messages: int) -> None:
+    log = build_log(num_messages)
+    router = KeywordRouter.from_agent_configs(get_agent_configs(), ROUTER_EXAMPLES)
+    configs = {
+        "no cache": None,
+        "exact tier": RoutingCache(),
+        "exact + classifier": RoutingCache(classifier=router),
+    }
+
+    print(f"replayed opening messages: {len(log)}")
+    baseline_routes = None
+    with UserInfoStub(latency=0.0) as stub:
+        for name, routing_cache in configs.items():
+            llm, routes, elapsed = await replay(log, stub.url, routing_cache)
+            baseline_routes = baseline_routes or routes
+            agreement = sum(
+                routes.get(session_id) == agent
+                for session_id, agent in baseline_routes.items()
+            ) / len(baseline_routes)
+            stats = routing_cache.stats() if routing_cache else {}
+            print(
+                f"{name:<20} orchestrator llm calls={llm.num_routing_calls:<5} "
+                f"total llm calls={llm.num_calls:<5} elapsed={elapsed:.2f}s "
+                f"agreement with llm routing={agreement:.1%} {stats}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=500)
+    asyncio.run(main(parser.parse_args().messages))
@@ -0,0 +1,169 @@
+"""
+Stresses and times the session state access of the workflow steps.
+
+The stress test runs concurrent tool calls that each set one user state field, as
+the `num_workers` of a step do, once with the previous get-mutate-set of the whole
+user state and its version through the context, and once with the atomic
+`SessionState` updates. It exits non-zero if the atomic path loses an update.
+
+The microbenchmark compares the operations per second of both access patterns.
+
+    python -m benchmarks.bench_session_state --workers 64 --rounds 200
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from typing import Awaitable, Callable
+
+from llama_index.core.llms import ChatMessage
+from llama_index.core.workflow import Context
+
+from conversation import ConversationStore
+from prompts import USER_STATE_PROMPT, get_user_state_prompt, update_user_state
+from session_state import get_session_state
+from workflow import SystemAgent
+
+
+# ---- the previous access pattern ----
+
+
+async def legacy_update(ctx: Context, key: str, value: int) -> None:
+    user_state = dict(await ctx.get("user_state", default={}))
+    user_state[key] = value
+    # the tool's own work, e.g. an HTTP call, sits between the read and the write
+    await asyncio.sleep(0)
+    await ctx.set("user_state", user_state)
+    await ctx.set("user_state_version", await ctx.get("user_state_version") + 1)
+
+
+async def legacy_append(ctx: Context, message: ChatMessage) -> None:
+    chat_history = await ctx.get("chat_history")
+    chat_history.append(message)
+    await ctx.set("chat_history", chat_history)
+
+
+async def legacy_state_prompt(ctx: Context) -> str:
+    user_state = await ctx.get("user_state")
+    return USER_STATE_PROMPT.format(
+        user_state_str="\n".join(f"{k}: {v}" for k, v in user_state.items())
+    )
+
+
+# ---- stress ----
+
+
+async def stress_round(
+    workflow: SystemAgent, workers: int, legacy: bool
+) -> tuple[int, int]:
+    """Returns the lost fields and the lost version bumps of one round."""
+    ctx = Context(workflow)
+    if legacy:
+        await ctx.set("user_state", {})
+        await ctx.set("user_state_version", 0)
+
+    async def worker(i: int) -> None:
+        if legacy:
+            await legacy_update(ctx, f"field_{i}", i)
+        else:
+            await asyncio.sleep(0)
+            await update_user_state(ctx, **{f"field_{i}": i})
+
+    await asyncio.gather(*(worker(i) for i in range(workers)))
+    if legacy:
+        user_state = await ctx.get("user_state")
+        version = await ctx.get("user_state_version")
+    else:
+        user_state = (await get_session_state(ctx)).user_state
+        version = user_state.version
+    return workers - len(user_state), workers - version
+
+
+async def stress(args: argparse.Namespace, workflow: SystemAgent) -> int:
+    lost = {}
+    for legacy in (True, False):
+        fields = versions = 0
+        for _ in range(args.rounds):
+            lost_fields, lost_versions = await stress_round(
+                workflow, args.workers, legacy
+            )
+            fields += lost_fields
+            versions += lost_versions
+        lost[legacy] = fields + versions
+        updates = args.rounds * args.workers
+        print(
+            f"{'get-mutate-set' if legacy else 'session state':<15}: "
+            f"lost {fields}/{updates} fields, {versions}/{updates} version bumps"
+        )
+    return lost[False]
+
+
+# ---- microbenchmark ----
+
+
+async def ops_per_sec(op: Callable[[int], Awaitable], ops: int) -> float:
+    start = time.perf_counter()
+    for i in range(ops):
+        await op(i)
+    return ops / (time.perf_counter() - start)
+
+
+async def microbenchmark(args: argparse.Namespace, workflow: SystemAgent) -> None:
+    legacy_ctx, ctx = Context(workflow), Context(workflow)
+    await legacy_ctx.set("user_state", {})
+    await legacy_ctx.set("user_state_version", 0)
+    await legacy_ctx.set("chat_history", [])
+    state = await get_session_state(ctx)
+    state.conversation = ConversationStore()
+    message = ChatMessage(role="tool", content="ok")
+
+    async def legacy_speaker(i: int) -> None:
+        await legacy_ctx.set("active_speaker", f"agent {i % 2}")
+        await legacy_ctx.set("agent_turns", await legacy_ctx.get("agent_turns", 0) + 1)
+
+    async def state_speaker(i: int) -> None:
+        state = await get_session_state(ctx)
+        state.set_active_speaker(f"agent {i % 2}", state.agent_turns + 1)
+
+    async def state_append(i: int) -> None:
+        (await get_session_state(ctx)).append_message(message)
+
+    async def legacy_prompt(i: int) -> None:
+        await legacy_update(legacy_ctx, f"field_{i % 8}", i)
+        await legacy_state_prompt(legacy_ctx)
+
+    async def state_prompt(i: int) -> None:
+        await update_user_state(ctx, **{f"field_{i % 8}": i})
+        await get_user_state_prompt(ctx)
+
+    cases = [
+        ("set active speaker", legacy_speaker, state_speaker),
+        ("append message", lambda i: legacy_append(legacy_ctx, message), state_append),
+        ("update field + prompt", legacy_prompt, state_prompt),
+    ]
+    print(f"{'ops/sec':<22} {'get-mutate-set':>15} {'session state':>15}")
+    for name, legacy_op, state_op in cases:
+        legacy = await ops_per_sec(legacy_op, args.ops)
+        atomic = await ops_per_sec(state_op, args.ops)
+        print(f"{name:<22} {legacy:>15,.0f} {atomic:>15,.0f} ({atomic / legacy:.1f}x)")
+
+
+async def main(args: argparse.Namespace) -> int:
+    workflow = SystemAgent()
+    print(f"stress: {args.rounds} rounds of {args.workers} concurrent updates")
+    lost = await stress(args, workflow)
+    print()
+    await microbenchmark(args, workflow)
+    if lost:
+        print(f"FAIL: the session state lost {lost} updates")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=64)
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--ops", type=int, default=50_000)
+    sys.exit(asyncio.run(main(parser.parse_args())))
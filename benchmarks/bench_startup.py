@@ -0,0 +1,124 @@
+"""
+Measures cold-start costs in fresh interpreters: the import time of the entry point
+modules, and the time from process start to the first response of a turn served with
+the mock LLM. Budgets can be set to fail the run on regressions.
+
+    python -m benchmarks.bench_startup --runs 5 --max-import-ms 2500
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+IMPORT_SCRIPT = """
+import time
+{preload}
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+FIRST_RESPONSE_SCRIPT = """
+import asyncio
+
+from llama_index.core.workflow import Context
+
+from benchmarks.mock_llm import MockFunctionCallingLLM
+from main import get_agent_configs
+from workflow import SystemAgent
+
+
+async def main():
+    workflow = SystemAgent(timeout=None)
+    await workflow.run(
+        ctx=Context(workflow),
+        user_msg="Is eating a lot of apples healthy?",
+        agent_configs=get_agent_configs(),
+        llm=MockFunctionCallingLLM(),
+    )
+    print("done", flush=True)
+    await workflow.aclose()
+
+
+asyncio.run(main())
+"""
+
+# modules the entry points no longer import at startup; their cost is measured on
+# top of llama_index.core, which the entry points import anyway
+LAZY_MODULES = [
+    "llama_index.llms.openai",
+    "llama_index.utils.workflow",
+    "aiohttp",
+    "retrieval",
+]
+
+
+def run_python(script: str) -> tuple[float, str]:
+    """Runs `script` in a fresh interpreter and returns its wall time and first line."""
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-W", "ignore", "-c", script],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    first_line = process.stdout.readline().strip()
+    elapsed = time.perf_counter() - start
+    process.communicate()
+    if process.returncode:
+        raise RuntimeError(f"benchmark script failed with code {process.returncode}")
+    return elapsed, first_line
+
+
+def median_import_time(module: str, runs: int, preload: str = "") -> float:
+    script = IMPORT_SCRIPT.format(module=module, preload=preload)
+    return statistics.median(float(run_python(script)[1]) for _ in range(runs))
+
+
+def main(args: argparse.Namespace) -> int:
+    failed = False
+    print(f"median of {args.runs} fresh interpreters")
+    for module in ["workflow", "main", "serving"]:
+        import_time = median_import_time(module, args.runs)
+        over_budget = args.max_import_ms and import_time * 1000 > args.max_import_ms
+        failed |= bool(over_budget)
+        print(
+            f"import {module:<28}: {import_time * 1000:7.0f}ms"
+            + (" OVER BUDGET" if over_budget else "")
+        )
+
+    loaded = run_python(
+        f"import sys, main, serving; "
+        f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    )[1]
+    if loaded:
+        failed = True
+        print(f"imported at startup, should be lazy: {loaded}")
+    for module in LAZY_MODULES:
+        print(
+            f"import {module:<28}: "
+            f"{median_import_time(module, args.runs, 'import llama_index.core') * 1000:7.0f}ms (lazy, extra)"
+        )
+
+    first_response = statistics.median(
+        run_python(FIRST_RESPONSE_SCRIPT)[0] for _ in range(args.runs)
+    )
+    over_budget = (
+        args.max_first_response_ms
+        and first_response * 1000 > args.max_first_response_ms
+    )
+    failed |= bool(over_budget)
+    print(
+        f"process start to first response   : {first_response * 1000:7.0f}ms"
+        + (" OVER BUDGET" if over_budget else "")
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float, default=None)
+    parser.add_argument("--max-first-response-ms", type=float, default=None)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,72 @@
+"""
+Measures time-to-first-token (TTFT) and total turn latency of `SystemAgent` with and
+without streaming, using the mock function-calling LLM.
+
+    python -m benchmarks.bench_streaming --sessions 50 --answer-words 300
+"""
+
+import argparse
+import asyncio
+import time
+
+from llama_index.core.workflow import Context
+
+from benchmarks.mock_llm import MockFunctionCallingLLM
+from benchmarks.stats import format_latencies
+from main import get_agent_configs
+from workflow import AgentStreamEvent, SystemAgent
+
+
+async def run_turn(
+    workflow: SystemAgent, llm: MockFunctionCallingLLM, user_msg: str
+) -> tuple[float, float]:
+    start = time.perf_counter()
+    first_token = None
+    handler = workflow.run(
+        ctx=Context(workflow),
+        user_msg=user_msg,
+        agent_configs=get_agent_configs(),
+        llm=llm,
+        chat_history=[],
+        initial_state={},
+    )
+    async for event in handler.stream_events():
+        if isinstance(event, AgentStreamEvent) and first_token is None:
+            first_token = time.perf_counter() - start
+    await handler
+    total = time.perf_counter() - start
+    return first_token or total, total
+
+
+async def main(args: argparse.Namespace) -> None:
+    llm = MockFunctionCallingLLM(
+        latency=args.llm_latency,
+        token_latency=args.token_latency,
+        answer_words=args.answer_words,
+    )
+    print(
+        f"sessions={args.sessions} answer words={args.answer_words} "
+        f"llm latency={args.llm_latency * 1000:.0f}ms "
+        f"token latency={args.token_latency * 1000:.1f}ms"
+    )
+    for stream in (False, True):
+        workflow = SystemAgent(timeout=None, stream=stream)
+        results = await asyncio.gather(
+            *[
+                run_turn(workflow, llm, "Is eating a lot of apples healthy?")
+                for _ in range(args.sessions)
+            ]
+        )
+        await workflow.aclose()
+        label = "streaming" if stream else "blocking "
+        print(f"{label} ttft : {format_latencies([ttft for ttft, _ in results])}")
+        print(f"{label} total: {format_latencies([total for _, total in results])}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--answer-words", type=int, default=300)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--token-latency", type=float, default=0.005)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,87 @@
+"""
+Replays the conversations of `benchmarks/traces.json` once with a single model and
+once tiered, with the orchestrator and the Information Agent on a smaller, faster
+mock model whose invalid tool calls (`--mistake-rate`) are escalated to the full
+model, and compares turn latency, LLM calls and cost per turn.
+
+The mock models are billed like gpt-4o and gpt-4o-mini.
+
+    python -m benchmarks.bench_tiering --llm-latency 0.4 --small-llm-latency 0.15
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks.replay import TRACES_PATH, Replay
+from benchmarks.stats import format_latencies
+from benchmarks.stub_server import UserInfoStub
+
+
+async def run(args: argparse.Namespace, url: str) -> tuple[Replay, float]:
+    random.seed(0)
+    replay = Replay(args, url, account=True)
+    start = time.perf_counter()
+    await replay.run(args.sessions, args.concurrency)
+    elapsed = time.perf_counter() - start
+    await replay.manager.stop()
+    return replay, elapsed
+
+
+async def main(args: argparse.Namespace) -> None:
+    print(
+        f"sessions={args.sessions} concurrency={args.concurrency} "
+        f"llm latency={args.llm_latency * 1000:.0f}ms "
+        f"small llm latency={args.small_llm_latency * 1000:.0f}ms "
+        f"mistake rate={args.mistake_rate:.0%}"
+    )
+    with UserInfoStub(latency=args.tool_latency) as stub:
+        for tiered in (False, True):
+            setup = argparse.Namespace(**{**vars(args), "tiered": tiered})
+            replay, elapsed = await run(setup, stub.url)
+            latencies = [x for values in replay.latencies.values() for x in values]
+            stats = replay.tiering.stats()
+            escalations = sum(tier["escalations"] for tier in stats.values())
+            cost = sum(tier["cost"] for tier in stats.values())
+            print(f"{'tiered' if tiered else 'single model'}:")
+            for name, values in replay.latencies.items():
+                print(f"  {name:<26} {format_latencies(values)}")
+            print(
+                f"  {'all turns':<26} {format_latencies(latencies)} "
+                f"({replay.num_turns / elapsed:.1f} turns/s)"
+            )
+            print(
+                f"  llm calls per turn={replay.num_calls / replay.num_turns:.2f} "
+                f"escalations={escalations} "
+                f"cost per 1k turns=${cost / replay.num_turns * 1000:.3f}"
+            )
+            for model, tier in stats.items():
+                print(
+                    f"    {model:<24} calls={tier['calls']:5d} "
+                    f"p50={tier['latency_p50'] * 1000:.1f}ms "
+                    f"p90={tier['latency_p90'] * 1000:.1f}ms "
+                    f"cost=${tier['cost']:.4f}"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=120)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--llm-latency", type=float, default=0.4)
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    parser.add_argument("--small-llm-latency", type=float, default=0.15)
+    parser.add_argument("--small-token-latency", type=float, default=0.0)
+    parser.add_argument("--mistake-rate", type=float, default=0.05)
+    parser.add_argument("--tool-latency", type=float, default=0.05)
+    parser.add_argument("--traces", default=TRACES_PATH)
+    # the replay's other setups
+    parser.set_defaults(
+        speculate=0,
+        speculation_tpm=None,
+        no_sticky=False,
+        malformed_rate=None,
+        no_output_schema=False,
+    )
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,110 @@
+"""
+Measures the turn latency saved by memoizing a slow tool with `ToolCache`, in memory
+and on disk (including a warm restart from the disk cache).
+
+    python -m benchmarks.bench_tool_cache --sessions 200 --concurrency 20 --latency 0.1
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from llama_index.core.tools import BaseTool
+from llama_index.core.workflow import Context
+
+from benchmarks.mock_llm import MockFunctionCallingLLM
+from benchmarks.stats import format_latencies
+from benchmarks.stub_server import UserInfoStub
+from cache import DiskCache
+from http_client import AsyncHttpClient
+from scheduler import ToolPolicy
+from tool_cache import ToolCache
+from utils import FunctionToolWithContext
+from workflow import AgentConfig, SystemAgent
+
+
+def get_guideline_tools(url: str) -> list[BaseTool]:
+    async def get_health_guidelines(ctx: Context, http: AsyncHttpClient) -> str:
+        """Get the current health guidelines from API"""
+        guidelines = await http.get_json(url)
+        return f"The health guidelines are {guidelines['user_tasks']}."
+
+    return [FunctionToolWithContext.from_defaults(async_fn=get_health_guidelines)]
+
+
+async def run_sessions(
+    args: argparse.Namespace, url: str, tool_cache: ToolCache | None
+) -> list[float]:
+    policies = {}
+    if tool_cache is not None:
+        # the guidelines are the same for every user, so the cache is shared
+        policies["get_health_guidelines"] = ToolPolicy(
+            cache_ttl=60 * 60, cache_scope="global"
+        )
+    agent_config = AgentConfig(
+        name="Information Agent",
+        description="Answer user's question related to health",
+        system_prompt="Answer the question using the health guidelines.",
+        tools=get_guideline_tools(url),
+        tool_policies=policies,
+    )
+    llm = MockFunctionCallingLLM(latency=args.llm_latency)
+    workflow = SystemAgent(timeout=None, tool_cache=tool_cache)
+
+    async def run_session() -> float:
+        start = time.perf_counter()
+        await workflow.run(
+            ctx=Context(workflow),
+            user_msg="How much should I walk?",
+            agent_configs=[agent_config],
+            llm=llm,
+        )
+        return time.perf_counter() - start
+
+    latencies = []
+    for _ in range(0, args.sessions, args.concurrency):
+        latencies += await asyncio.gather(
+            *[run_session() for _ in range(args.concurrency)]
+        )
+    await workflow.aclose()
+    return latencies
+
+
+async def main(args: argparse.Namespace) -> None:
+    print(
+        f"sessions={args.sessions} concurrency={args.concurrency} "
+        f"tool latency={args.latency * 1000:.0f}ms llm latency={args.llm_latency * 1000:.0f}ms"
+    )
+    with (
+        UserInfoStub(latency=args.latency) as stub,
+        tempfile.TemporaryDirectory() as tmp,
+    ):
+        path = os.path.join(tmp, "tool_cache.sqlite")
+        for label, make_cache in (
+            ("no cache  ", lambda: None),
+            ("in memory ", lambda: ToolCache()),
+            ("disk, cold", lambda: ToolCache(DiskCache(path))),
+            # a new process would find the results written by the previous run
+            ("disk, warm", lambda: ToolCache(DiskCache(path))),
+        ):
+            tool_cache = make_cache()
+            num_requests = stub.num_requests
+            latencies = await run_sessions(args, stub.url, tool_cache)
+            hit_ratio = tool_cache.hit_ratio if tool_cache is not None else 0.0
+            print(
+                f"{label}: {format_latencies(latencies)} "
+                f"tool requests={stub.num_requests - num_requests} hit ratio={hit_ratio:.0%}"
+            )
+            if tool_cache is not None and isinstance(tool_cache.backend, DiskCache):
+                tool_cache.backend.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--llm-latency", type=float, default=0.02)
+    asyncio.run(main(parser.parse_args()))
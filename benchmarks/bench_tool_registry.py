@@ -0,0 +1,96 @@
+"""
+Measures how long it takes to build the tools of an agent pool with 500 generated
+tool functions: building every schema, reusing a warm `ToolRegistry` (e.g. when
+`get_agent_configs()` runs again per tenant), and starting cold from persisted schemas.
+
+    python -m benchmarks.bench_tool_registry --tools 500
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from typing import Any, Callable
+
+from llama_index.core.workflow import Context
+
+from http_client import AsyncHttpClient
+from utils import FunctionToolWithContext, ToolRegistry
+
+TOOL_TEMPLATE = '''
+async def lookup_{i}(
+    ctx: Context,
+    http: AsyncHttpClient,
+    query: str,
+    limit: int = 10,
+    tags: list[str] | None = None,
+    include_archived_{i}: bool = False,
+) -> str:
+    """Looks up records of kind {i} matching the query."""
+    return query
+'''
+
+
+def generate_tool_functions(num_tools: int) -> list[Callable[..., Any]]:
+    namespace = {
+        "__name__": "generated_tools",
+        "Context": Context,
+        "AsyncHttpClient": AsyncHttpClient,
+    }
+    exec("".join(TOOL_TEMPLATE.format(i=i) for i in range(num_tools)), namespace)
+    return [namespace[f"lookup_{i}"] for i in range(num_tools)]
+
+
+def build_tools(
+    fns: list[Callable[..., Any]], registry: ToolRegistry
+) -> tuple[float, list[FunctionToolWithContext]]:
+    start = time.perf_counter()
+    tools = [
+        FunctionToolWithContext.from_defaults(async_fn=fn, registry=registry)
+        for fn in fns
+    ]
+    # what the LLM integration asks for on the first call
+    for tool in tools:
+        tool.metadata.to_openai_tool()
+    return time.perf_counter() - start, tools
+
+
+def main(args: argparse.Namespace) -> None:
+    fns = generate_tool_functions(args.tools)
+    print(f"tools={args.tools}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        schema_path = os.path.join(tmp, "tool_schemas.json")
+
+        registry = ToolRegistry(schema_path=schema_path)
+        cold, tools = build_tools(fns, registry)
+        print(f"cold, building every schema : {cold * 1000:8.1f}ms")
+        start = time.perf_counter()
+        registry.save()
+        print(
+            f"  persisting the schemas    : {(time.perf_counter() - start) * 1000:8.1f}ms"
+        )
+
+        warm, _ = build_tools(fns, registry)
+        print(
+            f"warm registry, rebuilt pool : {warm * 1000:8.1f}ms ({cold / warm:.0f}x)"
+        )
+
+        # a new process: empty in-memory cache, schemas loaded from disk
+        start = time.perf_counter()
+        registry = ToolRegistry(schema_path=schema_path)
+        _, restored = build_tools(fns, registry)
+        persisted = time.perf_counter() - start
+        print(
+            f"cold, persisted schemas     : {persisted * 1000:8.1f}ms ({cold / persisted:.0f}x)"
+        )
+
+    assert [tool.metadata.to_openai_tool() for tool in restored] == [
+        tool.metadata.to_openai_tool() for tool in tools
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tools", type=int, default=500)
+    main(parser.parse_args())
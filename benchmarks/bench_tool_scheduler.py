@@ -0,0 +1,138 @@
+"""
+Measures how long a sub-agent turn takes when the LLM requests several slow tools in
+one message, and how `ToolPolicy` limits and worker pools change that.
+
+    python -m benchmarks.bench_tool_scheduler --tools 8 --tool-latency 0.2
+"""
+
+import argparse
+import asyncio
+import time
+
+from llama_index.core.tools import FunctionTool
+from llama_index.core.workflow import Context
+
+from benchmarks.mock_llm import MockFunctionCallingLLM
+from scheduler import ToolPolicy, ToolScheduler
+from workflow import AgentConfig, SystemAgent
+
+
+def get_io_tools(num_tools: int, latency: float) -> list[FunctionTool]:
+    async def lookup() -> str:
+        await asyncio.sleep(latency)
+        return "ok"
+
+    return [
+        FunctionTool.from_defaults(async_fn=lookup, name=f"lookup_{i}")
+        for i in range(num_tools)
+    ]
+
+
+def burn_cpu(n: int = 3_000_000) -> int:
+    """A pure-python loop that holds the GIL, like parsing or scoring would."""
+    total = 0
+    for i in range(n):
+        total += i * i % 7
+    return total
+
+
+def get_cpu_tools(num_tools: int) -> list[FunctionTool]:
+    return [
+        FunctionTool.from_defaults(fn=burn_cpu, name=f"score_{i}")
+        for i in range(num_tools)
+    ]
+
+
+async def run_turns(
+    tools: list[FunctionTool],
+    policies: dict[str, ToolPolicy] | None = None,
+    tool_scheduler: ToolScheduler | None = None,
+    sessions: int = 1,
+) -> float:
+    """Runs one turn in each of `sessions` concurrent sessions and returns the wall time."""
+    agent_config = AgentConfig(
+        name="Tool Agent",
+        description="Calls every tool it has.",
+        system_prompt="Call all of your tools.",
+        tools=tools,
+        tool_policies=policies or {},
+    )
+    # routes every message to the only agent, which calls all its tools in one message
+    llm = MockFunctionCallingLLM(
+        default_agent=agent_config.name, parallel_tool_calls=True
+    )
+    workflow = SystemAgent(timeout=None, tool_scheduler=tool_scheduler)
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *[
+            workflow.run(
+                ctx=Context(workflow),
+                user_msg="Run everything",
+                agent_configs=[agent_config],
+                llm=llm,
+            )
+            for _ in range(sessions)
+        ]
+    )
+    elapsed = time.perf_counter() - start
+    await workflow.aclose()
+    return elapsed
+
+
+async def main(args: argparse.Namespace) -> None:
+    io_tools = get_io_tools(args.tools, args.tool_latency)
+    print(f"{args.tools} tools x {args.tool_latency * 1000:.0f}ms each, one turn")
+    elapsed = await run_turns(io_tools)
+    print(f"  all at once      : {elapsed * 1000:7.0f}ms")
+    timeout = args.tool_latency / 2
+    policies = {
+        tool.metadata.get_name(): ToolPolicy(timeout=timeout) for tool in io_tools
+    }
+    elapsed = await run_turns(io_tools, policies)
+    print(f"  timeout={timeout * 1000:.0f}ms    : {elapsed * 1000:7.0f}ms")
+
+    print(f"\n1 tool x {args.tool_latency * 1000:.0f}ms, {args.sessions} sessions")
+    for limit in (None, 4, 1):
+        policy = ToolPolicy(max_concurrency=limit)
+        elapsed = await run_turns(
+            io_tools[:1],
+            {io_tools[0].metadata.get_name(): policy},
+            sessions=args.sessions,
+        )
+        print(f"  max_concurrency={limit!s:<4}: {elapsed * 1000:7.0f}ms")
+
+    # cpu-bound tools run next to an io-bound session, whose latency shows whether
+    # the event loop stayed responsive
+    cpu_tools = get_cpu_tools(args.cpu_tools)
+    start = time.perf_counter()
+    burn_cpu()
+    single = time.perf_counter() - start
+    print(
+        f"\n{args.cpu_tools} cpu-bound tools x {single * 1000:.0f}ms each, "
+        f"next to 1 tool x {args.tool_latency * 1000:.0f}ms"
+    )
+    cpu_bound = {
+        tool.metadata.get_name(): ToolPolicy(cpu_bound=True) for tool in cpu_tools
+    }
+    for label, policies, tool_scheduler in (
+        ("on the event loop", None, None),
+        ("thread pool      ", cpu_bound, None),
+        ("process pool     ", cpu_bound, ToolScheduler(max_processes=args.cpu_tools)),
+    ):
+        cpu_elapsed, io_elapsed = await asyncio.gather(
+            run_turns(cpu_tools, policies, tool_scheduler), run_turns(io_tools[:1])
+        )
+        print(
+            f"  {label}: cpu turn {cpu_elapsed * 1000:5.0f}ms, "
+            f"io turn {io_elapsed * 1000:5.0f}ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tools", type=int, default=8)
+    parser.add_argument("--tool-latency", type=float, default=0.2)
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--cpu-tools", type=int, default=4)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,94 @@
+"""
+Measures the overhead of tracing: the same CPU-bound load (a zero-latency mock LLM
+and tool) runs without a tracer and with each exporter, and the turns per second
+are compared. The JSONL trace of the last run is summarized with `trace_summary.py`.
+
+    python -m benchmarks.bench_tracing --sessions 500
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.mock_llm import MockFunctionCallingLLM
+from benchmarks.stub_server import UserInfoStub
+from main import get_agent_configs, get_health_coach_tools
+from serving import SessionManager
+from tracing import InMemoryExporter, JSONLExporter, OTLPJSONExporter, Tracer
+from workflow import SystemAgent, ToolRequestEvent
+
+CONVERSATION = ["Hello!", "I want to start health coaching", "gain muscle"]
+
+
+async def auto_approve(session_id: str, event: ToolRequestEvent) -> bool:
+    return True
+
+
+async def run(args: argparse.Namespace, url: str, tracer: Tracer | None) -> float:
+    agent_configs = get_agent_configs()
+    agent_configs[0].tools = get_health_coach_tools(user_info_url=url)
+    workflow = SystemAgent(timeout=None, tracer=tracer)
+    num_turns = 0
+
+    async with SessionManager(
+        workflow, agent_configs, MockFunctionCallingLLM(), approval_handler=auto_approve
+    ) as manager:
+
+        async def session(i: int) -> None:
+            nonlocal num_turns
+            for user_msg in CONVERSATION:
+                await manager.chat(f"session-{i}", user_msg)
+                num_turns += 1
+            manager.close_session(f"session-{i}")
+
+        start = time.perf_counter()
+        for i in range(0, args.sessions, args.concurrency):
+            batch = range(i, min(i + args.concurrency, args.sessions))
+            await asyncio.gather(*(session(j) for j in batch))
+        elapsed = time.perf_counter() - start
+    await workflow.aclose()
+    return num_turns / elapsed
+
+
+async def main(args: argparse.Namespace) -> None:
+    with UserInfoStub(latency=0) as stub, tempfile.TemporaryDirectory() as tmp:
+        jsonl_path = os.path.join(tmp, "trace.jsonl")
+        runs = {
+            "no tracer": lambda: None,
+            "in-memory": lambda: Tracer(InMemoryExporter()),
+            "JSONL": lambda: Tracer(JSONLExporter(jsonl_path)),
+            "OTLP/JSON": lambda: Tracer(
+                OTLPJSONExporter(os.path.join(tmp, "trace.otlp.jsonl"))
+            ),
+        }
+        # warm up imports and caches
+        await run(argparse.Namespace(sessions=10, concurrency=10), stub.url, None)
+        print(f"sessions={args.sessions} x {len(CONVERSATION)} turns, CPU-bound")
+        # interleaved, so drift in machine speed affects every configuration alike
+        rates: dict[str, list[float]] = {name: [] for name in runs}
+        for _ in range(args.repeat):
+            for name, make_tracer in runs.items():
+                tracer = make_tracer()
+                rates[name].append(await run(args, stub.url, tracer))
+                if tracer is not None:
+                    tracer.close()
+        baseline = max(rates["no tracer"])
+        for name, rate in rates.items():
+            print(
+                f"{name:<10}: {max(rate):7.1f} turns/s "
+                f"({(baseline / max(rate) - 1) * 100:+5.1f}% time per turn)"
+            )
+        print("\n$ python trace_summary.py trace.jsonl")
+        subprocess.run([sys.executable, "trace_summary.py", jsonl_path], check=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    asyncio.run(main(parser.parse_args()))
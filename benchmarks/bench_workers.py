@@ -0,0 +1,103 @@
+"""
+Drives the conversations of `benchmarks.load_generator` through a `WorkerPool` with
+1, 2, 4... worker processes, each serving its sessions with the mock LLM, and reports
+throughput per worker count against one `SessionManager` in this process. With a
+short LLM latency the turns are CPU-bound, so throughput should grow with the workers
+up to the number of cores.
+
+    python -m benchmarks.bench_workers --workers 1,2,4 --sessions 2000
+"""
+
+import argparse
+import asyncio
+import functools
+import os
+import time
+from typing import Awaitable, Callable
+
+from benchmarks.load_generator import CONVERSATIONS, auto_approve
+from benchmarks.mock_llm import MockFunctionCallingLLM
+from benchmarks.stats import format_latencies
+from benchmarks.stub_server import UserInfoStub
+from cluster import WorkerPool
+from main import get_agent_configs, get_health_coach_tools
+from serving import SessionManager
+from workflow import SystemAgent
+
+Chat = Callable[[str, str], Awaitable[str | None]]
+
+
+def make_manager(user_info_url: str, llm_latency: float) -> SessionManager:
+    """Builds the `SessionManager` of a worker; pickled by reference."""
+    agent_configs = get_agent_configs()
+    agent_configs[0].tools = get_health_coach_tools(user_info_url=user_info_url)
+    llm = MockFunctionCallingLLM(latency=llm_latency, jitter=llm_latency / 2)
+    return SessionManager(
+        SystemAgent(timeout=None),
+        agent_configs,
+        llm,
+        idle_timeout=None,
+        approval_handler=auto_approve,
+    )
+
+
+async def drive(chat: Chat, args: argparse.Namespace) -> tuple[list[float], float]:
+    latencies: list[float] = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def client(i: int) -> None:
+        async with semaphore:
+            for user_msg in CONVERSATIONS[i % len(CONVERSATIONS)]:
+                start = time.perf_counter()
+                # distinct messages, so the gateway doesn't share calls across sessions
+                await chat(f"session-{i}", f"{user_msg} ({i})")
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(args.sessions)))
+    return latencies, time.perf_counter() - start
+
+
+async def main(args: argparse.Namespace) -> None:
+    worker_counts = [int(n) for n in args.workers.split(",")]
+    print(
+        f"cores={os.cpu_count()} sessions={args.sessions} "
+        f"concurrency={args.concurrency} llm latency={args.llm_latency * 1000:.0f}ms"
+    )
+    with UserInfoStub(latency=args.tool_latency) as stub:
+        factory = functools.partial(make_manager, stub.url, args.llm_latency)
+
+        async with factory() as manager:
+            latencies, elapsed = await drive(manager.chat, args)
+        print(
+            f"{'in process':<12} {len(latencies) / elapsed:7.1f} turns/s  "
+            f"{format_latencies(latencies)}"
+        )
+
+        single = None
+        for num_workers in worker_counts:
+            start = time.perf_counter()
+            async with WorkerPool(factory, num_workers=num_workers) as pool:
+                startup = time.perf_counter() - start
+                latencies, elapsed = await drive(pool.chat, args)
+                sessions = [
+                    stats["sessions"] for stats in (await pool.stats()).values()
+                ]
+            throughput = len(latencies) / elapsed
+            single = single or throughput / num_workers
+            print(
+                f"{f'{num_workers} workers':<12} {throughput:7.1f} turns/s  "
+                f"{format_latencies(latencies)}  "
+                f"scaling={throughput / single:.2f}x "
+                f"startup={startup:.1f}s sessions per worker={sessions}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--llm-latency", type=float, default=0.005)
+    parser.add_argument("--tool-latency", type=float, default=0.0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,91 @@
+"""
+Drives many concurrent conversations through a `SessionManager` backed by the mock
+function-calling LLM and a local user-info stub, and reports throughput and latency.
+
+    python -m benchmarks.load_generator --sessions 1000 --concurrency 200
+"""
+
+import argparse
+import asyncio
+import time
+
+from benchmarks.mock_llm import MockFunctionCallingLLM
+from benchmarks.stats import format_latencies
+from benchmarks.stub_server import UserInfoStub
+from llm_gateway import LLMGateway
+from main import get_agent_configs, get_health_coach_tools
+from serving import SessionManager
+from workflow import SystemAgent, ToolRequestEvent
+
+CONVERSATIONS = [
+    ["Hello!", "I want to start health coaching", "gain muscle"],
+    ["Hello!", "Is eating a lot of apples considered healthy?", "thanks"],
+]
+
+
+async def auto_approve(session_id: str, event: ToolRequestEvent) -> bool:
+    return True
+
+
+async def run_session(
+    manager: SessionManager, session_id: str, turns: list[str], latencies: list[float]
+) -> None:
+    for user_msg in turns:
+        start = time.perf_counter()
+        await manager.chat(session_id, user_msg)
+        latencies.append(time.perf_counter() - start)
+    manager.close_session(session_id)
+
+
+async def main(args: argparse.Namespace) -> None:
+    llm = MockFunctionCallingLLM(latency=args.llm_latency, jitter=args.llm_latency / 2)
+
+    with UserInfoStub(latency=args.tool_latency) as stub:
+        agent_configs = get_agent_configs()
+        agent_configs[0].tools = get_health_coach_tools(user_info_url=stub.url)
+        # without coalescing unless asked, the sessions send the same messages and
+        # would mostly share in-flight calls rather than load the serving engine
+        workflow = SystemAgent(
+            timeout=None,
+            llm_gateway=LLMGateway(
+                max_concurrency=args.max_llm_calls, coalesce=args.coalesce
+            ),
+        )
+
+        latencies: list[float] = []
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def client(i: int) -> None:
+            async with semaphore:
+                turns = CONVERSATIONS[i % len(CONVERSATIONS)]
+                await run_session(manager, f"session-{i}", turns, latencies)
+
+        async with SessionManager(
+            workflow, agent_configs, llm, approval_handler=auto_approve
+        ) as manager:
+            start = time.perf_counter()
+            await asyncio.gather(*[client(i) for i in range(args.sessions)])
+            elapsed = time.perf_counter() - start
+
+    print(
+        f"sessions={args.sessions} concurrency={args.concurrency} "
+        f"llm latency={args.llm_latency * 1000:.0f}ms max llm calls={args.max_llm_calls} "
+        f"coalesce={args.coalesce}"
+    )
+    print(f"elapsed      : {elapsed:.2f}s")
+    print(f"sessions/sec : {args.sessions / elapsed:.1f}")
+    print(f"turns/sec    : {len(latencies) / elapsed:.1f}")
+    print(f"turn latency : {format_latencies(latencies)}")
+    print(f"llm calls    : {llm.num_calls}")
+    print(f"manager stats: {manager.stats()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--tool-latency", type=float, default=0.01)
+    parser.add_argument("--max-llm-calls", type=int, default=None)
+    parser.add_argument("--coalesce", action="store_true")
+    asyncio.run(main(parser.parse_args()))
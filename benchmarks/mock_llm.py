@@ -0,0 +1,439 @@
+import asyncio
+import json
+import random
+import uuid
+from collections import Counter
+from typing import Any, Sequence
+
+from pydantic import Field, PrivateAttr
+
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    ChatResponseGen,
+    CompletionResponse,
+    CompletionResponseAsyncGen,
+    CompletionResponseGen,
+    LLMMetadata,
+)
+from llama_index.core.llms.function_calling import FunctionCallingLLM
+from llama_index.core.tools import BaseTool, ToolSelection
+
+DEFAULT_ROUTES = {"coach": "Health Coach Agent"}
+# ways `structured_answers` are malformed; the first four can be repaired locally
+MALFORMATIONS = (
+    "prose",
+    "trailing_text",
+    "trailing_comma",
+    "truncated",
+    "wrong_type",
+    "missing_field",
+)
+
+
+def estimate_tokens(text: str | None) -> int:
+    """Rough token estimate (~4 characters per token) used for mock usage reports."""
+    return len(text or "") // 4 + 1
+
+
+class MockAPIError(Exception):
+    """An error response of the mock provider, e.g. a 429 when over its limits."""
+
+    def __init__(self, status_code: int, retry_after: float | None = None):
+        super().__init__(f"Mock provider error {status_code}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class MockFunctionCallingLLM(FunctionCallingLLM):
+    """
+    A scripted function-calling LLM for benchmarks, no network required.
+
+    - When offered the `TransferToAgent` tool, it routes by keyword (`routes`) and
+      falls back to `default_agent`; with `allow_parallel_tool_calls`, it transfers to
+      every agent whose keyword is in the message.
+    - When offered `RequestTransfer`, it calls it when the user message routes by
+      keyword to another agent than the one named in its system prompt.
+    - When offered other tools, it calls each tool once per conversation, the first
+      time a user message arrives; one tool per message, or all of them in a single
+      message with `parallel_tool_calls`.
+    - Otherwise it answers with a short text message.
+
+    Every call sleeps for `latency` (+/- `jitter`) seconds plus `prefill_latency` per
+    prompt token before the first token, and `token_latency` seconds per generated
+    word; text answers are padded to `answer_words` words. With `tail_probability`,
+    a call takes `tail_latency` seconds longer.
+
+    With `structured_answers`, an agent whose system prompt asks for the coaching
+    JSON answers with it once it has called its tools, and so does an LLM asked to
+    repair one; a `malformed_rate` share of them are malformed (`MALFORMATIONS`).
+
+    Like a smaller model, a `mistake_rate` share of its tool call messages name an
+    agent or a tool that does not exist.
+
+    Like a provider under load, calls beyond `max_concurrency` in flight fail with a
+    429 `MockAPIError` and a `error_rate` share of calls fail with a 503, both after
+    `error_latency` seconds.
+    """
+
+    latency: float = 0.0
+    jitter: float = 0.0
+    token_latency: float = 0.0
+    prefill_latency: float = 0.0
+    answer_words: int = 0
+    tail_probability: float = 0.0
+    tail_latency: float = 0.0
+    max_concurrency: int | None = None
+    error_rate: float = 0.0
+    error_latency: float = 0.0
+    parallel_tool_calls: bool = False
+    mistake_rate: float = 0.0
+    structured_answers: bool = False
+    malformed_rate: float = 0.0
+    routes: dict[str, str] = Field(default_factory=lambda: dict(DEFAULT_ROUTES))
+    default_agent: str = "Information Agent"
+    model: str = "mock-function-calling"
+    # responses are deterministic, like a real LLM at temperature 0
+    temperature: float = 0.0
+
+    _num_calls: int = PrivateAttr(default=0)
+    _num_routing_calls: int = PrivateAttr(default=0)
+    _prompt_tokens: list[int] = PrivateAttr(default_factory=list)
+    _in_flight: int = PrivateAttr(default=0)
+    _errors: Counter = PrivateAttr(default_factory=Counter)
+    # draws the simulated mistakes, so runs with the same calls make the same ones
+    _rng: random.Random = PrivateAttr(default_factory=lambda: random.Random(0))
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "MockFunctionCallingLLM"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(
+            is_chat_model=True,
+            is_function_calling_model=True,
+            model_name=self.model,
+        )
+
+    @property
+    def num_calls(self) -> int:
+        return self._num_calls
+
+    @property
+    def prompt_tokens(self) -> list[int]:
+        """Estimated prompt tokens of every call, in call order."""
+        return self._prompt_tokens
+
+    @property
+    def num_routing_calls(self) -> int:
+        """Number of calls that were offered the orchestrator's `TransferToAgent` tool."""
+        return self._num_routing_calls
+
+    @property
+    def errors(self) -> Counter:
+        """Number of failed calls by status code."""
+        return self._errors
+
+    # ---- scripted behaviour ----
+
+    def _respond(
+        self,
+        messages: Sequence[ChatMessage],
+        tools: Sequence[BaseTool],
+        allow_parallel_tool_calls: bool = False,
+    ) -> ChatMessage:
+        # the user state prompt is a system message after the history
+        last_message = next(
+            (m for m in reversed(messages) if m.role != "system"),
+            ChatMessage(content=""),
+        )
+        last_user_msg = next(
+            (m.content or "" for m in reversed(messages) if m.role == "user"), ""
+        )
+        tool_names = [tool.metadata.get_name() for tool in tools]
+
+        if "TransferToAgent" in tool_names:
+            self._num_routing_calls += 1
+            agent_names = []
+            for keyword, agent in self.routes.items():
+                if keyword in last_user_msg.lower() and agent not in agent_names:
+                    agent_names.append(agent)
+            if not allow_parallel_tool_calls:
+                agent_names = agent_names[:1]
+            return self._tool_call_message(
+                *[
+                    ("TransferToAgent", {"agent_name": agent_name})
+                    for agent_name in agent_names or [self.default_agent]
+                ]
+            )
+
+        if "RequestTransfer" in tool_names and last_message.role == "user":
+            system_prompt = next(
+                (m.content or "" for m in messages if m.role == "system"), ""
+            )
+            for keyword, agent in self.routes.items():
+                if keyword in last_user_msg.lower() and agent not in system_prompt:
+                    return self._tool_call_message(("RequestTransfer", {}))
+            tool_names.remove("RequestTransfer")
+
+        if last_message.role == "user":
+            called = {
+                tool_call["name"]
+                for m in messages
+                for tool_call in m.additional_kwargs.get("tool_calls", [])
+            }
+            uncalled = [name for name in tool_names if name not in called]
+            if uncalled:
+                if not self.parallel_tool_calls:
+                    uncalled = uncalled[:1]
+                return self._tool_call_message(*[(name, {}) for name in uncalled])
+
+        question = " ".join(last_user_msg.split()[:12])
+        system_prompt = next(
+            (m.content or "" for m in messages if m.role == "system"), ""
+        )
+        if self.structured_answers and '"recommended_task"' in system_prompt:
+            # a repair call is offered no tools
+            if not tools:
+                return ChatMessage(
+                    role="assistant", content=self._coaching_json(question)
+                )
+            if last_message.role == "user" and any(m.role == "tool" for m in messages):
+                malformed = self._rng.random() < self.malformed_rate
+                return ChatMessage(
+                    role="assistant", content=self._coaching_json(question, malformed)
+                )
+
+        answer = f"Here is a mock answer to: {question}"
+        padding = max(0, self.answer_words - len(answer.split()))
+        return ChatMessage(role="assistant", content=answer + " lorem" * padding)
+
+    def _coaching_json(self, question: str, malformed: bool = False) -> str:
+        answer = {
+            "user_info": "mock user",
+            "user_goal": question,
+            "recommended_task": ["walk 20 minutes", "drink water", "sleep 8 hours"],
+            "reason": "mock reason",
+        }
+        kind = self._rng.choice(MALFORMATIONS) if malformed else None
+        if kind == "wrong_type":
+            answer["recommended_task"] = "; ".join(answer["recommended_task"])
+        elif kind == "missing_field":
+            del answer["reason"]
+        text = json.dumps(answer, indent=4)
+        if kind == "prose":
+            return f"Here is your plan:\n```json\n{text}\n```"
+        if kind == "trailing_text":
+            return f"{text}\nLet me know if you want to change anything!"
+        if kind == "trailing_comma":
+            return text[:-2] + ",\n}"
+        if kind == "truncated":
+            return text[:-8]
+        return text
+
+    def _tool_call_message(self, *tool_calls: tuple[str, dict]) -> ChatMessage:
+        return ChatMessage(
+            role="assistant",
+            content="",
+            additional_kwargs={
+                "tool_calls": [
+                    {
+                        "id": f"call_{uuid.uuid4().hex[:12]}",
+                        "name": tool_name,
+                        "arguments": tool_kwargs,
+                    }
+                    for tool_name, tool_kwargs in tool_calls
+                ]
+            },
+        )
+
+    def _chat_response(
+        self,
+        messages: Sequence[ChatMessage],
+        tools: Sequence[BaseTool],
+        allow_parallel_tool_calls: bool = False,
+    ) -> ChatResponse:
+        self._num_calls += 1
+        message = self._respond(messages, tools, allow_parallel_tool_calls)
+        tool_calls = message.additional_kwargs.get("tool_calls")
+        if tool_calls and self.mistake_rate and self._rng.random() < self.mistake_rate:
+            tool_call = tool_calls[0]
+            if tool_call["name"] == "TransferToAgent":
+                tool_call["arguments"] = {"agent_name": "General Agent"}
+            else:
+                tool_call["name"] += "_tool"
+        prompt_tokens = sum(estimate_tokens(m.content) for m in messages)
+        self._prompt_tokens.append(prompt_tokens)
+        completion_tokens = estimate_tokens(message.content)
+        return ChatResponse(
+            message=message,
+            additional_kwargs={
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        )
+
+    def _delay(self, response: ChatResponse) -> float:
+        """Time to first token for `response`."""
+        prefill = self.prefill_latency * response.additional_kwargs["prompt_tokens"]
+        jitter = random.uniform(-self.jitter, self.jitter)
+        tail = self.tail_latency if random.random() < self.tail_probability else 0.0
+        return max(0.0, self.latency + jitter + prefill + tail)
+
+    async def _check_limits(self) -> None:
+        """Fails the call the way a provider would when over its limits."""
+        status_code = None
+        if self.max_concurrency is not None and self._in_flight >= self.max_concurrency:
+            status_code = 429
+        elif self.error_rate and random.random() < self.error_rate:
+            status_code = 503
+        if status_code is not None:
+            self._errors[status_code] += 1
+            await asyncio.sleep(self.error_latency)
+            raise MockAPIError(status_code)
+
+    def _chunks(self, message: ChatMessage) -> list[tuple[str, dict]]:
+        """Splits a message into (content delta, additional_kwargs) stream chunks."""
+        tool_calls = message.additional_kwargs.get("tool_calls", [])
+        if tool_calls:
+            return [
+                ("", {"tool_calls": tool_calls[: i + 1]})
+                for i in range(len(tool_calls))
+            ]
+        words = (message.content or "").split(" ")
+        return [(word if i == 0 else f" {word}", {}) for i, word in enumerate(words)]
+
+    # ---- FunctionCallingLLM interface ----
+
+    def _prepare_chat_with_tools(
+        self,
+        tools: Sequence[BaseTool],
+        user_msg: str | ChatMessage | None = None,
+        chat_history: list[ChatMessage] | None = None,
+        verbose: bool = False,
+        allow_parallel_tool_calls: bool = False,
+        **kwargs: Any,
+    ) -> dict[str, Any]:
+        messages = list(chat_history or [])
+        if isinstance(user_msg, str):
+            user_msg = ChatMessage(role="user", content=user_msg)
+        if user_msg is not None:
+            messages.append(user_msg)
+        return {
+            "messages": messages,
+            "tools": tools,
+            "allow_parallel_tool_calls": allow_parallel_tool_calls,
+            **kwargs,
+        }
+
+    def get_tool_calls_from_response(
+        self,
+        response: ChatResponse,
+        error_on_no_tool_call: bool = True,
+        **kwargs: Any,
+    ) -> list[ToolSelection]:
+        tool_calls = response.message.additional_kwargs.get("tool_calls", [])
+        if not tool_calls and error_on_no_tool_call:
+            raise ValueError("Expected at least one tool call, but got 0 tool calls.")
+        return [
+            ToolSelection(
+                tool_id=tool_call["id"],
+                tool_name=tool_call["name"],
+                tool_kwargs=tool_call["arguments"],
+            )
+            for tool_call in tool_calls
+        ]
+
+    def chat(
+        self,
+        messages: Sequence[ChatMessage],
+        tools: Sequence[BaseTool] = (),
+        allow_parallel_tool_calls: bool = False,
+        **kwargs: Any,
+    ) -> ChatResponse:
+        return self._chat_response(messages, tools, allow_parallel_tool_calls)
+
+    async def achat(
+        self,
+        messages: Sequence[ChatMessage],
+        tools: Sequence[BaseTool] = (),
+        allow_parallel_tool_calls: bool = False,
+        **kwargs: Any,
+    ) -> ChatResponse:
+        await self._check_limits()
+        response = self._chat_response(messages, tools, allow_parallel_tool_calls)
+        num_chunks = len(self._chunks(response.message))
+        self._in_flight += 1
+        try:
+            await asyncio.sleep(self._delay(response) + self.token_latency * num_chunks)
+        finally:
+            self._in_flight -= 1
+        return response
+
+    def complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponse:
+        response = self.chat([ChatMessage(role="user", content=prompt)])
+        return CompletionResponse(text=response.message.content or "")
+
+    async def acomplete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponse:
+        response = await self.achat([ChatMessage(role="user", content=prompt)])
+        return CompletionResponse(text=response.message.content or "")
+
+    def stream_chat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponseGen:
+        raise NotImplementedError("Streaming is not supported by the mock LLM.")
+
+    async def astream_chat(
+        self,
+        messages: Sequence[ChatMessage],
+        tools: Sequence[BaseTool] = (),
+        allow_parallel_tool_calls: bool = False,
+        **kwargs: Any,
+    ) -> ChatResponseAsyncGen:
+        await self._check_limits()
+        response = self._chat_response(messages, tools, allow_parallel_tool_calls)
+        self._in_flight += 1
+
+        async def gen() -> ChatResponseAsyncGen:
+            try:
+                loop = asyncio.get_running_loop()
+                start = loop.time() + self._delay(response)
+                content = ""
+                for i, (delta, additional_kwargs) in enumerate(
+                    self._chunks(response.message)
+                ):
+                    # sleep until the chunk is due, so timer overshoot does not accumulate
+                    await asyncio.sleep(
+                        max(0.0, start + (i + 1) * self.token_latency - loop.time())
+                    )
+                    content += delta
+                    yield ChatResponse(
+                        message=ChatMessage(
+                            role="assistant",
+                            content=content,
+                            additional_kwargs=additional_kwargs,
+                        ),
+                        delta=delta,
+                        additional_kwargs=response.additional_kwargs,
+                    )
+            finally:
+                self._in_flight -= 1
+
+        return gen()
+
+    def stream_complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponseGen:
+        raise NotImplementedError("Streaming is not supported by the mock LLM.")
+
+    async def astream_complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponseAsyncGen:
+        raise NotImplementedError("Streaming is not supported by the mock LLM.")
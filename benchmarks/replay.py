@@ -0,0 +1,364 @@
+"""
+Replays scripted conversations (`benchmarks/traces.json`: health coaching with an
+approved tool call, with a rejected one, and information queries) through a
+`SessionManager` backed by the mock function-calling LLM and the user-info stub, and
+compares the results with a stored baseline, so regressions in the workflow are
+caught without an OpenAI endpoint.
+
+Reported: throughput, turn latency percentiles, LLM calls and prompt tokens per
+turn, and memory per session. The mock is deterministic, so the LLM calls and prompt
+tokens must match the baseline almost exactly; timing and memory get a tolerance.
+
+    python -m benchmarks.replay                  # compare with the baseline
+    python -m benchmarks.replay --save-baseline  # record a new baseline
+    python -m benchmarks.replay --speculate --llm-latency 0.3  # speculative routing
+    python -m benchmarks.replay --no-sticky      # route every turn via the orchestrator
+    python -m benchmarks.replay --tiered --llm-latency 0.4 --small-llm-latency 0.15
+
+With `--speculate`, sub-agent calls start while the orchestrator decides; the hit
+rate, latency saved and tokens wasted on wrong guesses are reported, and the extra
+LLM calls and prompt tokens are not counted as regressions.
+
+With `--tiered`, the orchestrator and the Information Agent run on a second, smaller
+mock model that makes a `--mistake-rate` share of invalid tool calls, escalated to
+the full model; the calls, latency and cost per model are reported, and the LLM calls
+and prompt tokens are not counted as regressions. `python -m benchmarks.bench_tiering`
+compares the tiered and the single-model setups.
+
+With `--malformed-rate`, the Health Coach Agent answers with its coaching JSON, that
+share of them malformed, and the answers a client parsing the JSON would reject and
+retry the turn for are counted, as are the repairs of its output schema (off with
+`--no-output-schema`). `python -m benchmarks.bench_output_repair` compares both.
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+from benchmarks.mock_llm import MockFunctionCallingLLM
+from benchmarks.stats import percentile
+from benchmarks.stub_server import UserInfoStub
+from llm_gateway import LLMGateway
+from main import CoachingResponse, get_agent_configs, get_health_coach_tools
+from routing import KeywordRouter, RoutingPolicy
+from serving import SessionManager
+from speculation import Speculator
+from tiering import DEFAULT_PRICES, ModelTiering
+from workflow import SystemAgent, ToolRequestEvent
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+TRACES_PATH = os.path.join(BENCHMARKS_DIR, "traces.json")
+BASELINE_PATH = os.path.join(BENCHMARKS_DIR, "baseline.json")
+# the mock models are billed like the OpenAI models they stand in for
+MOCK_PRICES = {
+    "mock-function-calling": DEFAULT_PRICES["gpt-4o"],
+    "mock-small": DEFAULT_PRICES["gpt-4o-mini"],
+}
+
+# metric: (higher is better, tolerance kind)
+METRICS = {
+    "turns_per_sec": (True, "time"),
+    "turn_p50_ms": (False, "time"),
+    "turn_p90_ms": (False, "time"),
+    "turn_p99_ms": (False, "time"),
+    "llm_calls_per_turn": (False, "exact"),
+    "prompt_tokens_per_turn": (False, "exact"),
+    "memory_per_session_kib": (False, "memory"),
+}
+
+
+def is_valid_coaching_response(response: str) -> bool:
+    """Whether a client parsing the response as the coaching JSON accepts it."""
+    try:
+        CoachingResponse.model_validate_json(response)
+    except ValueError:
+        return False
+    return True
+
+
+def load_traces(path: str) -> list[tuple[str, list[dict]]]:
+    """The conversations to replay, each repeated `weight` times per round."""
+    with open(path, encoding="utf-8") as f:
+        traces = json.load(f)
+    return [
+        (name, trace["turns"])
+        for name, trace in traces.items()
+        for _ in range(trace.get("weight", 1))
+    ]
+
+
+class Replay:
+    """Runs the traces through one `SessionManager` and records every turn."""
+
+    def __init__(self, args: argparse.Namespace, url: str, account: bool = False):
+        agent_configs = get_agent_configs()
+        agent_configs[0].tools = get_health_coach_tools(user_info_url=url)
+        self.llm = MockFunctionCallingLLM(
+            latency=args.llm_latency,
+            token_latency=args.token_latency,
+            structured_answers=args.malformed_rate is not None,
+            malformed_rate=args.malformed_rate or 0.0,
+        )
+        if args.no_output_schema:
+            agent_configs[0].output_schema = None
+        self.output_schema = agent_configs[0].output_schema
+        # JSON answers, and those a client would reject and retry the turn for
+        self.structured_outputs = 0
+        self.invalid_outputs = 0
+        self.llms = [self.llm]
+        # with `account`, the calls are accounted per model with a single model too
+        self.tiering = ModelTiering(prices=MOCK_PRICES) if account else None
+        if args.tiered:
+            small_llm = MockFunctionCallingLLM(
+                model="mock-small",
+                latency=args.small_llm_latency,
+                token_latency=args.small_token_latency,
+                mistake_rate=args.mistake_rate,
+            )
+            self.llms.append(small_llm)
+            # the Information Agent answers without tools
+            agent_configs[1].llm = small_llm
+            self.tiering = ModelTiering(router_llm=small_llm, prices=MOCK_PRICES)
+        self.speculator = None
+        if args.speculate:
+            self.speculator = Speculator(
+                classifier=KeywordRouter.from_agent_configs(agent_configs),
+                max_agents=args.speculate,
+                tokens_per_minute=args.speculation_tpm,
+            )
+        self.manager = SessionManager(
+            # coalescing identical requests depends on timing, so it is off to keep
+            # the LLM calls and prompt tokens deterministic
+            SystemAgent(
+                timeout=None,
+                llm_gateway=LLMGateway(coalesce=False),
+                speculator=self.speculator,
+                routing_policy=RoutingPolicy(sticky=not args.no_sticky),
+                tiering=self.tiering,
+            ),
+            agent_configs,
+            self.llm,
+            idle_timeout=None,
+            approval_handler=self.approve,
+        )
+        self.traces = load_traces(args.traces)
+        self.latencies: dict[str, list[float]] = {name: [] for name, _ in self.traces}
+        # the approval decision of the turn each session is running
+        self._decisions: dict[str, bool] = {}
+
+    async def approve(self, session_id: str, event: ToolRequestEvent) -> bool:
+        return self._decisions.get(session_id, True)
+
+    async def run_session(self, i: int, close: bool = True) -> None:
+        name, turns = self.traces[i % len(self.traces)]
+        session_id = f"{name}-{i}"
+        for turn in turns:
+            self._decisions[session_id] = turn.get("approve", True)
+            start = time.perf_counter()
+            response = await self.manager.chat(session_id, turn["user"])
+            self.latencies[name].append(time.perf_counter() - start)
+            if response and "{" in response:
+                self.structured_outputs += 1
+                self.invalid_outputs += not is_valid_coaching_response(response)
+        self._decisions.pop(session_id, None)
+        if close:
+            self.manager.close_session(session_id)
+
+    async def run(
+        self, num_sessions: int, concurrency: int, close: bool = True
+    ) -> None:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def client(i: int) -> None:
+            async with semaphore:
+                await self.run_session(i, close=close)
+
+        await asyncio.gather(*(client(i) for i in range(num_sessions)))
+
+    @property
+    def num_turns(self) -> int:
+        return sum(len(latencies) for latencies in self.latencies.values())
+
+    @property
+    def num_calls(self) -> int:
+        return sum(llm.num_calls for llm in self.llms)
+
+    @property
+    def num_routing_calls(self) -> int:
+        return sum(llm.num_routing_calls for llm in self.llms)
+
+    @property
+    def prompt_tokens(self) -> int:
+        return sum(sum(llm.prompt_tokens) for llm in self.llms)
+
+
+async def measure(args: argparse.Namespace) -> dict[str, float]:
+    random.seed(0)
+    with UserInfoStub(latency=args.tool_latency) as stub:
+        # warm up imports, compiled prompts and connection pools
+        warmup = Replay(args, stub.url)
+        await warmup.run(len(warmup.traces), args.concurrency)
+        await warmup.manager.stop()
+
+        # the fastest of `--repeat` runs, which is the least disturbed by the machine
+        replay, elapsed = None, float("inf")
+        for _ in range(args.repeat):
+            run = Replay(args, stub.url)
+            start = time.perf_counter()
+            await run.run(args.sessions, args.concurrency)
+            if time.perf_counter() - start < elapsed:
+                replay, elapsed = run, time.perf_counter() - start
+            await run.manager.stop()
+
+        # memory is traced in a separate pass, tracing slows everything down
+        memory_replay = Replay(args, stub.url)
+        gc.collect()
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        await memory_replay.run(args.memory_sessions, args.concurrency, close=False)
+        gc.collect()
+        memory = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+        await memory_replay.manager.stop()
+
+    latencies = [x for values in replay.latencies.values() for x in values]
+    for name, values in replay.latencies.items():
+        print(
+            f"  {name:<26} turns={len(values):5d} "
+            + " ".join(
+                f"p{q}={percentile(values, q) * 1000:6.1f}ms" for q in (50, 90, 99)
+            )
+        )
+    print(
+        f"  llm calls per session={replay.num_calls / args.sessions:.2f} "
+        f"(routing {replay.num_routing_calls / args.sessions:.2f})"
+    )
+    if replay.tiering is not None:
+        for model, stats in replay.tiering.stats().items():
+            print(
+                f"  {model:<26} calls={stats['calls']:5d} "
+                f"escalated={stats['escalation_rate']:5.1%} "
+                f"p50={stats['latency_p50'] * 1000:6.1f}ms "
+                f"p90={stats['latency_p90'] * 1000:6.1f}ms "
+                f"cost per turn=${stats['cost'] / replay.num_turns:.6f}"
+            )
+    if replay.speculator is not None:
+        stats = replay.speculator.stats()
+        print(
+            f"  speculation: started={stats['started']} hits={stats['hits']} "
+            f"misses={stats['misses']} hit rate={stats['hit_rate']:.0%} "
+            f"over budget={stats['over_budget']} "
+            f"saved={stats['latency_saved_per_hit'] * 1000:.1f}ms per hit "
+            f"({stats['latency_saved'] / replay.num_turns * 1000:.1f}ms per turn), "
+            f"wasted tokens={stats['wasted_tokens']}"
+        )
+    if args.malformed_rate is not None:
+        print(
+            f"  coaching JSON answers={replay.structured_outputs} "
+            f"rejected by the client={replay.invalid_outputs}"
+        )
+        if replay.output_schema is not None:
+            print(f"  output schema: {replay.output_schema.stats()}")
+    return {
+        "turns_per_sec": replay.num_turns / elapsed,
+        "turn_p50_ms": percentile(latencies, 50) * 1000,
+        "turn_p90_ms": percentile(latencies, 90) * 1000,
+        "turn_p99_ms": percentile(latencies, 99) * 1000,
+        "llm_calls_per_turn": replay.num_calls / replay.num_turns,
+        "prompt_tokens_per_turn": replay.prompt_tokens / replay.num_turns,
+        "memory_per_session_kib": memory / args.memory_sessions / 1024,
+    }
+
+
+def compare(
+    results: dict[str, float], baseline: dict[str, float], args: argparse.Namespace
+) -> bool:
+    """Prints the results next to the baseline; returns False on a regression."""
+    tolerances = {
+        "time": args.time_tolerance,
+        "memory": args.memory_tolerance,
+        "exact": 0.01,
+    }
+    ok = True
+    print(f"{'metric':<24} {'baseline':>10} {'current':>10} {'change':>8}")
+    for metric, (higher_is_better, kind) in METRICS.items():
+        value, expected = results[metric], baseline.get(metric)
+        if expected is None:
+            print(f"{metric:<24} {'-':>10} {value:>10.2f}")
+            continue
+        change = (value - expected) / expected if expected else 0.0
+        regressed = (-change if higher_is_better else change) > tolerances[kind]
+        # speculation spends extra LLM calls by design, escalations and repairs add
+        # calls, and structured answers change the prompts
+        changed_calls = args.speculate or args.tiered or args.malformed_rate is not None
+        regressed &= not (changed_calls and kind == "exact")
+        ok &= not regressed
+        print(
+            f"{metric:<24} {expected:>10.2f} {value:>10.2f} {change:>+8.1%}"
+            + ("  REGRESSION" if regressed else "")
+        )
+    return ok
+
+
+def main(args: argparse.Namespace) -> int:
+    print(
+        f"replaying {args.sessions} sessions, concurrency={args.concurrency}, "
+        f"llm latency={args.llm_latency * 1000:.0f}ms"
+        + (f", speculating on {args.speculate} agent(s)" if args.speculate else "")
+    )
+    results = asyncio.run(measure(args))
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(
+                {metric: round(value, 3) for metric, value in results.items()},
+                f,
+                indent=2,
+            )
+            f.write("\n")
+        print(f"saved baseline to {args.baseline}")
+        compare(results, {}, args)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}, run with --save-baseline first")
+        return 1
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    return 0 if compare(results, baseline, args) else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=600)
+    parser.add_argument("--memory-sessions", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    # CPU-bound by default, so the numbers reflect the cost of the workflow itself
+    parser.add_argument("--llm-latency", type=float, default=0.0)
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    parser.add_argument("--tool-latency", type=float, default=0.0)
+    parser.add_argument("--traces", default=TRACES_PATH)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    # the number of sub-agents to speculate on while the orchestrator decides
+    parser.add_argument("--speculate", type=int, default=0)
+    parser.add_argument("--speculation-tpm", type=int, default=None)
+    parser.add_argument("--no-sticky", action="store_true")
+    # route and answer information queries on a smaller model
+    parser.add_argument("--tiered", action="store_true")
+    parser.add_argument("--small-llm-latency", type=float, default=0.0)
+    parser.add_argument("--small-token-latency", type=float, default=0.0)
+    parser.add_argument("--mistake-rate", type=float, default=0.05)
+    # answer with the coaching JSON, this share of it malformed
+    parser.add_argument("--malformed-rate", type=float, default=None)
+    parser.add_argument("--no-output-schema", action="store_true")
+    # timing varies between machines and runs more than memory does
+    parser.add_argument("--time-tolerance", type=float, default=0.25)
+    parser.add_argument("--memory-tolerance", type=float, default=0.15)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,12 @@
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile, `q` in [0, 100]."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def format_latencies(values: list[float]) -> str:
+    """Formats p50/p90/p99 of latencies given in seconds as milliseconds."""
+    return " ".join(f"p{q}={percentile(values, q) * 1000:.1f}ms" for q in (50, 90, 99))
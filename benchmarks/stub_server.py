@@ -0,0 +1,62 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+USER_INFO = {
+    "user_persona": {"age": 25, "weight": 70, "height": 180},
+    "user_tasks": ["Walk 1000 steps everyday", "Eat more green vegetables"],
+}
+
+
+class UserInfoStub:
+    """
+    A local stand-in for the user-info service, served from a background thread.
+
+    Every request sleeps for `latency` seconds before answering, so the stub behaves
+    like a remote API without blocking the event loop of the benchmark itself.
+    """
+
+    def __init__(self, latency: float = 0.1, port: int = 0):
+        self.latency = latency
+        self.num_requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body are sent separately; don't let Nagle's algorithm
+            # hold the body back for a delayed ACK
+            disable_nagle_algorithm = True
+
+            def do_GET(self) -> None:
+                stub.num_requests += 1
+                time.sleep(stub.latency)
+                if self.path != "/user-info":
+                    self.send_error(404)
+                    return
+                body = json.dumps(USER_INFO).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args: object) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/user-info"
+
+    def __enter__(self) -> "UserInfoStub":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,210 @@
+import json
+import sqlite3
+import time
+import zlib
+from typing import Any
+
+from llama_index.core.llms import ChatMessage
+from llama_index.core.workflow import Context
+
+from conversation import ConversationSnapshot, ConversationStore
+from session_state import get_session_state
+
+# the context keys a checkpoint carries besides the conversation and the fields of the
+# session state; everything else in the context (LLM client, agent configs, tools,
+# derived prompt caches) is rebuilt by the run
+CHECKPOINT_KEYS = (
+    "history_summary",
+    "history_summarized_upto",
+    "tool_cache_scope",
+)
+
+# one-byte tags in front of every encoded record
+_JSON = b"\x00"
+_ZLIB = b"\x01"
+# records shorter than this rarely shrink when compressed
+_MIN_COMPRESS_SIZE = 32
+# primes zlib with the keys every message record repeats, which matters for records
+# as short as single chat messages
+_ZLIB_DICT = (
+    b'"tool_call_id":"call_"}},{"role":"tool","content":"'
+    b'{"role":"assistant","content":null,"additional_kwargs":{"tool_calls":'
+    b'[{"id":"call_","type":"function","function":{"name":"","arguments":"{}"}}]'
+    b'{"role":"user","content":"'
+)
+
+
+def _json_default(value: Any) -> Any:
+    # e.g. the tool calls an LLM integration leaves in `additional_kwargs`
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json")
+    return str(value)
+
+
+def encode(value: Any) -> bytes:
+    """Compact JSON, zlib-compressed when that makes it smaller."""
+    data = json.dumps(value, separators=(",", ":"), default=_json_default).encode()
+    if len(data) >= _MIN_COMPRESS_SIZE:
+        compressor = zlib.compressobj(zdict=_ZLIB_DICT)
+        compressed = compressor.compress(data) + compressor.flush()
+        if len(compressed) < len(data):
+            return _ZLIB + compressed
+    return _JSON + data
+
+
+def decode(data: bytes) -> Any:
+    tag, body = data[:1], data[1:]
+    if tag == _ZLIB:
+        body = zlib.decompressobj(zdict=_ZLIB_DICT).decompress(body)
+    elif tag != _JSON:
+        raise ValueError(f"Unknown checkpoint record tag {tag!r}")
+    return json.loads(body)
+
+
+def message_to_dict(message: ChatMessage) -> dict:
+    data = {"role": message.role.value, "content": message.content}
+    if message.additional_kwargs:
+        data["additional_kwargs"] = message.additional_kwargs
+    return data
+
+
+def message_from_dict(data: dict) -> ChatMessage:
+    return ChatMessage(
+        role=data["role"],
+        content=data["content"],
+        additional_kwargs=data.get("additional_kwargs", {}),
+    )
+
+
+class SQLiteCheckpointer:
+    """
+    Persists the conversation and user state of sessions in a local SQLite database,
+    so they survive restarts and can be picked up by any worker sharing the file.
+
+    Only data is stored: messages as append-only rows, and a small head record with
+    the turn boundaries and the `CHECKPOINT_KEYS`. Each checkpoint writes the messages
+    added since the previous one and rewrites the head only when it changed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, head BLOB NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "session_id TEXT NOT NULL, idx INTEGER NOT NULL, data BLOB NOT NULL, "
+            "PRIMARY KEY (session_id, idx)) WITHOUT ROWID"
+        )
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def __contains__(self, session_id: str) -> bool:
+        return (
+            self._conn.execute(
+                "SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            is not None
+        )
+
+    async def save(
+        self, ctx: Context, session_id: str, turn_complete: bool = False
+    ) -> int:
+        """
+        Checkpoints the session held in `ctx` and returns the number of bytes written.
+
+        `turn_complete` marks the end of a turn; a session restored from a checkpoint
+        taken mid-turn drops that unfinished turn.
+        """
+        state = await get_session_state(ctx)
+        conversation = state.conversation
+        if conversation is None:
+            return 0
+
+        head = encode(
+            {
+                "num_messages": len(conversation),
+                "turn_starts": conversation.turn_starts,
+                "turn_complete": turn_complete,
+                "state": {
+                    **state.checkpoint_fields(),
+                    **{
+                        key: await ctx.get(key, default=None) for key in CHECKPOINT_KEYS
+                    },
+                },
+            }
+        )
+        start = conversation.persisted_length
+        records = [
+            (session_id, idx, encode(message_to_dict(message)))
+            for idx, message in enumerate(conversation.messages[start:], start)
+        ]
+        if not records and head == await ctx.get("checkpoint_head", default=None):
+            return 0
+
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "DELETE FROM messages WHERE session_id = ? AND idx >= ?",
+                (session_id, start),
+            )
+            self._conn.executemany("INSERT INTO messages VALUES (?, ?, ?)", records)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)",
+                (session_id, head, time.time()),
+            )
+        conversation.mark_persisted()
+        await ctx.set("checkpoint_head", head)
+        return len(head) + sum(len(record[2]) for record in records)
+
+    async def restore(self, ctx: Context, session_id: str) -> bool:
+        """Loads the checkpoint of `session_id` into `ctx`; False if there is none."""
+        row = self._conn.execute(
+            "SELECT head FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return False
+        head = decode(row[0])
+        rows = self._conn.execute(
+            "SELECT data FROM messages WHERE session_id = ? AND idx < ? ORDER BY idx",
+            (session_id, head["num_messages"]),
+        ).fetchall()
+
+        conversation = ConversationStore(
+            [message_from_dict(decode(data)) for (data,) in rows],
+            turn_starts=head["turn_starts"],
+        )
+        conversation.mark_persisted()
+        if not head["turn_complete"] and conversation.num_turns:
+            # the worker stopped mid-turn; the user never got an answer to it
+            last_turn_start = conversation.turn_starts[-1]
+            conversation.rollback(
+                ConversationSnapshot(store=conversation, length=last_turn_start)
+            )
+
+        state = await get_session_state(ctx)
+        state.conversation = conversation
+        state.restore_checkpoint_fields(head["state"])
+        for key in CHECKPOINT_KEYS:
+            if head["state"].get(key) is not None:
+                await ctx.set(key, head["state"][key])
+        await ctx.set("checkpoint_head", row[0])
+        return True
+
+    def delete(self, session_id: str) -> None:
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "DELETE FROM messages WHERE session_id = ?", (session_id,)
+            )
+            self._conn.execute(
+                "DELETE FROM sessions WHERE session_id = ?", (session_id,)
+            )
+
+    def close(self) -> None:
+        self._conn.close()
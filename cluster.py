@@ -0,0 +1,428 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+from bisect import bisect
+from dataclasses import dataclass, field
+from multiprocessing.process import BaseProcess
+from typing import Any, Callable, Iterable
+
+from serving import ServerBusyError, SessionManager
+
+ManagerFactory = Callable[[], SessionManager]
+
+# requests and replies are JSON lines; a reply holds a whole agent response
+MAX_MESSAGE_BYTES = 2**24
+
+
+class WorkerError(RuntimeError):
+    """Raised when a worker fails a request or exits while serving it."""
+
+
+class HashRing:
+    """
+    Consistent hashing of session ids onto workers.
+
+    Each worker owns `replicas` points of the ring, so adding or removing a worker
+    only moves the sessions of about 1/N of the ring.
+    """
+
+    def __init__(self, nodes: Iterable[int] = (), replicas: int = 64):
+        self.replicas = replicas
+        self._nodes: set[int] = set()
+        self._points: list[int] = []
+        self._owners: list[int] = []
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big")
+
+    def _rebuild(self) -> None:
+        ring = sorted(
+            (self._hash(f"{node}:{replica}"), node)
+            for node in self._nodes
+            for replica in range(self.replicas)
+        )
+        self._points = [point for point, _ in ring]
+        self._owners = [node for _, node in ring]
+
+    def add(self, node: int) -> None:
+        self._nodes.add(node)
+        self._rebuild()
+
+    def remove(self, node: int) -> None:
+        self._nodes.discard(node)
+        self._rebuild()
+
+    def node_for(self, key: str) -> int:
+        if not self._points:
+            raise ValueError("The ring has no nodes!")
+        i = bisect(self._points, self._hash(key)) % len(self._points)
+        return self._owners[i]
+
+
+# ---- worker process ----
+
+
+def _run_worker(worker_id: int, manager_factory: ManagerFactory, path: str) -> None:
+    """The entry point of a worker process."""
+    # the pool shuts its workers down; SIGTERM drains the worker
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_serve(manager_factory, path))
+
+
+async def _serve(manager_factory: ManagerFactory, path: str) -> None:
+    manager = manager_factory()
+    # compile the prompts and tool schemas before the first turn
+    for agent_config in manager.agent_configs:
+        agent_config.compile()
+    await manager.start()
+
+    draining = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, draining.set)
+    requests: set[asyncio.Task] = set()
+    writers: list[asyncio.StreamWriter] = []
+
+    async def handle(
+        reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        writers.append(writer)
+        while line := await reader.readline():
+            request = json.loads(line)
+            if request["op"] == "drain":
+                # the pool sends nothing after it
+                break
+            task = asyncio.create_task(_handle_request(manager, request, writer))
+            requests.add(task)
+            task.add_done_callback(requests.discard)
+        # drained, or the pool went away
+        draining.set()
+
+    server = await asyncio.start_unix_server(handle, path, limit=MAX_MESSAGE_BYTES)
+    await draining.wait()
+    server.close()
+    # finish the turns already started, then leave
+    while requests:
+        await asyncio.gather(*requests, return_exceptions=True)
+    await manager.stop()
+    for writer in writers:
+        writer.close()
+
+
+async def _handle_request(
+    manager: SessionManager, request: dict[str, Any], writer: asyncio.StreamWriter
+) -> None:
+    reply: dict[str, Any] = {"id": request["id"]}
+    try:
+        op = request["op"]
+        if op == "chat":
+            reply["result"] = await manager.chat(
+                request["session_id"], request["user_msg"]
+            )
+        elif op == "resolve_approvals":
+            reply["result"] = await manager.resolve_approvals(
+                request["session_id"], request["decisions"], request.get("reason")
+            )
+        elif op == "close_session":
+            manager.close_session(request["session_id"])
+        elif op == "stats":
+            reply["result"] = manager.stats()
+        else:
+            raise ValueError(f"Unknown operation {op!r}")
+    except Exception as e:
+        reply["error"] = type(e).__name__
+        reply["message"] = str(e)
+    if not writer.is_closing():
+        writer.write(json.dumps(reply).encode() + b"\n")
+
+
+# ---- pool ----
+
+
+@dataclass
+class _Worker:
+    worker_id: int
+    process: BaseProcess | None = None
+    writer: asyncio.StreamWriter | None = None
+    reader_task: asyncio.Task | None = None
+    # requests sent to the worker, by request id
+    pending: dict[int, asyncio.Future] = field(default_factory=dict)
+    # cleared while the worker (re)starts; requests wait for it
+    ready: asyncio.Event = field(default_factory=asyncio.Event)
+    draining: bool = False
+    # replaces the worker after it exited unexpectedly
+    replace_task: asyncio.Task | None = None
+    # why requests can't be served, e.g. it could not be replaced; they fail with it
+    # until the worker is started again
+    error: str | None = None
+
+
+class WorkerPool:
+    """
+    Serves sessions from `num_workers` processes, so prompt building, validation and
+    JSON work use more than one core.
+
+    Each worker runs its own `SessionManager`, built by `manager_factory` in the worker
+    (a module-level function or a `functools.partial` of one, as it is pickled), and
+    compiles its agents' prompts and tool schemas before serving. Sessions are routed
+    to workers by consistent hashing of the session id, so each session's `Context`
+    stays in one worker. Approval and event handlers of the managers run in the
+    workers.
+
+    `restart_worker` and `rolling_restart` drain a worker: its new turns wait while
+    the turns it started finish, then a new worker takes over its sessions. Sessions
+    keep their conversations across a restart only if the workflow has a
+    checkpointer; the same holds for a worker that exits unexpectedly, which is
+    replaced, failing its pending requests with `WorkerError`. A replacement that
+    fails to start is retried `restart_attempts` times with exponential backoff;
+    after that, the worker's requests fail with `WorkerError` until
+    `restart_worker` starts it again. A worker still busy `drain_timeout` seconds
+    after a drain is killed.
+    """
+
+    def __init__(
+        self,
+        manager_factory: ManagerFactory,
+        num_workers: int | None = None,
+        replicas: int = 64,
+        start_timeout: float = 60.0,
+        drain_timeout: float | None = 60.0,
+        restart_attempts: int = 3,
+        restart_backoff: float = 1.0,
+    ):
+        self.manager_factory = manager_factory
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.ring = HashRing(range(self.num_workers), replicas=replicas)
+        self.start_timeout = start_timeout
+        self.drain_timeout = drain_timeout
+        self.restart_attempts = restart_attempts
+        self.restart_backoff = restart_backoff
+        # spawned rather than forked, the parent's event loop and threads don't carry over
+        self._mp_context = multiprocessing.get_context("spawn")
+        self._workers = {i: _Worker(i) for i in range(self.num_workers)}
+        self._request_ids = itertools.count()
+        self._socket_dir: str | None = None
+        self._stopping = False
+
+    # ---- lifecycle ----
+
+    async def start(self) -> None:
+        """Starts the workers and waits until they all serve."""
+        self._socket_dir = tempfile.mkdtemp(prefix="workers-")
+        self._stopping = False
+        try:
+            await asyncio.gather(
+                *(self._spawn(worker) for worker in self._workers.values())
+            )
+        except BaseException:
+            # stop the workers that did start
+            await self.stop()
+            raise
+
+    async def stop(self) -> None:
+        """Drains and stops every worker."""
+        self._stopping = True
+        replacing = [
+            worker.replace_task
+            for worker in self._workers.values()
+            if worker.replace_task is not None
+        ]
+        for task in replacing:
+            task.cancel()
+        await asyncio.gather(*replacing, return_exceptions=True)
+        await asyncio.gather(
+            *(
+                self._drain(worker)
+                for worker in self._workers.values()
+                if worker.reader_task is not None
+            )
+        )
+        # requests still waiting for a worker fail rather than wait forever
+        for worker in self._workers.values():
+            worker.error = "The worker pool is stopped"
+            worker.ready.set()
+        if self._socket_dir is not None:
+            shutil.rmtree(self._socket_dir, ignore_errors=True)
+            self._socket_dir = None
+
+    async def __aenter__(self) -> "WorkerPool":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.stop()
+
+    async def _spawn(self, worker: _Worker) -> None:
+        path = os.path.join(self._socket_dir, f"worker-{worker.worker_id}.sock")
+        if os.path.exists(path):
+            os.unlink(path)
+        process = self._mp_context.Process(
+            target=_run_worker,
+            args=(worker.worker_id, self.manager_factory, path),
+            name=f"worker-{worker.worker_id}",
+        )
+        process.start()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.start_timeout
+        # the worker listens once it has imported and built its manager
+        try:
+            while True:
+                try:
+                    reader, writer = await asyncio.open_unix_connection(
+                        path, limit=MAX_MESSAGE_BYTES
+                    )
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    if not process.is_alive() or loop.time() > deadline:
+                        raise WorkerError(
+                            f"Worker {worker.worker_id} failed to start"
+                        ) from None
+                    await asyncio.sleep(0.05)
+        except BaseException:
+            process.kill()
+            await asyncio.to_thread(process.join)
+            raise
+        worker.process, worker.writer = process, writer
+        worker.reader_task = asyncio.create_task(self._read_replies(worker, reader))
+        worker.error = None
+        worker.ready.set()
+
+    async def _read_replies(
+        self, worker: _Worker, reader: asyncio.StreamReader
+    ) -> None:
+        while line := await reader.readline():
+            reply = json.loads(line)
+            future = worker.pending.get(reply["id"])
+            if future is not None and not future.done():
+                future.set_result(reply)
+        # the worker exited
+        for future in worker.pending.values():
+            if not future.done():
+                future.set_exception(
+                    WorkerError(f"Worker {worker.worker_id} exited during the request")
+                )
+        if not worker.draining and not self._stopping:
+            worker.ready.clear()
+            worker.replace_task = asyncio.create_task(self._replace(worker))
+
+    async def _replace(self, worker: _Worker) -> None:
+        await asyncio.to_thread(worker.process.join)
+        error = None
+        try:
+            for attempt in range(self.restart_attempts):
+                if attempt:
+                    await asyncio.sleep(self.restart_backoff * 2 ** (attempt - 1))
+                try:
+                    await self._spawn(worker)
+                    return
+                except Exception as e:
+                    error = e
+            # wake up the waiting requests, which fail
+            worker.error = f"Worker {worker.worker_id} could not be restarted: {error}"
+            worker.ready.set()
+        finally:
+            worker.replace_task = None
+
+    async def _drain(self, worker: _Worker) -> None:
+        """Lets the worker finish the turns it started, then waits until it exits."""
+        worker.ready.clear()
+        worker.draining = True
+        try:
+            if not worker.writer.is_closing():
+                worker.writer.write(b'{"op": "drain"}\n')
+            try:
+                await asyncio.wait_for(
+                    asyncio.shield(worker.reader_task), self.drain_timeout
+                )
+            except TimeoutError:
+                # SIGTERM would only ask it to drain again
+                worker.process.kill()
+                await worker.reader_task
+            await asyncio.to_thread(worker.process.join)
+            worker.writer.close()
+        finally:
+            worker.draining = False
+
+    async def restart_worker(self, worker_id: int) -> None:
+        """Drains the worker and starts a new one for its sessions."""
+        worker = self._workers[worker_id]
+        await self._drain(worker)
+        await self._spawn(worker)
+
+    async def rolling_restart(self) -> None:
+        """Restarts the workers one at a time, the others keep serving."""
+        for worker_id in self._workers:
+            await self.restart_worker(worker_id)
+
+    # ---- requests ----
+
+    def worker_for(self, session_id: str) -> int:
+        return self.ring.node_for(session_id)
+
+    async def _request(self, worker_id: int, op: str, **fields: Any) -> Any:
+        worker = self._workers[worker_id]
+        # checked again after waking up, the worker may be draining by then
+        while not worker.ready.is_set():
+            await worker.ready.wait()
+        if worker.error is not None:
+            raise WorkerError(worker.error)
+        request_id = next(self._request_ids)
+        future = asyncio.get_running_loop().create_future()
+        worker.pending[request_id] = future
+        try:
+            worker.writer.write(
+                json.dumps({"id": request_id, "op": op, **fields}).encode() + b"\n"
+            )
+            await worker.writer.drain()
+            reply = await future
+        finally:
+            worker.pending.pop(request_id, None)
+        if "error" in reply:
+            if reply["error"] == ServerBusyError.__name__:
+                raise ServerBusyError(reply["message"])
+            raise WorkerError(f"{reply['error']}: {reply['message']}")
+        return reply.get("result")
+
+    async def chat(self, session_id: str, user_msg: str) -> str | None:
+        """Runs one turn of `session_id` in its worker, see `SessionManager.chat`."""
+        return await self._request(
+            self.worker_for(session_id),
+            "chat",
+            session_id=session_id,
+            user_msg=user_msg,
+        )
+
+    async def resolve_approvals(
+        self,
+        session_id: str,
+        decisions: dict[str, bool] | bool,
+        reason: str | None = None,
+    ) -> str | None:
+        """See `SessionManager.resolve_approvals`."""
+        return await self._request(
+            self.worker_for(session_id),
+            "resolve_approvals",
+            session_id=session_id,
+            decisions=decisions,
+            reason=reason,
+        )
+
+    async def close_session(self, session_id: str) -> None:
+        await self._request(
+            self.worker_for(session_id), "close_session", session_id=session_id
+        )
+
+    async def stats(self) -> dict[int, dict[str, int]]:
+        """The `SessionManager.stats` of every worker, by worker id."""
+        stats = await asyncio.gather(
+            *(self._request(worker_id, "stats") for worker_id in self._workers)
+        )
+        return dict(zip(self._workers, stats))
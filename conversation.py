@@ -0,0 +1,110 @@
+from dataclasses import dataclass
+from itertools import islice
+from typing import Iterator
+
+from llama_index.core.llms import ChatMessage
+
+
+@dataclass(frozen=True)
+class ConversationSnapshot:
+    """
+    A read-only view of a conversation at a point in time.
+
+    Taking a snapshot is O(1): since the log is append-only, the view only records
+    the length of the log when it was taken.
+    """
+
+    store: "ConversationStore"
+    length: int
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self) -> Iterator[ChatMessage]:
+        return islice(self.store.messages, self.length)
+
+    def __getitem__(self, index: int) -> ChatMessage:
+        if not -self.length <= index < self.length:
+            raise IndexError("snapshot index out of range")
+        return self.store.messages[index % self.length]
+
+    def to_list(self) -> list[ChatMessage]:
+        return self.store.messages[: self.length]
+
+
+class ConversationStore:
+    """
+    The append-only message log of one session, kept in the workflow `Context`.
+
+    Each turn records where it starts, so the messages a turn appended can be read
+    back as a delta without scanning the history. `messages` is the same list the
+    workflow steps see as `chat_history`.
+    """
+
+    def __init__(
+        self,
+        messages: list[ChatMessage] | None = None,
+        turn_starts: list[int] | None = None,
+    ):
+        # copy, so the caller's list is never mutated by the workflow
+        self.messages: list[ChatMessage] = list(messages or [])
+        self._turn_starts: list[int] = list(turn_starts or [])
+        # the messages before this index are unchanged since the last checkpoint
+        self._persisted_length = 0
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    @property
+    def num_turns(self) -> int:
+        return len(self._turn_starts)
+
+    @property
+    def is_first_turn(self) -> bool:
+        """Whether the current turn opened the conversation."""
+        return self._turn_starts[-1:] == [0]
+
+    @property
+    def turn_starts(self) -> list[int]:
+        return list(self._turn_starts)
+
+    @property
+    def persisted_length(self) -> int:
+        return self._persisted_length
+
+    def mark_persisted(self) -> None:
+        """Records that every message up to now has been checkpointed."""
+        self._persisted_length = len(self.messages)
+
+    def append(self, message: ChatMessage) -> None:
+        self.messages.append(message)
+
+    def begin_turn(self, user_msg: ChatMessage) -> None:
+        """Marks the start of a new turn and appends its user message."""
+        self._turn_starts.append(len(self.messages))
+        self.messages.append(user_msg)
+
+    def turn_delta(self, turn: int = -1) -> list[ChatMessage]:
+        """Returns the messages appended during `turn` (the latest one by default)."""
+        if not self._turn_starts:
+            return []
+        turn = turn % len(self._turn_starts)
+        start = self._turn_starts[turn]
+        end = (
+            self._turn_starts[turn + 1]
+            if turn + 1 < len(self._turn_starts)
+            else len(self.messages)
+        )
+        return self.messages[start:end]
+
+    def snapshot(self) -> ConversationSnapshot:
+        return ConversationSnapshot(store=self, length=len(self.messages))
+
+    def rollback(self, snapshot: ConversationSnapshot) -> None:
+        """Drops every message appended after `snapshot` was taken."""
+        if snapshot.store is not self:
+            raise ValueError("Snapshot belongs to a different conversation!")
+        del self.messages[snapshot.length :]
+        self._persisted_length = min(self._persisted_length, snapshot.length)
+        while self._turn_starts and self._turn_starts[-1] >= snapshot.length:
+            self._turn_starts.pop()
@@ -0,0 +1,19 @@
+import argparse
+
+from workflow import SystemAgent
+
+
+def main() -> None:
+    """Draws all possible flows of the workflow to an HTML file."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--filename", default="workflow.html")
+    args = parser.parse_args()
+
+    # the visualization dependency is only needed here
+    from llama_index.utils.workflow import draw_all_possible_flows
+
+    draw_all_possible_flows(SystemAgent(), filename=args.filename)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+from dataclasses import dataclass, field
+from typing import Literal
+
+from llama_index.core.llms import ChatMessage
+from pydantic import BaseModel
+
+DEFAULT_FAN_OUT_PROMPT = (
+    "If the user's message needs several of the agents, call TransferToAgent once for "
+    "each of them; they will answer at the same time."
+)
+DEFAULT_MERGE_PROMPT = (
+    "Several agents answered parts of the user's message. Combine their answers into "
+    "one response to the user. Keep every fact and recommendation, drop repetitions, "
+    "and do not mention the agents."
+)
+FAN_OUT_APPROVAL_REASON = (
+    "Tools that need approval cannot run while several agents answer at once. "
+    "Ask the user to continue with you to use this tool."
+)
+
+
+class FanOutPolicy(BaseModel):
+    """
+    Lets the orchestrator hand a turn to several agents at once.
+
+    When the orchestrator picks more than one agent, each runs its own tool loop
+    concurrently on a copy of the history, and their answers are merged into one
+    response: with an LLM call (`merge="llm"`) or by joining them under the agents'
+    names (`merge="concat"`). Only the merged answer is added
+    to the conversation. If one branch fails or exceeds `branch_timeout`, the others
+    are cancelled and the turn fails.
+    """
+
+    # agents per turn; further transfers picked by the orchestrator are dropped
+    max_agents: int = 3
+    # branches running at once across all sessions of the workflow
+    max_concurrent_branches: int | None = None
+    # LLM calls per branch; the last one is made without tools so the agent answers
+    max_llm_calls: int = 4
+    branch_timeout: float | None = None
+    merge: Literal["llm", "concat"] = "llm"
+    orchestrator_prompt: str = DEFAULT_FAN_OUT_PROMPT
+    merge_prompt: str = DEFAULT_MERGE_PROMPT
+
+
+@dataclass(slots=True)
+class BranchResult:
+    """The answer of one agent of a fan-out, and the messages of its branch."""
+
+    agent_name: str
+    content: str
+    messages: list[ChatMessage] = field(default_factory=list)
+
+
+def concat_branches(branches: list[BranchResult]) -> str:
+    """Joins the answers under the agents' names, or returns the only answer as is."""
+    if len(branches) == 1:
+        return branches[0].content
+    return "\n\n".join(f"{b.agent_name}:\n{b.content}" for b in branches)
+
+
+def merge_input(
+    merge_prompt: str, user_msg: str | None, branches: list[BranchResult]
+) -> list[ChatMessage]:
+    """The LLM input of the merge call."""
+    answers = "\n\n".join(
+        f'<answer agent="{b.agent_name}">\n{b.content}\n</answer>' for b in branches
+    )
+    return [
+        ChatMessage(role="system", content=merge_prompt),
+        ChatMessage(
+            role="user",
+            content=f"User message:\n{user_msg or ''}\n\nAnswers:\n{answers}",
+        ),
+    ]
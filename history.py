@@ -0,0 +1,200 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Callable
+
+from llama_index.core.llms import ChatMessage, LLM
+from llama_index.core.utils import get_tokenizer
+from llama_index.core.workflow import Context
+
+from llm_gateway import LLMGateway
+
+DEFAULT_SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and an assistant.\n"
+    "Fold the new messages into the existing summary. Keep the user's goals, facts about "
+    "the user, decisions made, tool results and any open questions. Be concise.\n\n"
+    "Existing summary:\n{summary}\n\n"
+    "New messages:\n{transcript}"
+)
+SUMMARY_MESSAGE_PREFIX = "Summary of the earlier conversation:\n"
+
+
+@dataclass
+class HistoryWindow:
+    """The LLM input chosen by `HistoryManager.window` and its token accounting."""
+
+    messages: list[ChatMessage]
+    prompt_tokens: int
+    history_tokens: int
+    num_dropped: int
+
+
+class HistoryManager:
+    """
+    Keeps the chat history sent to the LLM within a token budget.
+
+    The newest messages are kept until the budget is spent; an assistant message with
+    tool calls is always kept or dropped together with its tool results. Messages that
+    fall out of the window are folded into a rolling summary by a background task, so
+    summarization never delays the current turn; the summary is prepended once ready.
+
+    Token counts are cached per session, so each message is tokenized only once.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = 4000,
+        summarize: bool = True,
+        summary_prompt: str | None = None,
+        tokenizer: Callable[[str], list] | None = None,
+        llm_gateway: LLMGateway | None = None,
+    ):
+        self.token_budget = token_budget
+        self.summarize = summarize
+        self.summary_prompt = summary_prompt or DEFAULT_SUMMARY_PROMPT
+        self._tokenizer = tokenizer
+        # set by `SystemAgent` to its own gateway if not given
+        self.llm_gateway = llm_gateway
+        self._summary_tasks: dict[int, asyncio.Task] = {}
+
+    @property
+    def tokenizer(self) -> Callable[[str], list]:
+        if self._tokenizer is None:
+            self._tokenizer = get_tokenizer()
+        return self._tokenizer
+
+    def count_tokens(self, message: ChatMessage) -> int:
+        text = message.content or ""
+        tool_calls = message.additional_kwargs.get("tool_calls")
+        if tool_calls:
+            text += str(tool_calls)
+        # every message carries a few tokens of role/formatting overhead
+        return len(self.tokenizer(text)) + 4
+
+    async def _token_counts(
+        self, ctx: Context, chat_history: list[ChatMessage]
+    ) -> list[int]:
+        """Token count of every message, tokenizing only the ones appended since the last call."""
+        history_id, token_counts = await ctx.get(
+            "history_token_counts", default=(None, [])
+        )
+        if history_id != id(chat_history) or len(token_counts) > len(chat_history):
+            # the history was replaced rather than appended to, start over
+            token_counts = []
+        for message in chat_history[len(token_counts) :]:
+            token_counts.append(self.count_tokens(message))
+        await ctx.set("history_token_counts", (id(chat_history), token_counts))
+        return token_counts
+
+    @staticmethod
+    def _unit_starts(chat_history: list[ChatMessage]) -> list[int]:
+        """Indices where a droppable unit starts; tool results stick to the call before them."""
+        return [
+            i
+            for i, message in enumerate(chat_history)
+            if i == 0 or message.role != "tool"
+        ]
+
+    async def window(
+        self,
+        ctx: Context,
+        system_prompt: str,
+        chat_history: list[ChatMessage],
+        llm: LLM,
+        token_budget: int | None = None,
+        state_prompt: str | None = None,
+    ) -> HistoryWindow:
+        """
+        Builds the LLM input (system prompt, summary, recent messages, state prompt)
+        within the budget.
+
+        The most recent unit is always kept, even when it alone exceeds the budget.
+        """
+        token_budget = token_budget or self.token_budget
+        token_counts = await self._token_counts(ctx, chat_history)
+        system_message = ChatMessage(role="system", content=system_prompt)
+        system_tokens = self.count_tokens(system_message)
+        state_messages = []
+        if state_prompt:
+            state_messages.append(ChatMessage(role="system", content=state_prompt))
+            system_tokens += self.count_tokens(state_messages[0])
+
+        summary = await ctx.get("history_summary", default="")
+        summary_message = ChatMessage(
+            role="system", content=SUMMARY_MESSAGE_PREFIX + summary
+        )
+        summary_tokens = self.count_tokens(summary_message) if summary else 0
+
+        start = unit_end = len(chat_history)
+        num_tokens = system_tokens
+        for unit_start in reversed(self._unit_starts(chat_history)):
+            unit_tokens = sum(token_counts[unit_start:unit_end])
+            if (
+                start < len(chat_history)
+                and num_tokens + unit_tokens + summary_tokens > token_budget
+            ):
+                break
+            num_tokens += unit_tokens
+            start = unit_end = unit_start
+
+        messages = [system_message]
+        if start > 0:
+            if self.summarize:
+                self._schedule_summary(ctx, chat_history, start, llm)
+            if summary:
+                messages.append(summary_message)
+                num_tokens += summary_tokens
+
+        return HistoryWindow(
+            messages=messages + chat_history[start:] + state_messages,
+            prompt_tokens=num_tokens,
+            history_tokens=sum(token_counts),
+            num_dropped=start,
+        )
+
+    def _schedule_summary(
+        self, ctx: Context, chat_history: list[ChatMessage], end: int, llm: LLM
+    ) -> None:
+        task = self._summary_tasks.get(id(ctx))
+        if task is not None and not task.done():
+            # the next turn picks up whatever this one could not fold in
+            return
+        self._summary_tasks[id(ctx)] = asyncio.create_task(
+            self._summarize(ctx, chat_history[:end], llm)
+        )
+
+    async def _summarize(
+        self, ctx: Context, dropped: list[ChatMessage], llm: LLM
+    ) -> None:
+        try:
+            summarized_upto = await ctx.get("history_summarized_upto", default=0)
+            new_messages = dropped[summarized_upto:]
+            if not new_messages:
+                return
+
+            summary = await ctx.get("history_summary", default="")
+            transcript = "\n".join(
+                f"{message.role.value}: {message.content}"
+                for message in new_messages
+                if message.content
+            )
+            messages = [
+                ChatMessage(
+                    role="user",
+                    content=self.summary_prompt.format(
+                        summary=summary or "(none)", transcript=transcript
+                    ),
+                )
+            ]
+            if self.llm_gateway is None:
+                response = await llm.achat(messages)
+            else:
+                response = await self.llm_gateway.achat(
+                    llm, messages, agent_name="history_summary", session=id(ctx)
+                )
+            await ctx.set("history_summary", response.message.content or summary)
+            await ctx.set("history_summarized_upto", len(dropped))
+        except Exception:
+            # the summary is best-effort; the next turn that drops messages retries it
+            pass
+        finally:
+            self._summary_tasks.pop(id(ctx), None)
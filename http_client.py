@@ -0,0 +1,118 @@
+import asyncio
+import random
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    import aiohttp
+
+DEFAULT_RETRY_STATUSES = (429, 502, 503, 504)
+
+
+class AsyncHttpClient:
+    """
+    A pooled, keep-alive HTTP client shared by the tools of a workflow.
+
+    The underlying `aiohttp.ClientSession` is created lazily on the first request,
+    so the client can be constructed outside of a running event loop (e.g. in
+    `SystemAgent.__init__`) and closed with `aclose()` when the workflow shuts down.
+    """
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 20,
+        timeout: float = 10.0,
+        connect_timeout: float = 2.0,
+        max_retries: int = 2,
+        backoff: float = 0.1,
+        retry_statuses: tuple[int, ...] = DEFAULT_RETRY_STATUSES,
+        keepalive_timeout: float = 30.0,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.retry_statuses = retry_statuses
+        self.keepalive_timeout = keepalive_timeout
+        self._session: "aiohttp.ClientSession | None" = None
+
+    @property
+    def closed(self) -> bool:
+        return self._session is None or self._session.closed
+
+    def _get_session(self) -> "aiohttp.ClientSession":
+        if self.closed:
+            # imported on first use, aiohttp adds noticeably to the startup time
+            import aiohttp
+
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(
+                    total=self.timeout, connect=self.connect_timeout
+                ),
+            )
+        return self._session
+
+    async def request(self, method: str, url: str, **kwargs: Any) -> Any:
+        """
+        Send a request and return the decoded JSON body (or text for non-JSON responses).
+
+        Connection errors, timeouts and `retry_statuses` are retried with exponential
+        backoff and jitter; any other error status raises `aiohttp.ClientResponseError`.
+        """
+        import aiohttp
+
+        session = self._get_session()
+        attempt = 0
+        while True:
+            try:
+                async with session.request(method, url, **kwargs) as response:
+                    if (
+                        response.status in self.retry_statuses
+                        and attempt < self.max_retries
+                    ):
+                        raise _RetryableStatus(response.status)
+                    response.raise_for_status()
+                    if response.content_type == "application/json":
+                        return await response.json()
+                    return await response.text()
+            except (
+                _RetryableStatus,
+                aiohttp.ClientConnectionError,
+                asyncio.TimeoutError,
+            ):
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                delay = self.backoff * (2 ** (attempt - 1))
+                await asyncio.sleep(delay + random.uniform(0, delay))
+
+    async def get_json(self, url: str, **kwargs: Any) -> Any:
+        return await self.request("GET", url, **kwargs)
+
+    async def post_json(self, url: str, json: Any = None, **kwargs: Any) -> Any:
+        return await self.request("POST", url, json=json, **kwargs)
+
+    async def aclose(self) -> None:
+        if not self.closed:
+            await self._session.close()
+        self._session = None
+
+    async def __aenter__(self) -> "AsyncHttpClient":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.aclose()
+
+
+class _RetryableStatus(Exception):
+    def __init__(self, status: int):
+        super().__init__(f"Retryable HTTP status {status}")
+        self.status = status
@@ -0,0 +1,689 @@
+import asyncio
+import hashlib
+import json
+import random
+import sys
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, AsyncIterator, Awaitable, Callable, Hashable, Sequence
+from weakref import WeakKeyDictionary
+
+from pydantic import BaseModel
+
+from llama_index.core.llms import LLM, ChatMessage, ChatResponse
+from llama_index.core.tools import BaseTool
+
+from cache import LRUCache
+
+# rate limited, overloaded or failing upstream; worth another try
+TRANSIENT_STATUS_CODES = frozenset({408, 409, 429, 500, 502, 503, 504, 529})
+
+
+class LLMLimits(BaseModel):
+    """Used to cap the LLM calls of the whole workflow or of one agent."""
+
+    max_concurrency: int | None = None
+    tokens_per_minute: int | None = None
+
+
+def estimate_tokens(messages: Sequence[ChatMessage]) -> int:
+    """A cheap estimate (~4 characters per token) of the prompt tokens of a request."""
+    return sum(len(message.content or "") // 4 + 4 for message in messages)
+
+
+def _status_code(exc: BaseException) -> int | None:
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_transient_error(exc: BaseException) -> bool:
+    """Rate limits, server errors, timeouts and connection errors are retried."""
+    status = _status_code(exc)
+    if status is not None:
+        return status in TRANSIENT_STATUS_CODES
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return True
+    # the OpenAI client's network errors, which can only be raised once it is imported
+    openai = sys.modules.get("openai")
+    return openai is not None and isinstance(exc, openai.APIConnectionError)
+
+
+def _retry_after(exc: BaseException) -> float | None:
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    value = headers.get("retry-after", getattr(exc, "retry_after", None))
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class _FairLimiter:
+    """
+    Admits requests while under a concurrency cap and a tokens-per-minute bucket.
+
+    Waiting requests are served round-robin by key (the session), so a session with
+    many requests in the queue cannot starve the others.
+    """
+
+    def __init__(self, limits: LLMLimits):
+        self.max_concurrency = limits.max_concurrency
+        self.tokens_per_minute = limits.tokens_per_minute
+        self.in_flight = 0
+        self._tokens = float(limits.tokens_per_minute or 0)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters: OrderedDict[Hashable, deque[tuple[asyncio.Future, int]]] = (
+            OrderedDict()
+        )
+        self._timer: asyncio.TimerHandle | None = None
+
+    @property
+    def num_waiting(self) -> int:
+        return sum(len(queue) for queue in self._waiters.values())
+
+    def _wait_time(self, cost: int) -> float:
+        """How long until a request of `cost` tokens fits, 0 if it fits now."""
+        now = time.monotonic()
+        if self._paused_until > now:
+            return self._paused_until - now
+        if self.tokens_per_minute is None:
+            return 0.0
+        self._tokens = min(
+            self.tokens_per_minute,
+            self._tokens + (now - self._refilled_at) * self.tokens_per_minute / 60,
+        )
+        self._refilled_at = now
+        # a request larger than the whole bucket goes when the bucket is full
+        needed = min(cost, self.tokens_per_minute)
+        if self._tokens >= needed:
+            return 0.0
+        return (needed - self._tokens) * 60 / self.tokens_per_minute
+
+    def _has_slot(self) -> bool:
+        return self.max_concurrency is None or self.in_flight < self.max_concurrency
+
+    def _grant(self, cost: int) -> None:
+        self.in_flight += 1
+        if self.tokens_per_minute is not None:
+            self._tokens -= cost
+
+    def try_acquire(self, cost: int) -> bool:
+        """Takes a slot only if one is free now and nobody is waiting for it."""
+        if self._waiters or not self._has_slot() or self._wait_time(cost) > 0:
+            return False
+        self._grant(cost)
+        return True
+
+    async def acquire(self, key: Hashable, cost: int) -> None:
+        if self.try_acquire(cost):
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, deque()).append((future, cost))
+        # with nothing in flight, no release would wake the queue up
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # granted just before the cancellation
+                self.release(cost)
+            else:
+                self._remove_waiter(key, future)
+            raise
+
+    def release(self, reserved: int, used: int | None = None) -> None:
+        """Frees a slot; `used` settles the reserved token estimate with the actual usage."""
+        self.in_flight -= 1
+        if used is not None and self.tokens_per_minute is not None:
+            self._tokens -= used - reserved
+        self._dispatch()
+
+    def pause(self, delay: float) -> None:
+        """Holds back every new request for `delay` seconds, e.g. after a 429."""
+        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+
+    def _remove_waiter(self, key: Hashable, future: asyncio.Future) -> None:
+        queue = self._waiters.get(key)
+        if queue is None:
+            return
+        self._waiters[key] = deque(entry for entry in queue if entry[0] is not future)
+        if not self._waiters[key]:
+            del self._waiters[key]
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self._waiters and self._has_slot():
+            key, queue = next(iter(self._waiters.items()))
+            future, cost = queue[0]
+            wait = self._wait_time(cost)
+            if wait > 0:
+                # over the token budget or paused; retry once the head request fits
+                if self._timer is not None:
+                    self._timer.cancel()
+                self._timer = asyncio.get_running_loop().call_later(
+                    wait, self._dispatch
+                )
+                return
+            queue.popleft()
+            if queue:
+                self._waiters.move_to_end(key)
+            else:
+                del self._waiters[key]
+            self._grant(cost)
+            future.set_result(None)
+
+
+def _copy_response(response: ChatResponse) -> ChatResponse:
+    # every session sharing a response appends its message to its own history
+    return response.model_copy(
+        update={"message": response.message.model_copy(deep=True)}
+    )
+
+
+@dataclass
+class _SharedRequest:
+    """An upstream request shared by the identical requests made while it runs."""
+
+    task: asyncio.Future
+    num_waiters: int = 0
+
+
+class _SharedStream:
+    """Replays the chunks of one upstream stream to every request coalesced onto it."""
+
+    def __init__(self, stream: AsyncIterator[ChatResponse]):
+        self.chunks: list[ChatResponse] = []
+        self.num_readers = 0
+        self.abandoned = False
+        self._done = False
+        self._error: BaseException | None = None
+        self._changed = asyncio.Event()
+        self.task = asyncio.ensure_future(self._pump(stream))
+
+    async def _pump(self, stream: AsyncIterator[ChatResponse]) -> None:
+        try:
+            async for chunk in stream:
+                self.chunks.append(chunk)
+                self._notify()
+        except BaseException as exc:
+            # raised to every reader instead of from the task
+            self._error = exc
+        finally:
+            self._done = True
+            self._notify()
+
+    @property
+    def completed(self) -> bool:
+        """Whether the upstream stream ran to its end, without an error."""
+        return self._done and self._error is None and not self.abandoned
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def read(self) -> AsyncIterator[ChatResponse]:
+        self.num_readers += 1
+        i = 0
+        try:
+            while True:
+                while i < len(self.chunks):
+                    yield _copy_response(self.chunks[i])
+                    i += 1
+                if self._done:
+                    if self._error is not None:
+                        raise self._error
+                    return
+                await self._changed.wait()
+        finally:
+            self.num_readers -= 1
+            if self.num_readers == 0 and not self._done:
+                # nobody is left to read it
+                self.abandoned = True
+                self.task.cancel()
+
+
+class LLMGateway:
+    """
+    The single entry point of the workflow's LLM calls.
+
+    - `max_concurrency`/`tokens_per_minute` cap the calls of every agent together, and
+      `agent_limits` those of single agents. Requests over a limit wait in a queue
+      served round-robin by session. Token costs are estimated from the prompt and
+      settled with the usage the LLM reports.
+    - Transient errors (429, 5xx, timeouts, connection errors) are retried up to
+      `max_retries` times with full-jitter exponential backoff, honouring
+      `Retry-After`; a 429 also holds back the other queued requests. Disable the
+      retries of the LLM client itself (e.g. `OpenAI(max_retries=0)`) so they are
+      not multiplied.
+    - A non-streaming request still running after `hedge_after` seconds, or after the
+      `hedge_quantile` of recent latencies, is sent a second time when there is spare
+      capacity, and the first response wins.
+    - With `coalesce` (the default), identical requests (same model, temperature,
+      messages, tools and arguments) made while one of them is in flight share its
+      upstream call, streamed or not. This holds for sampled requests (temperature
+      above 0) of different sessions too, which then get the same response; pass
+      `coalesce=False` if each should be sampled on its own, and in benchmarks that
+      measure the rest of the serving path. With a `response_cache`, responses of
+      LLMs with a temperature of 0 are also reused by later identical requests until
+      the cache entry expires.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int | None = None,
+        tokens_per_minute: int | None = None,
+        agent_limits: dict[str, LLMLimits] | None = None,
+        max_retries: int = 3,
+        retry_base_delay: float = 0.5,
+        retry_max_delay: float = 30.0,
+        hedge_after: float | None = None,
+        hedge_quantile: float | None = None,
+        is_retryable: Callable[[BaseException], bool] = is_transient_error,
+        count_tokens: Callable[[Sequence[ChatMessage]], int] = estimate_tokens,
+        coalesce: bool = True,
+        response_cache: LRUCache | None = None,
+    ):
+        self.limits = LLMLimits(
+            max_concurrency=max_concurrency, tokens_per_minute=tokens_per_minute
+        )
+        self.agent_limits = agent_limits or {}
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.hedge_after = hedge_after
+        self.hedge_quantile = hedge_quantile
+        self.is_retryable = is_retryable
+        self.count_tokens = count_tokens
+        self.coalesce = coalesce
+        self.response_cache = response_cache
+
+        self._limiter = _FairLimiter(self.limits)
+        self._agent_limiters = {
+            agent_name: _FairLimiter(limits)
+            for agent_name, limits in self.agent_limits.items()
+        }
+        # latencies of recent successful calls, for the hedging threshold
+        self._latencies: deque[float] = deque(maxlen=512)
+        self._shared_requests: dict[str, _SharedRequest] = {}
+        self._shared_streams: dict[str, _SharedStream] = {}
+        self._tool_keys: WeakKeyDictionary[BaseTool, str] = WeakKeyDictionary()
+        self._stats = {
+            "requests": 0,
+            "upstream_calls": 0,
+            "coalesced": 0,
+            "cache_hits": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "failed": 0,
+            "hedged": 0,
+            "hedges_won": 0,
+            "queue_wait": 0.0,
+        }
+
+    def stats(self) -> dict[str, float]:
+        requests = self._stats["requests"]
+        return {
+            **self._stats,
+            # share of the requests that did not need their own upstream call
+            "coalescing_ratio": self._stats["coalesced"] / requests
+            if requests
+            else 0.0,
+            "in_flight": self._limiter.in_flight,
+            "waiting": self._limiter.num_waiting,
+        }
+
+    # ---- requests ----
+
+    async def achat_with_tools(
+        self,
+        llm: LLM,
+        tools: Sequence[BaseTool],
+        chat_history: list[ChatMessage],
+        agent_name: str | None = None,
+        session: Hashable = None,
+        **kwargs: Any,
+    ) -> ChatResponse:
+        return await self._shared(
+            llm,
+            self._request_key(llm, chat_history, tools, kwargs),
+            lambda: self._call(
+                lambda: llm.achat_with_tools(
+                    tools, chat_history=chat_history, **kwargs
+                ),
+                chat_history,
+                agent_name,
+                session,
+            ),
+        )
+
+    async def achat(
+        self,
+        llm: LLM,
+        messages: list[ChatMessage],
+        agent_name: str | None = None,
+        session: Hashable = None,
+        **kwargs: Any,
+    ) -> ChatResponse:
+        return await self._shared(
+            llm,
+            self._request_key(llm, messages, (), kwargs),
+            lambda: self._call(
+                lambda: llm.achat(messages, **kwargs), messages, agent_name, session
+            ),
+        )
+
+    async def astream_chat_with_tools(
+        self,
+        llm: LLM,
+        tools: Sequence[BaseTool],
+        chat_history: list[ChatMessage],
+        agent_name: str | None = None,
+        session: Hashable = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatResponse]:
+        """
+        Streams a response. A failure is retried only until the first chunk arrives,
+        and streams are not hedged. A cached response is replayed as a single chunk.
+        """
+        self._stats["requests"] += 1
+        stream = partial(
+            self._stream, llm, tools, chat_history, agent_name, session, **kwargs
+        )
+        key = self._request_key(llm, chat_history, tools, kwargs)
+        if key is None:
+            async for response in stream():
+                yield response
+            return
+
+        cached = self._get_cached(llm, key)
+        if cached is not None:
+            yield cached.model_copy(update={"delta": cached.message.content})
+            return
+        if not self.coalesce:
+            async for response in stream():
+                yield response
+            return
+
+        shared = self._shared_streams.get(key)
+        # a finished call may not have been removed yet
+        if shared is None or shared.abandoned or shared.task.done():
+            shared = self._shared_streams[key] = _SharedStream(stream())
+            shared.task.add_done_callback(partial(self._stream_done, llm, key, shared))
+        else:
+            self._stats["coalesced"] += 1
+        async for response in shared.read():
+            yield response
+
+    # ---- coalescing ----
+
+    def _tool_key(self, tool: BaseTool) -> str:
+        key = self._tool_keys.get(tool)
+        if key is None:
+            metadata = tool.metadata
+            key = f"{metadata.get_name()}\0{metadata.description}\0{metadata.fn_schema_str}"
+            self._tool_keys[tool] = key
+        return key
+
+    def _is_cacheable(self, llm: LLM) -> bool:
+        return (
+            self.response_cache is not None and getattr(llm, "temperature", None) == 0
+        )
+
+    def _request_key(
+        self,
+        llm: LLM,
+        messages: Sequence[ChatMessage],
+        tools: Sequence[BaseTool],
+        kwargs: dict[str, Any],
+    ) -> str | None:
+        """Hashes everything that determines the response, None if it is not shared."""
+        if not self.coalesce and not self._is_cacheable(llm):
+            return None
+        request = [
+            type(llm).__name__,
+            getattr(llm, "model", None),
+            getattr(llm, "temperature", None),
+            kwargs,
+            [self._tool_key(tool) for tool in tools],
+            [
+                [message.role.value, message.content, message.additional_kwargs]
+                for message in messages
+            ],
+        ]
+        data = json.dumps(request, separators=(",", ":"), default=str)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def _get_cached(self, llm: LLM, key: str) -> ChatResponse | None:
+        if not self._is_cacheable(llm):
+            return None
+        response = self.response_cache.get(key)
+        if response is None:
+            return None
+        self._stats["cache_hits"] += 1
+        return _copy_response(response)
+
+    async def _shared(
+        self,
+        llm: LLM,
+        key: str | None,
+        request: Callable[[], Awaitable[ChatResponse]],
+    ) -> ChatResponse:
+        self._stats["requests"] += 1
+        if key is None:
+            return await request()
+        cached = self._get_cached(llm, key)
+        if cached is not None:
+            return cached
+        if not self.coalesce:
+            response = await request()
+            if self._is_cacheable(llm):
+                self.response_cache.set(key, response)
+            return response
+
+        shared = self._shared_requests.get(key)
+        if shared is None or shared.task.done():
+            shared = self._shared_requests[key] = _SharedRequest(
+                asyncio.ensure_future(request())
+            )
+            shared.task.add_done_callback(partial(self._request_done, llm, key, shared))
+        else:
+            self._stats["coalesced"] += 1
+        shared.num_waiters += 1
+        try:
+            # one waiter giving up does not cancel the call for the others
+            response = await asyncio.shield(shared.task)
+        finally:
+            shared.num_waiters -= 1
+            if shared.num_waiters == 0 and not shared.task.done():
+                shared.task.cancel()
+                self._shared_requests.pop(key, None)
+        return _copy_response(response)
+
+    def _request_done(
+        self, llm: LLM, key: str, shared: _SharedRequest, task: asyncio.Future
+    ) -> None:
+        if self._shared_requests.get(key) is shared:
+            del self._shared_requests[key]
+        if (
+            not task.cancelled()
+            and task.exception() is None
+            and self._is_cacheable(llm)
+        ):
+            self.response_cache.set(key, task.result())
+
+    def _stream_done(
+        self, llm: LLM, key: str, shared: _SharedStream, task: asyncio.Future
+    ) -> None:
+        if self._shared_streams.get(key) is shared:
+            del self._shared_streams[key]
+        # a stream that failed midway holds a truncated message
+        if shared.chunks and shared.completed and self._is_cacheable(llm):
+            # the streamed chunks hold the whole message so far, the last one all of it
+            self.response_cache.set(key, shared.chunks[-1])
+
+    # ---- upstream calls ----
+
+    async def _stream(
+        self,
+        llm: LLM,
+        tools: Sequence[BaseTool],
+        chat_history: list[ChatMessage],
+        agent_name: str | None,
+        session: Hashable,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatResponse]:
+        self._stats["upstream_calls"] += 1
+        cost = self.count_tokens(chat_history)
+        limiters = self._get_limiters(agent_name)
+        attempt = 0
+        while True:
+            await self._acquire(limiters, session, cost)
+            used = None
+            try:
+                try:
+                    stream = await llm.astream_chat_with_tools(
+                        tools, chat_history=chat_history, **kwargs
+                    )
+                    response = await anext(stream)
+                except Exception as exc:
+                    delay = self._on_error(exc, attempt)
+                else:
+                    yield response
+                    async for response in stream:
+                        yield response
+                    used = response.additional_kwargs.get("total_tokens")
+                    return
+            finally:
+                self._release(limiters, cost, used)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def _call(
+        self,
+        request: Callable[[], Awaitable[ChatResponse]],
+        messages: Sequence[ChatMessage],
+        agent_name: str | None,
+        session: Hashable,
+    ) -> ChatResponse:
+        self._stats["upstream_calls"] += 1
+        cost = self.count_tokens(messages)
+        limiters = self._get_limiters(agent_name)
+        attempt = 0
+        while True:
+            await self._acquire(limiters, session, cost)
+            used = None
+            try:
+                start = time.monotonic()
+                response = await self._hedged(request, limiters, cost)
+                self._latencies.append(time.monotonic() - start)
+                used = response.additional_kwargs.get("total_tokens")
+                return response
+            except Exception as exc:
+                delay = self._on_error(exc, attempt)
+            finally:
+                self._release(limiters, cost, used)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def _on_error(self, exc: Exception, attempt: int) -> float:
+        """Re-raises `exc` unless it is worth retrying; returns the backoff delay."""
+        if attempt >= self.max_retries or not self.is_retryable(exc):
+            self._stats["failed"] += 1
+            raise exc
+        self._stats["retries"] += 1
+        retry_after = _retry_after(exc)
+        delay = random.uniform(
+            0, min(self.retry_max_delay, self.retry_base_delay * 2**attempt)
+        )
+        if _status_code(exc) == 429:
+            self._stats["rate_limited"] += 1
+            # everyone else would hit the same limit; hold the queue back as well
+            self._limiter.pause(
+                retry_after if retry_after is not None else self.retry_base_delay
+            )
+        return retry_after if retry_after is not None else delay
+
+    # ---- limits ----
+
+    def _get_limiters(self, agent_name: str | None) -> list[_FairLimiter]:
+        agent_limiter = self._agent_limiters.get(agent_name)
+        if agent_limiter is None:
+            return [self._limiter]
+        return [agent_limiter, self._limiter]
+
+    async def _acquire(
+        self, limiters: list[_FairLimiter], session: Hashable, cost: int
+    ) -> None:
+        start = time.monotonic()
+        acquired = []
+        try:
+            for limiter in limiters:
+                await limiter.acquire(session, cost)
+                acquired.append(limiter)
+        except BaseException:
+            for limiter in acquired:
+                limiter.release(cost, used=0)
+            raise
+        self._stats["queue_wait"] += time.monotonic() - start
+
+    def _release(
+        self, limiters: list[_FairLimiter], cost: int, used: int | None
+    ) -> None:
+        for limiter in limiters:
+            limiter.release(cost, used)
+
+    # ---- hedging ----
+
+    def _hedge_delay(self) -> float | None:
+        delay = self.hedge_after
+        if self.hedge_quantile is not None and len(self._latencies) >= 20:
+            ordered = sorted(self._latencies)
+            quantile = ordered[int(self.hedge_quantile * (len(ordered) - 1))]
+            delay = max(delay or 0.0, quantile)
+        return delay
+
+    async def _hedged(
+        self,
+        request: Callable[[], Awaitable[ChatResponse]],
+        limiters: list[_FairLimiter],
+        cost: int,
+    ) -> ChatResponse:
+        primary = asyncio.ensure_future(request())
+        hedge = None
+        hedge_limiters: list[_FairLimiter] = []
+        try:
+            delay = self._hedge_delay()
+            if delay is None:
+                return await primary
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+
+            # hedges only use spare capacity, so they never delay queued requests
+            for limiter in limiters:
+                if not limiter.try_acquire(cost):
+                    return await primary
+                hedge_limiters.append(limiter)
+            self._stats["hedged"] += 1
+            hedge = asyncio.ensure_future(request())
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._stats["hedges_won"] += 1
+                        return task.result()
+            return primary.result()
+        finally:
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+            for limiter in hedge_limiters:
+                limiter.release(cost, used=0 if hedge is None else None)
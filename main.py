@@ -1,47 +1,69 @@
 import asyncio
 import os
+from typing import Any
 
-import requests
 from dotenv import load_dotenv
-from llama_index.core.memory import ChatMemoryBuffer
 from llama_index.core.tools import BaseTool
 from llama_index.core.workflow import Context
-from llama_index.llms.openai import OpenAI
-from llama_index.utils.workflow import draw_all_possible_flows
+from pydantic import BaseModel, Field
 
 from workflow import (
     AgentConfig,
+    AgentStreamEvent,
     SystemAgent,
     ProgressEvent,
     ToolRequestEvent,
     ToolApprovedEvent,
 )
+from http_client import AsyncHttpClient
+from prompts import update_user_state
+from structured_output import OutputSchema
 from utils import FunctionToolWithContext
 
+DEFAULT_USER_INFO_URL = "http://localhost:3000/user-info"
+
 
 def get_initial_state() -> dict:
     return {}
 
 
-def get_health_coach_tools() -> list[BaseTool]:
-    async def get_user_information(ctx: Context) -> str:
+class CoachingResponse(BaseModel):
+    """The final answer of the Health Coach Agent."""
+
+    user_info: str | dict[str, Any]
+    user_goal: str
+    recommended_task: list[str] = Field(min_length=1)
+    reason: str
+
+
+def get_health_coach_tools(user_info_url: str | None = None) -> list[BaseTool]:
+    user_info_url = user_info_url or os.getenv("USER_INFO_URL", DEFAULT_USER_INFO_URL)
+
+    async def get_user_information(ctx: Context, http: AsyncHttpClient) -> str:
         """Get the user information from API"""
         ctx.write_event_to_stream(ProgressEvent(msg="Retrieving user information"))
-        response = requests.get('http://localhost:3000/user-info')
-        user_info = response.json()
-        user_state = await ctx.get("user_state")
-        user_state["user_persona"] = user_info["user_persona"]
-        user_state["user_tasks"] = user_info["user_tasks"]
-        await ctx.set("user_state", user_state)
-        return f"The user information is {user_state["user_persona"]} and the user tasks are {user_state["user_tasks"]}."
+        user_info = await http.get_json(user_info_url)
+        await update_user_state(
+            ctx,
+            user_persona=user_info["user_persona"],
+            user_tasks=user_info["user_tasks"],
+        )
+        return f"The user information is {user_info['user_persona']} and the user tasks are {user_info['user_tasks']}."
 
     return [
         FunctionToolWithContext.from_defaults(async_fn=get_user_information),
     ]
 
 
-def get_information_tools() -> list[BaseTool]:
-    return []
+def get_information_tools(index_path: str | None = None) -> list[BaseTool]:
+    # build the index with `python retrieval.py <index path> <documents>`
+    index_path = index_path or os.getenv("KNOWLEDGE_INDEX_PATH")
+    if not index_path or not os.path.exists(os.path.join(index_path, "index.json")):
+        return []
+    # imported on first use, numpy adds noticeably to the startup time
+    from retrieval import get_retrieval_tools, load_retriever
+
+    return get_retrieval_tools(load_retriever(index_path))
 
 
 def get_agent_configs() -> list[AgentConfig]:
@@ -64,7 +86,8 @@ Note: the final response should be a json with following format:
     }
             """,
             tools=get_health_coach_tools(),
-            tools_requiring_human_confirmation=["get_user_information"]
+            tools_requiring_human_confirmation=["get_user_information"],
+            output_schema=OutputSchema(model=CoachingResponse),
         ),
         AgentConfig(
             name="Information Agent",
@@ -82,17 +105,16 @@ async def main():
     """Main function to run the workflow."""
 
     from colorama import Fore, Style
+    from llama_index.llms.openai import OpenAI
     load_dotenv()
 
-    llm = OpenAI(model="gpt-4o", temperature=0, api_base=os.getenv('API_BASE'), api_key=os.getenv('API_KEY'))
-    memory = ChatMemoryBuffer.from_defaults(llm=llm)
+    # retries are left to the workflow's LLM gateway
+    llm = OpenAI(model="gpt-4o", temperature=0, api_base=os.getenv('API_BASE'), api_key=os.getenv('API_KEY'), max_retries=0)
     initial_state = get_initial_state()
     agent_configs = get_agent_configs()
-    workflow = SystemAgent(timeout=None)
-    draw_all_possible_flows(workflow, filename="workflow.html")
+    workflow = SystemAgent(timeout=None, stream=True)
 
-    # draw a diagram of the workflow
-    # draw_all_possible_flows(workflow, filename="workflow.html")
+    # to draw a diagram of the workflow, run `python draw_flows.py`
 
     handler = workflow.run(
         user_msg="Hello!",
@@ -103,6 +125,7 @@ async def main():
     )
 
     while True:
+        streamed = []
         async for event in handler.stream_events():
             if isinstance(event, ToolRequestEvent):
                 print(
@@ -114,52 +137,63 @@ async def main():
                 print(event.tool_kwargs)
                 print()
 
-                approved = input("Do you approve? (y/n): ")
+                # read from a thread, so running tool calls and streams keep going
+                approved = await asyncio.to_thread(input, "Do you approve? (y/n): ")
                 if "y" in approved.lower():
                     handler.ctx.send_event(
                         ToolApprovedEvent(
                             tool_id=event.tool_id,
                             tool_name=event.tool_name,
                             tool_kwargs=event.tool_kwargs,
+                            batch_id=event.batch_id,
                             approved=True,
                         )
                     )
                 else:
-                    reason = input("Why not? (reason): ")
+                    reason = await asyncio.to_thread(input, "Why not? (reason): ")
                     handler.ctx.send_event(
                         ToolApprovedEvent(
                             tool_name=event.tool_name,
                             tool_id=event.tool_id,
                             tool_kwargs=event.tool_kwargs,
+                            batch_id=event.batch_id,
                             approved=False,
                             response=reason,
                         )
                     )
             elif isinstance(event, ProgressEvent):
                 print(Fore.GREEN + f"SYSTEM >> {event.msg}" + Style.RESET_ALL)
+            elif isinstance(event, AgentStreamEvent):
+                if not streamed:
+                    print(Fore.BLUE + "AGENT >> ", end="")
+                streamed.append(event.delta)
+                print(event.delta, end="", flush=True)
 
         result = await handler
-        print(Fore.BLUE + f"AGENT >> {result['response']}" + Style.RESET_ALL)
-
-        # update the memory with only the new chat history
-        for i, msg in enumerate(result["chat_history"]):
-            if i >= len(memory.get()):
-                memory.put(msg)
-
-        user_msg = input("USER >> ")
+        if streamed:
+            print(Style.RESET_ALL)
+            # an answer repaired against its output schema differs from the stream
+            response = result["response"]
+            if response and not "".join(streamed).endswith(response):
+                print(Fore.BLUE + f"AGENT (validated) >> {response}" + Style.RESET_ALL)
+        else:
+            print(Fore.BLUE + f"AGENT >> {result['response']}" + Style.RESET_ALL)
+
+        user_msg = await asyncio.to_thread(input, "USER >> ")
         if user_msg.strip().lower() in ["exit", "quit", "bye"]:
             break
 
-        # pass in the existing context and continue the conversation
+        # pass in the existing context and continue the conversation,
+        # the chat history and user state are resumed from it
         handler = workflow.run(
             ctx=handler.ctx,
             user_msg=user_msg,
             agent_configs=agent_configs,
             llm=llm,
-            chat_history=memory.get(),
-            initial_state=initial_state,
         )
 
+    await workflow.aclose()
+
 
 if __name__ == "__main__":
     asyncio.run(main())
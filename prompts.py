@@ -0,0 +1,108 @@
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any
+
+from llama_index.core.tools import BaseTool, FunctionTool, ToolMetadata
+from llama_index.core.workflow import Context
+
+from routing import agent_configs_fingerprint
+from session_state import UserState, get_session_state
+
+if TYPE_CHECKING:
+    from workflow import AgentConfig
+
+USER_STATE_PROMPT = "Here is the current user state:\n{user_state_str}"
+
+# stands in for the user state while the static parts of a template are formatted
+_USER_STATE_SENTINEL = "\0user_state\0"
+
+
+def render_user_state(user_state: dict) -> str:
+    if isinstance(user_state, UserState):
+        return user_state.render()
+    return "\n".join(f"{k}: {v}" for k, v in user_state.items())
+
+
+async def get_user_state_version(ctx: Context) -> int:
+    return (await get_session_state(ctx)).user_state.version
+
+
+async def set_user_state(ctx: Context, user_state: dict) -> None:
+    """
+    Replaces the user state and bumps its version, so the prompts rendered from it are
+    rebuilt. Tools that change a few fields should use `update_user_state`.
+    """
+    (await get_session_state(ctx)).user_state.replace(user_state)
+
+
+async def update_user_state(ctx: Context, **fields: Any) -> None:
+    """Sets fields of the user state in one atomic update, e.g. from a tool."""
+    (await get_session_state(ctx)).update_user_state(**fields)
+
+
+async def get_user_state_prompt(ctx: Context) -> str:
+    """The user state rendered for the LLM, re-rendered only for the fields that changed."""
+    user_state = (await get_session_state(ctx)).user_state
+    return USER_STATE_PROMPT.format(user_state_str=user_state.render())
+
+
+class CachedToolMetadata(ToolMetadata):
+    """`ToolMetadata` that generates the JSON schema of the tool parameters only once."""
+
+    def get_parameters_dict(self) -> dict:
+        parameters = self.__dict__.get("_parameters")
+        if parameters is None:
+            parameters = self.__dict__["_parameters"] = super().get_parameters_dict()
+        # LLM integrations add keys to the top level of the returned dict
+        return dict(parameters)
+
+
+def compile_tools(tools: list[BaseTool]) -> list[BaseTool]:
+    """Swaps the metadata of function tools for `CachedToolMetadata`, in place."""
+    for tool in tools:
+        if isinstance(tool, FunctionTool) and not isinstance(
+            tool.metadata, CachedToolMetadata
+        ):
+            metadata = tool.metadata
+            tool._metadata = CachedToolMetadata(
+                description=metadata.description,
+                name=metadata.name,
+                fn_schema=metadata.fn_schema,
+                return_direct=metadata.return_direct,
+            )
+    return tools
+
+
+@dataclass
+class CompiledOrchestratorPrompt:
+    """
+    The orchestrator prompt for a set of agents, formatted up to the user state, and
+    the fingerprint the routing cache keys on.
+    """
+
+    # kept so the ids the prompt is cached under stay valid
+    agent_configs: tuple["AgentConfig", ...]
+    head: str
+    tail: str
+    fingerprint: str
+
+    @classmethod
+    def compile(
+        cls, template: str, agent_configs: dict[str, "AgentConfig"]
+    ) -> "CompiledOrchestratorPrompt":
+        agent_context_str = "".join(
+            f"{agent_name}: {agent_config.description}\n"
+            for agent_name, agent_config in agent_configs.items()
+        )
+        prompt = template.format(
+            agent_context_str=agent_context_str, user_state_str=_USER_STATE_SENTINEL
+        )
+        head, _, tail = prompt.partition(_USER_STATE_SENTINEL)
+        return cls(
+            agent_configs=tuple(agent_configs.values()),
+            head=head,
+            tail=tail,
+            fingerprint=agent_configs_fingerprint(agent_configs, template),
+        )
+
+    def format(self, user_state_str: str) -> str:
+        return self.head + user_state_str + self.tail
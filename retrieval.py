@@ -0,0 +1,497 @@
+"""
+Semantic retrieval over a local document corpus, exposed to agents as tools.
+
+    python retrieval.py data/knowledge_index docs/
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import zlib
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Iterable, Iterator
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.tools import BaseTool, FunctionTool
+from pydantic import PrivateAttr
+
+from cache import LRUCache
+from routing import normalize_message
+
+_WORD_RE = re.compile(r"\S+")
+_TOKEN_RE = re.compile(r"[a-z0-9']+")
+# words that carry no topic; dropped before hashing so they don't dilute short queries
+_STOPWORDS = frozenset(
+    "a about am an and are as at be but by can could do does for from had has have "
+    "how i i'm if in is it its me my of on or our should so than that the their them "
+    "there these they this to was we were what when which who why will with would you "
+    "your".split()
+)
+DOCUMENT_EXTENSIONS = (".txt", ".md")
+
+
+# ---- chunking ----
+
+
+def chunk_text(text: str, chunk_size: int = 128, chunk_overlap: int = 16) -> list[str]:
+    """Splits `text` into windows of `chunk_size` words overlapping by `chunk_overlap`."""
+    words = _WORD_RE.findall(text)
+    step = max(1, chunk_size - chunk_overlap)
+    return [
+        " ".join(words[start : start + chunk_size])
+        for start in range(0, max(1, len(words) - chunk_overlap), step)
+        if words[start : start + chunk_size]
+    ]
+
+
+def iter_documents(paths: Iterable[str]) -> Iterator[tuple[str, str]]:
+    """Yields (path, text) for the given files and the documents under directories."""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in sorted(os.walk(path)):
+                for name in sorted(files):
+                    if name.endswith(DOCUMENT_EXTENSIONS):
+                        yield from iter_documents([os.path.join(root, name)])
+        else:
+            with open(path, encoding="utf-8") as f:
+                yield path, f.read()
+
+
+# ---- embeddings ----
+
+
+class HashingEmbedding(BaseEmbedding):
+    """
+    An offline embedding stand-in: signed feature hashing of words and word bigrams
+    (without stopwords) into `dim` dimensions, log-scaled and L2-normalized.
+
+    It only captures lexical overlap, but it needs no model or network, is
+    deterministic across processes, and embeds a batch with a few numpy operations.
+    Swap in any llama-index embedding for real semantic search; the index records
+    which model built it.
+    """
+
+    dim: int = 256
+    model_name: str = "hashing"
+
+    # the hash of every word seen (-1 for stopwords); bigram hashes are mixed from
+    # them, not stored
+    _digests: dict[str, int] = PrivateAttr(
+        default_factory=lambda: dict.fromkeys(_STOPWORDS, -1)
+    )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "HashingEmbedding"
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """Embeds a batch of texts as a (len(texts), dim) float32 array."""
+        cache = self._digests
+        digests, lengths = [], []
+        for text in texts:
+            tokens = _TOKEN_RE.findall(text.lower())
+            # looked up at C speed; only new words go through the Python loop
+            row = list(map(cache.get, tokens))
+            if None in row:
+                for token in tokens:
+                    if token not in cache:
+                        cache[token] = zlib.crc32(token.encode())
+                row = list(map(cache.get, tokens))
+            digests.extend(row)
+            lengths.append(len(row))
+
+        words = np.asarray(digests, dtype=np.int64)
+        rows = np.repeat(np.arange(len(texts)), lengths)
+        is_word = words >= 0
+        words, rows = words[is_word].astype(np.uint64), rows[is_word]
+        # bigrams of consecutive words of the same text
+        same_text = rows[1:] == rows[:-1]
+        bigrams = ((words[:-1] * np.uint64(1000003)) ^ words[1:]) & np.uint64(
+            0xFFFFFFFF
+        )
+        hashes = np.concatenate([words, bigrams[same_text]])
+        rows = np.concatenate([rows, rows[1:][same_text]])
+        signs = np.where(hashes & np.uint64(0x80000000), 1.0, -1.0)
+        columns = (hashes % np.uint64(self.dim)).astype(np.int64)
+        matrix = np.bincount(
+            rows * self.dim + columns,
+            weights=signs,
+            minlength=len(texts) * self.dim,
+        ).reshape(len(texts), self.dim)
+        # sublinear term frequency, so a repeated word doesn't drown the others
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        return normalize(matrix.astype(np.float32))
+
+    def _get_query_embedding(self, query: str) -> list[float]:
+        return self.embed([query])[0].tolist()
+
+    async def _aget_query_embedding(self, query: str) -> list[float]:
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> list[float]:
+        return self.embed([text])[0].tolist()
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[list[float]]:
+        return self.embed(texts).tolist()
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+async def embed_texts(embed_model: BaseEmbedding, texts: list[str]) -> np.ndarray:
+    """Embeds a batch of texts without blocking the event loop."""
+    if isinstance(embed_model, HashingEmbedding):
+        return await asyncio.to_thread(embed_model.embed, texts)
+    embeddings = await embed_model.aget_text_embedding_batch(texts)
+    return normalize(np.asarray(embeddings, dtype=np.float32))
+
+
+async def embed_query(embed_model: BaseEmbedding, query: str) -> np.ndarray:
+    if isinstance(embed_model, HashingEmbedding):
+        # a single short text, cheaper than a hop to a thread
+        return embed_model.embed([query])[0]
+    embedding = await embed_model.aget_query_embedding(query)
+    return normalize(np.asarray(embedding, dtype=np.float32))
+
+
+# ---- index ----
+
+
+class VectorIndex:
+    """
+    A persisted vector index searched through a memory map.
+
+    A directory holds the normalized float32 vectors as one flat file, the chunk
+    records (text and source) as JSON in a blob file with an offsets file, and a
+    small `index.json` with the dimensions, the count and the embedding model. Chunks
+    are only appended; `index.json` is written last, so a crashed ingestion leaves
+    the index at its previous count. Search is exact: one matrix-vector product over
+    the mapped vectors, pages being read from the OS cache.
+    """
+
+    def __init__(self, path: str, dim: int, count: int = 0, embed_model: str = ""):
+        self.path = path
+        self.dim = dim
+        self.count = count
+        self.embed_model = embed_model
+        self._vectors: np.ndarray | None = None
+        self._offsets: np.ndarray | None = None
+
+    @classmethod
+    def create(cls, path: str, dim: int, embed_model: str) -> "VectorIndex":
+        os.makedirs(path, exist_ok=True)
+        for name in ("vectors.f32", "records.bin", "offsets.i64"):
+            open(os.path.join(path, name), "wb").close()
+        index = cls(path, dim, embed_model=embed_model)
+        index._write_meta()
+        return index
+
+    @classmethod
+    def open(cls, path: str) -> "VectorIndex":
+        with open(os.path.join(path, "index.json")) as f:
+            meta = json.load(f)
+        return cls(path, meta["dim"], meta["count"], meta["embed_model"])
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _write_meta(self) -> None:
+        meta = {"dim": self.dim, "count": self.count, "embed_model": self.embed_model}
+        tmp_path = self._file("index.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._file("index.json"))
+
+    def add(self, vectors: np.ndarray, records: list[dict[str, Any]]) -> None:
+        """Appends normalized vectors and their records ({"text", "source"})."""
+        if vectors.shape != (len(records), self.dim):
+            raise ValueError(
+                f"Expected {len(records)} vectors of {self.dim} dimensions, "
+                f"got {vectors.shape}"
+            )
+        blobs = [json.dumps(record).encode() for record in records]
+        end = int(self._mapped()[1][-1]) if self.count else 0
+        offsets = end + np.cumsum([len(blob) for blob in blobs], dtype=np.int64)
+        # truncate whatever a crashed ingestion left after the committed count
+        self._vectors = self._offsets = None
+        with open(self._file("vectors.f32"), "r+b") as f:
+            f.truncate(self.count * self.dim * 4)
+            f.seek(0, os.SEEK_END)
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        with open(self._file("offsets.i64"), "r+b") as f:
+            f.truncate(self.count * 8)
+            f.seek(0, os.SEEK_END)
+            f.write(offsets.tobytes())
+        with open(self._file("records.bin"), "r+b") as f:
+            f.truncate(end)
+            f.seek(0, os.SEEK_END)
+            f.write(b"".join(blobs))
+        self.count += len(records)
+        self._write_meta()
+        self._vectors = self._offsets = None
+
+    def _mapped(self) -> tuple[np.ndarray, np.ndarray]:
+        if self._vectors is None:
+            if self.count == 0:
+                self._vectors = np.zeros((0, self.dim), dtype=np.float32)
+                self._offsets = np.zeros(0, dtype=np.int64)
+            else:
+                self._vectors = np.memmap(
+                    self._file("vectors.f32"),
+                    dtype=np.float32,
+                    mode="r",
+                    shape=(self.count, self.dim),
+                )
+                self._offsets = np.memmap(
+                    self._file("offsets.i64"),
+                    dtype=np.int64,
+                    mode="r",
+                    shape=(self.count,),
+                )
+        return self._vectors, self._offsets
+
+    def search(self, query: np.ndarray, top_k: int = 4) -> list[tuple[int, float]]:
+        """The (chunk id, cosine similarity) of the `top_k` closest chunks, best first."""
+        return self.search_many(query[None, :], top_k)[0]
+
+    def search_many(
+        self, queries: np.ndarray, top_k: int = 4
+    ) -> list[list[tuple[int, float]]]:
+        """`search` for each row of `queries`, in one pass over the vectors."""
+        vectors, _ = self._mapped()
+        if not len(vectors):
+            return [[] for _ in queries]
+        all_scores = vectors @ queries.astype(np.float32).T
+        top_k = min(top_k, len(vectors))
+        results = []
+        for scores in all_scores.T:
+            top = np.argpartition(-scores, top_k - 1)[:top_k]
+            top = top[np.argsort(-scores[top])]
+            results.append([(int(i), float(scores[i])) for i in top])
+        return results
+
+    def record(self, chunk_id: int) -> dict[str, Any]:
+        _, offsets = self._mapped()
+        start = int(offsets[chunk_id - 1]) if chunk_id else 0
+        with open(self._file("records.bin"), "rb") as f:
+            f.seek(start)
+            return json.loads(f.read(int(offsets[chunk_id]) - start))
+
+
+# ---- ingestion ----
+
+
+async def _batches(
+    documents: Iterable[tuple[str, str]],
+    chunk_size: int,
+    chunk_overlap: int,
+    batch_size: int,
+) -> AsyncIterator[list[dict[str, Any]]]:
+    batch = []
+    for source, text in documents:
+        for chunk in chunk_text(text, chunk_size, chunk_overlap):
+            batch.append({"text": chunk, "source": source})
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        # let the event loop run between documents
+        await asyncio.sleep(0)
+    if batch:
+        yield batch
+
+
+async def ingest(
+    documents: Iterable[tuple[str, str]],
+    index: VectorIndex,
+    embed_model: BaseEmbedding,
+    chunk_size: int = 128,
+    chunk_overlap: int = 16,
+    batch_size: int = 512,
+) -> int:
+    """
+    Chunks and embeds (source, text) documents in batches and appends them to `index`.
+    The next batch is embedded while the previous one is written. Returns the number
+    of chunks added.
+    """
+    added = 0
+    pending = None
+    async for batch in _batches(documents, chunk_size, chunk_overlap, batch_size):
+        embedding = asyncio.ensure_future(
+            embed_texts(embed_model, [record["text"] for record in batch])
+        )
+        if pending is not None:
+            await asyncio.to_thread(index.add, *pending)
+        pending = (await embedding, batch)
+        added += len(batch)
+    if pending is not None:
+        await asyncio.to_thread(index.add, *pending)
+    return added
+
+
+# ---- retrieval ----
+
+
+@dataclass(slots=True)
+class RetrievedChunk:
+    text: str
+    source: str
+    score: float
+
+
+class Retriever:
+    """
+    Top-k search over a `VectorIndex` for agents.
+
+    Results are cached per normalized query and index size. The search runs in
+    `executor` (the default thread pool if None), so the event loop keeps serving
+    other sessions; numpy releases the GIL during the matrix product. Queries that
+    arrive while a search runs are searched together in the next one, in a single
+    pass over the vectors.
+    """
+
+    def __init__(
+        self,
+        index: VectorIndex,
+        embed_model: BaseEmbedding,
+        top_k: int = 4,
+        min_score: float = 0.0,
+        cache: LRUCache | None = None,
+        executor: Executor | None = None,
+    ):
+        if index.embed_model and index.embed_model != embed_model.model_name:
+            raise ValueError(
+                f"The index was built with {index.embed_model!r}, "
+                f"not {embed_model.model_name!r}"
+            )
+        self.index = index
+        self.embed_model = embed_model
+        self.top_k = top_k
+        self.min_score = min_score
+        self.cache = cache if cache is not None else LRUCache(max_size=4096)
+        self.executor = executor
+        # (query embedding, top_k, future) waiting for the next search
+        self._pending: list[tuple[np.ndarray, int, asyncio.Future]] = []
+        self._searching: asyncio.Task | None = None
+
+    def _to_chunks(self, hits: list[tuple[int, float]]) -> list[RetrievedChunk]:
+        chunks = []
+        for chunk_id, score in hits:
+            if score < self.min_score:
+                break
+            record = self.index.record(chunk_id)
+            chunks.append(RetrievedChunk(record["text"], record["source"], score))
+        return chunks
+
+    def _search(self, query: np.ndarray, top_k: int) -> list[RetrievedChunk]:
+        return self._to_chunks(self.index.search(query, top_k))
+
+    def _search_many(
+        self, queries: np.ndarray, top_k: list[int]
+    ) -> list[list[RetrievedChunk]]:
+        hits = self.index.search_many(queries, max(top_k))
+        return [self._to_chunks(h[:k]) for h, k in zip(hits, top_k)]
+
+    async def _run_searches(self) -> None:
+        """Searches the pending queries, one batch at a time, until none are left."""
+        loop = asyncio.get_running_loop()
+        batch = []
+        try:
+            while self._pending:
+                batch, self._pending = self._pending, []
+                try:
+                    results = await loop.run_in_executor(
+                        self.executor,
+                        self._search_many,
+                        np.stack([embedding for embedding, _, _ in batch]),
+                        [top_k for _, top_k, _ in batch],
+                    )
+                except Exception as e:
+                    for _, _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for (_, _, future), chunks in zip(batch, results):
+                    if not future.done():
+                        future.set_result(chunks)
+        finally:
+            # if cancelled, nothing else would resolve the waiting queries; the next
+            # query starts a new task
+            waiting, self._pending = batch + self._pending, []
+            for _, _, future in waiting:
+                if not future.done():
+                    future.cancel()
+            self._searching = None
+
+    async def aretrieve(
+        self, query: str, top_k: int | None = None
+    ) -> list[RetrievedChunk]:
+        top_k = top_k or self.top_k
+        key = (normalize_message(query), top_k, len(self.index))
+        chunks = self.cache.get(key)
+        if chunks is None:
+            embedding = await embed_query(self.embed_model, query)
+            future = asyncio.get_running_loop().create_future()
+            self._pending.append((embedding, top_k, future))
+            if self._searching is None:
+                self._searching = asyncio.create_task(self._run_searches())
+            chunks = await future
+            self.cache.set(key, chunks)
+        return chunks
+
+
+def format_chunks(chunks: list[RetrievedChunk]) -> str:
+    if not chunks:
+        return "No relevant passages found."
+    return "\n\n".join(
+        f"[{i}] ({os.path.basename(chunk.source)}) {chunk.text}"
+        for i, chunk in enumerate(chunks, 1)
+    )
+
+
+def get_retrieval_tools(retriever: Retriever) -> list[BaseTool]:
+    async def search_health_knowledge(query: str) -> str:
+        """Search the health knowledge base for passages relevant to the query. Use it to ground answers to health questions."""
+        return format_chunks(await retriever.aretrieve(query))
+
+    return [FunctionTool.from_defaults(async_fn=search_health_knowledge)]
+
+
+def load_retriever(path: str, **kwargs: Any) -> Retriever:
+    """Opens the index at `path` with the offline embedding it was built with."""
+    index = VectorIndex.open(path)
+    return Retriever(index, HashingEmbedding(dim=index.dim), **kwargs)
+
+
+async def main(args: argparse.Namespace) -> None:
+    embed_model = HashingEmbedding(dim=args.dim)
+    if os.path.exists(os.path.join(args.index, "index.json")):
+        index = VectorIndex.open(args.index)
+    else:
+        index = VectorIndex.create(args.index, args.dim, embed_model.model_name)
+    added = await ingest(
+        iter_documents(args.paths),
+        index,
+        embed_model,
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+    )
+    print(f"added {added} chunks, {len(index)} in {args.index}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Adds documents to a vector index.")
+    parser.add_argument("index")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--chunk-size", type=int, default=128)
+    parser.add_argument("--chunk-overlap", type=int, default=16)
+    asyncio.run(main(parser.parse_args()))
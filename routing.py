@@ -0,0 +1,208 @@
+import hashlib
+import math
+import re
+from collections import Counter
+from typing import TYPE_CHECKING, Collection
+
+from pydantic import BaseModel, Field
+
+from cache import LRUCache
+
+if TYPE_CHECKING:
+    from workflow import AgentConfig
+
+_TOKEN_RE = re.compile(r"[a-z0-9']+")
+_STOPWORDS = frozenset(
+    "a an and are i i'm is it me my of on or please the to want what with you".split()
+)
+
+
+def normalize_message(msg: str) -> str:
+    """Lowercases the message and collapses punctuation and whitespace."""
+    return " ".join(_TOKEN_RE.findall(msg.lower()))
+
+
+def agent_configs_fingerprint(
+    agent_configs: dict[str, "AgentConfig"], orchestrator_prompt: str
+) -> str:
+    """Hashes everything the orchestrator sees about the agents, so cached routes are
+    dropped whenever the agent pool or the routing prompt changes."""
+    digest = hashlib.sha256(orchestrator_prompt.encode())
+    for name, agent_config in sorted(agent_configs.items()):
+        digest.update(f"\0{name}\0{agent_config.description}".encode())
+    return digest.hexdigest()[:16]
+
+
+def _tokenize(text: str) -> list[str]:
+    return [
+        token for token in _TOKEN_RE.findall(text.lower()) if token not in _STOPWORDS
+    ]
+
+
+class KeywordRouter:
+    """
+    A TF-IDF nearest-centroid classifier that routes messages to agents without an LLM.
+
+    Each agent is represented by the TF-IDF vector of its description and example
+    messages. A message is routed only when its best cosine similarity is at least
+    `min_score` and beats the runner-up by `min_margin`; otherwise `predict` returns
+    `None` and the orchestrator asks the LLM.
+    """
+
+    def __init__(
+        self,
+        examples: dict[str, list[str]],
+        min_score: float = 0.3,
+        min_margin: float = 0.15,
+    ):
+        self.min_score = min_score
+        self.min_margin = min_margin
+
+        docs = {
+            agent: Counter(_tokenize(" ".join(texts)))
+            for agent, texts in examples.items()
+        }
+        doc_freq = Counter(token for counts in docs.values() for token in counts)
+        num_docs = len(docs)
+        self._idf = {
+            token: math.log((1 + num_docs) / (1 + freq)) + 1
+            for token, freq in doc_freq.items()
+        }
+        self._centroids = {
+            agent: self._vectorize(counts) for agent, counts in docs.items()
+        }
+
+    @classmethod
+    def from_agent_configs(
+        cls,
+        agent_configs: list["AgentConfig"],
+        examples: dict[str, list[str]] | None = None,
+        **kwargs: float,
+    ) -> "KeywordRouter":
+        """Builds a router from agent descriptions plus optional example messages."""
+        examples = examples or {}
+        return cls(
+            {
+                agent_config.name: [agent_config.description]
+                + examples.get(agent_config.name, [])
+                for agent_config in agent_configs
+            },
+            **kwargs,
+        )
+
+    def _vectorize(self, counts: Counter) -> dict[str, float]:
+        vector = {
+            token: count * self._idf[token]
+            for token, count in counts.items()
+            if token in self._idf
+        }
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        return (
+            {token: weight / norm for token, weight in vector.items()} if norm else {}
+        )
+
+    def scores(self, msg: str) -> dict[str, float]:
+        query = self._vectorize(Counter(_tokenize(msg)))
+        return {
+            agent: sum(
+                weight * centroid.get(token, 0.0) for token, weight in query.items()
+            )
+            for agent, centroid in self._centroids.items()
+        }
+
+    def predict(self, msg: str) -> str | None:
+        ranked = sorted(
+            self.scores(msg).items(), key=lambda item: item[1], reverse=True
+        )
+        if not ranked:
+            return None
+        best_agent, best_score = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+        if best_score >= self.min_score and best_score - runner_up >= self.min_margin:
+            return best_agent
+        return None
+
+
+class RoutingCache:
+    """
+    Routes repeated or easy user messages without an orchestrator LLM call.
+
+    The exact-match tier is an LRU/TTL cache keyed on the normalized user message and
+    the agent-config fingerprint, filled from past orchestrator decisions. The optional
+    classifier tier (e.g. a `KeywordRouter`) answers when the exact tier misses and it
+    is confident. The orchestrator only uses it for the opening message of a
+    conversation, as follow-ups like "yes" depend on their context, and not for a turn
+    an agent handed back with `RequestTransfer`.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 4096,
+        ttl: float | None = 24 * 60 * 60,
+        classifier: KeywordRouter | None = None,
+    ):
+        self.exact = LRUCache(max_size=max_size, ttl=ttl)
+        self.classifier = classifier
+        self.classifier_hits = 0
+
+    def lookup(self, user_msg: str, fingerprint: str) -> str | None:
+        agent_name = self.exact.get((fingerprint, normalize_message(user_msg)))
+        if agent_name is None and self.classifier is not None:
+            agent_name = self.classifier.predict(user_msg)
+            if agent_name is not None:
+                self.classifier_hits += 1
+        return agent_name
+
+    def store(self, user_msg: str, fingerprint: str, agent_name: str) -> None:
+        self.exact.set((fingerprint, normalize_message(user_msg)), agent_name)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "exact_hits": self.exact.hits,
+            "classifier_hits": self.classifier_hits,
+            "misses": self.exact.misses - self.classifier_hits,
+            "size": len(self.exact),
+        }
+
+
+class RoutingPolicy(BaseModel):
+    """
+    Decides whether a turn goes straight to an agent or through the orchestrator.
+
+    With `sticky`, the active agent keeps the conversation on follow-up turns until it
+    calls `RequestTransfer`, has served `max_turns_per_agent` turns in a row, or the
+    user message contains one of `reroute_keywords`. A message containing a key of
+    `keyword_routes` goes to that agent without asking the orchestrator. Keywords
+    match whole words of the normalized message.
+    """
+
+    sticky: bool = True
+    max_turns_per_agent: int | None = None
+    keyword_routes: dict[str, str] = Field(default_factory=dict)
+    reroute_keywords: list[str] = Field(default_factory=list)
+    # transfers an agent may request per turn before it has to answer itself
+    max_transfers_per_turn: int = 1
+
+    def next_agent(
+        self,
+        user_msg: str,
+        active_speaker: str | None,
+        agent_turns: int,
+        agent_names: Collection[str],
+    ) -> str | None:
+        """The agent to hand the turn to, or None to ask the orchestrator."""
+        msg = f" {normalize_message(user_msg)} "
+        for keyword, agent_name in self.keyword_routes.items():
+            if f" {normalize_message(keyword)} " in msg and agent_name in agent_names:
+                return agent_name
+
+        if not self.sticky or not active_speaker or active_speaker not in agent_names:
+            return None
+        if any(f" {normalize_message(kw)} " in msg for kw in self.reroute_keywords):
+            return None
+        if (
+            self.max_turns_per_agent is not None
+            and agent_turns >= self.max_turns_per_agent
+        ):
+            return None
+        return active_speaker
@@ -0,0 +1,139 @@
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Literal
+
+from pydantic import BaseModel, Field
+
+from llama_index.core.tools import BaseTool, FunctionTool, ToolOutput
+from llama_index.core.workflow import Context
+
+from http_client import AsyncHttpClient
+from utils import FunctionToolWithContext
+
+
+class ToolPolicy(BaseModel):
+    """Used to declare how a tool is executed, approved and whether its results are cached."""
+
+    max_concurrency: int | None = None
+    timeout: float | None = None
+    cpu_bound: bool = False
+
+    # memoization, see `ToolCache`; results are only cached when `cache_ttl` is set.
+    # A hit skips the tool, so don't cache tools with side effects such as state updates
+    cache_ttl: float | None = None
+    cache_scope: Literal["session", "global"] = "session"
+    cache_state_keys: list[str] = Field(default_factory=list)
+    invalidates: list[str] = Field(default_factory=list)
+
+    # human approval, for tools listed in `tools_requiring_human_confirmation`
+    auto_approve: bool = False
+    approval_timeout: float | None = None
+
+
+DEFAULT_TOOL_POLICY = ToolPolicy()
+
+
+class ToolTimeoutError(TimeoutError):
+    """Raised when a tool call exceeds the timeout of its `ToolPolicy`."""
+
+
+class ToolScheduler:
+    """
+    Executes tool calls according to their `ToolPolicy`.
+
+    - `max_concurrency` caps the calls of a tool in flight across all sessions.
+    - `timeout` bounds a single call.
+    - `cpu_bound` tools run their sync function in a worker pool so they don't block
+      the event loop: plain `FunctionTool`s go to the process pool when one is
+      configured (their function must then be picklable), everything else goes to
+      the thread pool.
+    """
+
+    def __init__(self, max_threads: int | None = None, max_processes: int = 0):
+        self.max_threads = max_threads
+        self.max_processes = max_processes
+        self._thread_pool: ThreadPoolExecutor | None = None
+        self._process_pool: ProcessPoolExecutor | None = None
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+
+    def _get_executor(self, tool: BaseTool) -> Executor:
+        if self.max_processes and not isinstance(tool, FunctionToolWithContext):
+            if self._process_pool is None:
+                self._process_pool = ProcessPoolExecutor(self.max_processes)
+            return self._process_pool
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(
+                self.max_threads, thread_name_prefix="tool"
+            )
+        return self._thread_pool
+
+    def _get_semaphore(self, tool_name: str, limit: int) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(tool_name)
+        if semaphore is None:
+            semaphore = self._semaphores[tool_name] = asyncio.Semaphore(limit)
+        return semaphore
+
+    async def run(
+        self,
+        ctx: Context,
+        tool: BaseTool,
+        tool_kwargs: dict[str, Any],
+        policy: ToolPolicy | None = None,
+        http: AsyncHttpClient | None = None,
+    ) -> ToolOutput:
+        policy = policy or DEFAULT_TOOL_POLICY
+        call = self._call(ctx, tool, tool_kwargs, policy, http)
+        if policy.timeout is not None:
+            call = self._with_timeout(tool, call, policy.timeout)
+        if policy.max_concurrency is None:
+            return await call
+
+        semaphore = self._get_semaphore(
+            tool.metadata.get_name(), policy.max_concurrency
+        )
+        async with semaphore:
+            return await call
+
+    @staticmethod
+    async def _with_timeout(tool: BaseTool, call: Any, timeout: float) -> ToolOutput:
+        try:
+            return await asyncio.wait_for(call, timeout)
+        except asyncio.TimeoutError:
+            raise ToolTimeoutError(
+                f"Tool {tool.metadata.get_name()} timed out after {timeout}s"
+            ) from None
+
+    async def _call(
+        self,
+        ctx: Context,
+        tool: BaseTool,
+        tool_kwargs: dict[str, Any],
+        policy: ToolPolicy,
+        http: AsyncHttpClient | None,
+    ) -> ToolOutput:
+        if isinstance(tool, FunctionToolWithContext):
+            if policy.cpu_bound:
+                return await asyncio.get_running_loop().run_in_executor(
+                    self._get_executor(tool),
+                    partial(tool.call, ctx, http=http, **tool_kwargs),
+                )
+            return await tool.acall(ctx, http=http, **tool_kwargs)
+
+        if policy.cpu_bound and isinstance(tool, FunctionTool):
+            raw_output = await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(tool), partial(tool.fn, **tool_kwargs)
+            )
+            return ToolOutput(
+                content=str(raw_output),
+                tool_name=tool.metadata.get_name(),
+                raw_input={"args": (), "kwargs": tool_kwargs},
+                raw_output=raw_output,
+            )
+        return await tool.acall(**tool_kwargs)
+
+    def shutdown(self) -> None:
+        for pool in (self._thread_pool, self._process_pool):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        self._thread_pool = self._process_pool = None
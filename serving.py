@@ -0,0 +1,301 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+from llama_index.core.llms import LLM
+from llama_index.core.workflow import Context, Event
+
+from approvals import ApprovalBroker, PendingApproval
+from workflow import AgentConfig, SystemAgent, ToolApprovedEvent, ToolRequestEvent
+
+ApprovalHandler = Callable[[str, ToolRequestEvent], Awaitable[bool]]
+EventHandler = Callable[[str, Event], None]
+
+DEFAULT_REJECT_REASON = "No approver is available for this session."
+
+
+class ServerBusyError(RuntimeError):
+    """Raised when a turn is rejected by admission control."""
+
+
+@dataclass
+class Session:
+    """The per-session state kept by the `SessionManager`."""
+
+    session_id: str
+    ctx: Context
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    last_active: float = field(default_factory=time.monotonic)
+    num_turns: int = 0
+
+
+class SessionManager:
+    """
+    Serves many concurrent conversations over one `SystemAgent`.
+
+    Each session id owns its own `Context`, so conversations are isolated while sharing
+    the workflow, the LLM client and the tools. Turns of the same session run one at a
+    time; turns of different sessions run concurrently up to `max_concurrent_turns`,
+    with at most `max_pending_turns` waiting for a slot before new turns are rejected.
+    Sessions idle for longer than `idle_timeout` seconds are evicted; if the workflow
+    has a checkpointer, an evicted session resumes from its checkpoint on its next turn.
+
+    Without an approval broker on the workflow, tool calls that need approval are
+    decided by `approval_handler` while the turn waits. With one, the turn ends with
+    the calls parked (`chat` returns None) and resumes when `resolve_approvals` decides
+    them; approvals that time out are resumed as rejected every
+    `approval_check_interval` seconds, their response passed to `event_handler` with
+    the other events of the turn.
+    """
+
+    def __init__(
+        self,
+        workflow: SystemAgent,
+        agent_configs: list[AgentConfig],
+        llm: LLM,
+        initial_state: dict | None = None,
+        max_sessions: int = 10_000,
+        max_concurrent_turns: int = 1_000,
+        max_pending_turns: int = 10_000,
+        idle_timeout: float | None = 15 * 60,
+        approval_handler: ApprovalHandler | None = None,
+        event_handler: EventHandler | None = None,
+        approval_check_interval: float = 1.0,
+    ):
+        self.workflow = workflow
+        self.agent_configs = agent_configs
+        self.llm = llm
+        self.initial_state = initial_state or {}
+        self.max_sessions = max_sessions
+        self.max_pending_turns = max_pending_turns
+        self.idle_timeout = idle_timeout
+        self.approval_handler = approval_handler
+        self.event_handler = event_handler
+        self.approval_check_interval = approval_check_interval
+
+        self._sessions: dict[str, Session] = {}
+        self._turn_semaphore = asyncio.Semaphore(max_concurrent_turns)
+        self._num_pending = 0
+        self._eviction_task: asyncio.Task | None = None
+        self._approval_task: asyncio.Task | None = None
+        # expired batches being resumed, by `(session_id, batch_id)`
+        self._resume_tasks: dict[tuple[str, str], asyncio.Task] = {}
+        self._stats = {
+            "turns_completed": 0,
+            "turns_failed": 0,
+            "turns_rejected": 0,
+            "sessions_evicted": 0,
+        }
+
+    # ---- lifecycle ----
+
+    @property
+    def approval_broker(self) -> ApprovalBroker | None:
+        return self.workflow.approval_broker
+
+    async def start(self) -> None:
+        """Starts the background eviction of idle sessions and expiry of approvals."""
+        if self.idle_timeout and self._eviction_task is None:
+            self._eviction_task = asyncio.create_task(self._evict_idle_sessions())
+        if self.approval_broker is not None and self._approval_task is None:
+            self._approval_task = asyncio.create_task(self._resume_expired_approvals())
+
+    async def stop(self) -> None:
+        """Stops the background loops and releases the resources owned by the workflow."""
+        for task in (self._eviction_task, self._approval_task):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._eviction_task = self._approval_task = None
+        await self.workflow.aclose()
+
+    async def __aenter__(self) -> "SessionManager":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.stop()
+
+    # ---- sessions ----
+
+    @property
+    def num_sessions(self) -> int:
+        return len(self._sessions)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            **self._stats,
+            "sessions": self.num_sessions,
+            "pending": self._num_pending,
+        }
+
+    def _get_or_create_session(self, session_id: str) -> Session:
+        session = self._sessions.get(session_id)
+        if session is None:
+            if len(self._sessions) >= self.max_sessions:
+                self._stats["turns_rejected"] += 1
+                raise ServerBusyError(
+                    f"Session limit of {self.max_sessions} reached, cannot open {session_id}."
+                )
+            session = Session(
+                session_id=session_id,
+                ctx=Context(self.workflow),
+            )
+            self._sessions[session_id] = session
+        return session
+
+    def close_session(self, session_id: str) -> None:
+        self._sessions.pop(session_id, None)
+
+    async def _evict_idle_sessions(self) -> None:
+        while True:
+            await asyncio.sleep(self.idle_timeout / 4)
+            deadline = time.monotonic() - self.idle_timeout
+            for session_id, session in list(self._sessions.items()):
+                if session.last_active < deadline and not session.lock.locked():
+                    del self._sessions[session_id]
+                    self._stats["sessions_evicted"] += 1
+
+    # ---- turns ----
+
+    async def chat(self, session_id: str, user_msg: str) -> str | None:
+        """
+        Runs one conversation turn for `session_id` and returns the agent response, or
+        None if the turn is parked on tool approvals, see `pending_approvals`.
+        """
+        return await self._turn(session_id, user_msg=user_msg)
+
+    async def _turn(
+        self, session_id: str, user_msg: str | None = None, batch_id: str | None = None
+    ) -> str | None:
+        if self._num_pending >= self.max_pending_turns:
+            self._stats["turns_rejected"] += 1
+            raise ServerBusyError("Too many pending turns, try again later.")
+
+        session = self._get_or_create_session(session_id)
+        self._num_pending += 1
+        try:
+            await session.lock.acquire()
+            try:
+                await self._turn_semaphore.acquire()
+            except BaseException:
+                session.lock.release()
+                raise
+        finally:
+            self._num_pending -= 1
+
+        try:
+            if batch_id is None:
+                return await self._run_turn(session, user_msg=user_msg)
+            # another caller may have resumed the batch while this one waited
+            approvals = self.approval_broker.take_batch(session_id, batch_id)
+            if approvals is None:
+                return None
+            return await self._run_turn(session, approvals=approvals)
+        except Exception:
+            self._stats["turns_failed"] += 1
+            raise
+        finally:
+            session.last_active = time.monotonic()
+            self._turn_semaphore.release()
+            session.lock.release()
+
+    async def _run_turn(
+        self,
+        session: Session,
+        user_msg: str | None = None,
+        approvals: list[PendingApproval] | None = None,
+    ) -> str | None:
+        # the conversation and user state live in the session's context after the first turn
+        handler = self.workflow.run(
+            ctx=session.ctx,
+            session_id=session.session_id,
+            user_msg=user_msg,
+            approvals=approvals,
+            agent_configs=self.agent_configs,
+            llm=self.llm,
+            initial_state=dict(self.initial_state) if not session.num_turns else None,
+        )
+
+        async for event in handler.stream_events():
+            # parked requests are answered through `resolve_approvals` instead
+            if isinstance(event, ToolRequestEvent) and event.approval_id is None:
+                handler.ctx.send_event(
+                    await self._request_approval(session.session_id, event)
+                )
+            elif self.event_handler is not None:
+                self.event_handler(session.session_id, event)
+
+        result = await handler
+        if user_msg is not None:
+            session.num_turns += 1
+        self._stats["turns_completed"] += 1
+        return result["response"]
+
+    # ---- approvals ----
+
+    def pending_approvals(self, session_id: str) -> list[PendingApproval]:
+        if self.approval_broker is None:
+            return []
+        return self.approval_broker.pending(session_id)
+
+    async def resolve_approvals(
+        self,
+        session_id: str,
+        decisions: dict[str, bool] | bool,
+        reason: str | None = None,
+    ) -> str | None:
+        """
+        Records approval decisions for the parked tool calls of `session_id`, by
+        approval id or one decision for all of them, and resumes the turn once every
+        call of its batch is decided. Returns the agent response, or None while some
+        calls are still pending.
+        """
+        if self.approval_broker is None:
+            raise ValueError("The workflow has no approval broker!")
+        pending = {a.approval_id for a in self.approval_broker.pending(session_id)}
+        if isinstance(decisions, bool):
+            decisions = dict.fromkeys(pending, decisions)
+        self.approval_broker.resolve_many(
+            {k: v for k, v in decisions.items() if k in pending}, reason
+        )
+
+        response = None
+        for _, batch_id in self.approval_broker.ready_batches(session_id):
+            response = await self._turn(session_id, batch_id=batch_id)
+        return response
+
+    async def _resume_expired_approvals(self) -> None:
+        while True:
+            await asyncio.sleep(self.approval_check_interval)
+            for batch in self.approval_broker.ready_batches(expired=True):
+                if batch not in self._resume_tasks:
+                    task = asyncio.create_task(self._resume_in_background(*batch))
+                    self._resume_tasks[batch] = task
+                    task.add_done_callback(
+                        lambda _, batch=batch: self._resume_tasks.pop(batch, None)
+                    )
+
+    async def _resume_in_background(self, session_id: str, batch_id: str) -> None:
+        # the response reaches `event_handler` as the turn's `StopEvent`
+        try:
+            await self._turn(session_id, batch_id=batch_id)
+        except Exception:
+            # counted in `turns_failed`/`turns_rejected`; a rejected turn is retried
+            pass
+
+    async def _request_approval(
+        self, session_id: str, event: ToolRequestEvent
+    ) -> ToolApprovedEvent:
+        approved = False
+        if self.approval_handler is not None:
+            approved = await self.approval_handler(session_id, event)
+        return ToolApprovedEvent(
+            tool_id=event.tool_id,
+            tool_name=event.tool_name,
+            tool_kwargs=event.tool_kwargs,
+            batch_id=event.batch_id,
+            approved=approved,
+            response=None if approved else DEFAULT_REJECT_REASON,
+        )
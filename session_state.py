@@ -0,0 +1,252 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Iterable, Mapping
+from weakref import WeakKeyDictionary
+
+from llama_index.core.llms import LLM, ChatMessage
+from llama_index.core.workflow import Context
+
+from approvals import PendingApproval
+from conversation import ConversationStore
+
+if TYPE_CHECKING:
+    from workflow import AgentConfig
+
+SESSION_STATE_KEY = "session_state"
+# tools written against plain context keys read the user state from here; it is the
+# same `UserState` object as `SessionState.user_state`
+USER_STATE_KEY = "user_state"
+
+_MISSING = object()
+# held while the session state of a context is created
+_creation_locks: WeakKeyDictionary[Context, asyncio.Lock] = WeakKeyDictionary()
+
+
+class UserState(dict):
+    """
+    The user state of a session: a dict that versions its changes.
+
+    Every change made through the dict methods bumps `version` (once per call) and
+    marks the changed keys dirty, so the rendered prompt is only rebuilt for the
+    fields that changed. Values are compared on write, so a nested value mutated in
+    place is not seen; assign a new value instead.
+    """
+
+    __slots__ = ("version", "_dirty", "_lines", "_rendered")
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.version = 0
+        self._dirty: set[str] = set()
+        # the rendered "key: value" line of every field, and the joined text
+        self._lines: dict[str, str] = {}
+        self._rendered: str | None = None
+
+    def _changed(self, keys: Iterable[str]) -> None:
+        keys = set(keys)
+        if keys:
+            self.version += 1
+            self._dirty |= keys
+            self._rendered = None
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if self.get(key, _MISSING) != value:
+            super().__setitem__(key, value)
+            self._changed((key,))
+
+    def __delitem__(self, key: str) -> None:
+        super().__delitem__(key)
+        self._changed((key,))
+
+    def __ior__(self, other: Mapping[str, Any]) -> "UserState":
+        self.update(other)
+        return self
+
+    def update(self, *args: Any, **kwargs: Any) -> None:
+        changed = []
+        for key, value in dict(*args, **kwargs).items():
+            if self.get(key, _MISSING) != value:
+                super().__setitem__(key, value)
+                changed.append(key)
+        self._changed(changed)
+
+    def setdefault(self, key: str, default: Any = None) -> Any:
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key: str, *default: Any) -> Any:
+        if key not in self:
+            return super().pop(key, *default)
+        value = super().pop(key)
+        self._changed((key,))
+        return value
+
+    def popitem(self) -> tuple[str, Any]:
+        key, value = super().popitem()
+        self._changed((key,))
+        return key, value
+
+    def clear(self) -> None:
+        keys = list(self)
+        super().clear()
+        self._changed(keys)
+
+    def replace(self, data: Mapping[str, Any]) -> None:
+        """Replaces the whole state, as one version."""
+        changed = {key for key in self if key not in data or self[key] != data[key]}
+        changed |= {key for key in data if key not in self}
+        # rebuilt in the order of `data`, like assigning a new dict
+        super().clear()
+        super().update(data)
+        self._lines = {}
+        self._dirty = set(self)
+        self._changed(changed)
+
+    def restore(self, data: Mapping[str, Any], version: int) -> None:
+        """Loads a checkpointed state along with its version."""
+        self.replace(data)
+        self.version = version
+
+    @property
+    def dirty(self) -> frozenset[str]:
+        """The fields changed since the state was last rendered."""
+        return frozenset(self._dirty)
+
+    def render(self) -> str:
+        """The state as "key: value" lines, re-rendering only the dirty fields."""
+        if self._rendered is None:
+            for key in self._dirty:
+                if key in self:
+                    self._lines[key] = f"{key}: {self[key]}"
+                else:
+                    self._lines.pop(key, None)
+            self._dirty.clear()
+            # the lines of updated fields keep their place, like the dict keys
+            self._rendered = "\n".join(self._lines[key] for key in self)
+        return self._rendered
+
+
+@dataclass(slots=True)
+class ToolBatch:
+    """The tool calls of one LLM message, and their results as they come in."""
+
+    tool_ids: list[str]
+    results: dict[str, ChatMessage] = field(default_factory=dict)
+    # calls of the batch parked in the approval broker, which end the turn
+    parked: list[PendingApproval] = field(default_factory=list)
+
+    @property
+    def complete(self) -> bool:
+        return len(self.results) >= len(self.tool_ids)
+
+    def ordered_results(self) -> list[ChatMessage]:
+        """The results in the order the LLM made the calls."""
+        return [self.results[tool_id] for tool_id in self.tool_ids]
+
+
+class SessionState:
+    """
+    The state of one session run by `SystemAgent`, kept in the `Context` under one key.
+
+    Steps fetch it once and change it in place through its methods. None of them
+    awaits, so every change is atomic on the event loop: steps running concurrently
+    (e.g. the workers of `handle_tool_call` and `aggregate_tool_results`) cannot lose
+    each other's updates, and they don't queue on the context lock for every field.
+    """
+
+    __slots__ = (
+        "session_id",
+        "llm",
+        "agent_configs",
+        "conversation",
+        "user_state",
+        "active_speaker",
+        "agent_turns",
+        "turn_transfers",
+        "tool_batches",
+    )
+
+    def __init__(self) -> None:
+        self.session_id: str | None = None
+        self.llm: LLM | None = None
+        self.agent_configs: dict[str, "AgentConfig"] = {}
+        self.conversation: ConversationStore | None = None
+        self.user_state = UserState()
+        self.active_speaker = ""
+        # the turns in a row the active agent has served, for the `RoutingPolicy`
+        self.agent_turns = 0
+        # the transfers requested during the current turn
+        self.turn_transfers = 0
+        self.tool_batches: dict[str, ToolBatch] = {}
+
+    @property
+    def chat_history(self) -> list[ChatMessage]:
+        return self.conversation.messages
+
+    def agent_config(self, agent_name: str | None = None) -> "AgentConfig":
+        """The config of `agent_name`, the active speaker by default."""
+        return self.agent_configs[agent_name or self.active_speaker]
+
+    def append_message(self, message: ChatMessage) -> None:
+        self.conversation.append(message)
+
+    def set_active_speaker(self, agent_name: str, agent_turns: int = 1) -> None:
+        self.active_speaker = agent_name
+        self.agent_turns = agent_turns
+
+    def update_user_state(self, **fields: Any) -> None:
+        self.user_state.update(fields)
+
+    def start_batch(
+        self,
+        batch_id: str,
+        tool_ids: list[str],
+        parked: list[PendingApproval] | None = None,
+    ) -> None:
+        self.tool_batches[batch_id] = ToolBatch(tool_ids, parked=parked or [])
+
+    def add_tool_result(self, batch_id: str, message: ChatMessage) -> ToolBatch | None:
+        """Records a result; returns the batch, removed, once all its results are in."""
+        batch = self.tool_batches[batch_id]
+        batch.results[message.additional_kwargs["tool_call_id"]] = message
+        if not batch.complete:
+            return None
+        del self.tool_batches[batch_id]
+        return batch
+
+    # ---- checkpoints ----
+
+    def checkpoint_fields(self) -> dict[str, Any]:
+        """The fields a checkpoint carries besides the conversation."""
+        return {
+            "active_speaker": self.active_speaker,
+            "agent_turns": self.agent_turns,
+            "user_state": dict(self.user_state),
+            "user_state_version": self.user_state.version,
+        }
+
+    def restore_checkpoint_fields(self, fields: Mapping[str, Any]) -> None:
+        self.active_speaker = fields.get("active_speaker") or ""
+        self.agent_turns = fields.get("agent_turns") or 0
+        if fields.get("user_state") is not None:
+            self.user_state.restore(
+                fields["user_state"], fields.get("user_state_version") or 0
+            )
+
+
+async def get_session_state(ctx: Context) -> SessionState:
+    """The state of the session run with `ctx`, created on first use."""
+    state = await ctx.get(SESSION_STATE_KEY, default=None)
+    if state is not None:
+        return state
+    # concurrent first uses would each create a state and the last one would win
+    lock = _creation_locks.setdefault(ctx, asyncio.Lock())
+    async with lock:
+        state = await ctx.get(SESSION_STATE_KEY, default=None)
+        if state is None:
+            state = SessionState()
+            await ctx.set(SESSION_STATE_KEY, state)
+            await ctx.set(USER_STATE_KEY, state.user_state)
+    _creation_locks.pop(ctx, None)
+    return state
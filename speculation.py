@@ -0,0 +1,185 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Hashable
+
+from llama_index.core.llms import ChatMessage, ChatResponse
+
+from llm_gateway import estimate_tokens
+from routing import KeywordRouter
+
+
+@dataclass
+class Speculation:
+    """A sub-agent LLM call started before the orchestrator picked the agent."""
+
+    agent_name: str
+    task: asyncio.Task
+    prompt_tokens: int
+    # the history it was built from, it is only used if the history did not change
+    num_messages: int
+    started_at: float = field(default_factory=time.perf_counter)
+
+
+class Speculator:
+    """
+    Runs the LLM call of the sub-agent the orchestrator is most likely to pick
+    concurrently with the orchestrator's own call, saving a round trip when the guess
+    is right.
+
+    Candidates are the session's last active agent, then the agents the `classifier`
+    scores at least `min_score` for the user message, up to `max_agents` of them. The
+    call of the picked agent is kept and the others are cancelled. Speculative calls
+    spend at most `tokens_per_minute` estimated prompt tokens; beyond that, agents are
+    not speculated on until the budget refills.
+    """
+
+    def __init__(
+        self,
+        classifier: KeywordRouter | None = None,
+        max_agents: int = 1,
+        min_score: float = 0.1,
+        use_last_agent: bool = True,
+        tokens_per_minute: int | None = None,
+    ):
+        self.classifier = classifier
+        self.max_agents = max_agents
+        self.min_score = min_score
+        self.use_last_agent = use_last_agent
+        self.tokens_per_minute = tokens_per_minute
+        self._budget = float(tokens_per_minute or 0)
+        self._refilled_at = time.monotonic()
+        # started by the orchestrator, then kept for the picked agent until it speaks
+        self._running: dict[Hashable, list[Speculation]] = {}
+        self._kept: dict[Hashable, Speculation] = {}
+
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.over_budget = 0
+        self.latency_saved = 0.0
+        self.wasted_tokens = 0
+
+    def candidates(
+        self, user_msg: str | None, last_agent: str | None, agent_names: list[str]
+    ) -> list[str]:
+        """The agents to speculate on, most likely first."""
+        candidates = []
+        if self.use_last_agent and last_agent in agent_names:
+            candidates.append(last_agent)
+        if self.classifier is not None and user_msg:
+            scores = self.classifier.scores(user_msg)
+            for agent_name in sorted(scores, key=scores.get, reverse=True):
+                if scores[agent_name] < self.min_score:
+                    break
+                if agent_name in agent_names and agent_name not in candidates:
+                    candidates.append(agent_name)
+        return candidates[: self.max_agents]
+
+    def _spend(self, tokens: int) -> bool:
+        if self.tokens_per_minute is None:
+            return True
+        now = time.monotonic()
+        self._budget = min(
+            float(self.tokens_per_minute),
+            self._budget + (now - self._refilled_at) * self.tokens_per_minute / 60,
+        )
+        self._refilled_at = now
+        if self._budget < tokens:
+            self.over_budget += 1
+            return False
+        self._budget -= tokens
+        return True
+
+    def start(
+        self,
+        key: Hashable,
+        agent_name: str,
+        llm_input: list[ChatMessage],
+        call: Awaitable[ChatResponse],
+        num_messages: int,
+    ) -> bool:
+        """Runs `call` in the background for `agent_name`, if the budget allows."""
+        prompt_tokens = estimate_tokens(llm_input)
+        if not self._spend(prompt_tokens):
+            call.close()
+            return False
+        speculation = Speculation(
+            agent_name=agent_name,
+            task=asyncio.ensure_future(self._timed(call)),
+            prompt_tokens=prompt_tokens,
+            num_messages=num_messages,
+        )
+        self._running.setdefault(key, []).append(speculation)
+        self.started += 1
+        return True
+
+    @staticmethod
+    async def _timed(call: Awaitable[ChatResponse]) -> tuple[ChatResponse, float]:
+        response = await call
+        return response, time.perf_counter()
+
+    def resolve(self, key: Hashable, agent_name: str | None) -> None:
+        """Keeps the call for the agent the orchestrator picked and cancels the rest."""
+        for speculation in self._running.pop(key, []):
+            if speculation.agent_name == agent_name:
+                self._kept[key] = speculation
+            else:
+                self._discard(speculation)
+
+    def take(
+        self, key: Hashable, agent_name: str, num_messages: int
+    ) -> Speculation | None:
+        """The kept call for `agent_name`, if it was built from the same history."""
+        speculation = self._kept.pop(key, None)
+        if speculation is None:
+            return None
+        if (
+            speculation.agent_name != agent_name
+            or speculation.num_messages != num_messages
+        ):
+            self._discard(speculation)
+            return None
+        return speculation
+
+    async def result(self, speculation: Speculation) -> ChatResponse:
+        """Waits for a kept call and records the time it saved."""
+        waited_from = time.perf_counter()
+        try:
+            response, finished_at = await speculation.task
+        except Exception:
+            self.misses += 1
+            raise
+        self.hits += 1
+        # without speculation, the call would have started when it was needed
+        self.latency_saved += min(
+            finished_at - speculation.started_at, waited_from - speculation.started_at
+        )
+        return response
+
+    def _discard(self, speculation: Speculation) -> None:
+        self.misses += 1
+        task = speculation.task
+        if task.done() and not task.cancelled() and task.exception() is None:
+            usage = task.result()[0].additional_kwargs
+            self.wasted_tokens += usage.get("prompt_tokens", speculation.prompt_tokens)
+            self.wasted_tokens += usage.get("completion_tokens", 0)
+        else:
+            # a provider may bill the prompt of a cancelled call
+            self.wasted_tokens += speculation.prompt_tokens
+            task.cancel()
+
+    def stats(self) -> dict[str, float]:
+        decided = self.hits + self.misses
+        return {
+            "started": self.started,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / decided if decided else 0.0,
+            "over_budget": self.over_budget,
+            "latency_saved": self.latency_saved,
+            "latency_saved_per_hit": self.latency_saved / self.hits
+            if self.hits
+            else 0.0,
+            "wasted_tokens": self.wasted_tokens,
+        }
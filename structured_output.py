@@ -0,0 +1,173 @@
+import json
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Iterable
+
+from llama_index.core.llms import ChatMessage
+from pydantic import BaseModel, ConfigDict, PrivateAttr, ValidationError
+
+# how an answer came out of `SystemAgent._validate_output`
+OUTCOMES = ("valid", "repaired_locally", "repaired_by_llm", "failed", "unstructured")
+DEFAULT_REPAIR_PROMPT = (
+    "Rewrite the output below as a JSON object matching this JSON schema. Keep its "
+    "content, fix only the format, and reply with the JSON object alone.\n{schema}"
+)
+
+
+def repair_json(text: str) -> tuple[str | None, list[str]]:
+    """
+    The first JSON object in `text` made parseable, and the repairs it needed.
+
+    Scans the text once, like a streaming parser: drops the text around the object
+    (prose, code fences), trailing commas, and closes the strings and brackets of a
+    truncated object, cutting it after its last complete member if it stops within a
+    key. Returns None if there is no object or its brackets don't match.
+    """
+    start = text.find("{")
+    if start < 0:
+        return None, []
+    repairs = ["leading text"] if text[:start].strip() else []
+    out: list[str] = []
+    stack: list[str] = []
+    in_string = escaped = False
+    end = None
+    # where the last member of an object or array ended, and the brackets open there
+    last_member: tuple[int, list[str]] | None = None
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            elif char == "\n":
+                char = "\\n"
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char == ",":
+            last_member = (len(out), list(stack))
+        elif char in "}]":
+            if stack.pop() != char:
+                return None, repairs
+            if _drop_trailing_comma(out):
+                repairs.append("trailing comma")
+            if not stack:
+                out.append(char)
+                end = i
+                break
+        out.append(char)
+
+    if end is None:
+        repairs.append("truncated")
+        closed = out + ['"'] if in_string else list(out)
+        _drop_trailing_comma(closed)
+        if "".join(closed).rstrip().endswith(":"):
+            closed.append("null")
+        candidate = "".join(closed + stack[::-1])
+        if last_member is not None and not _is_json(candidate):
+            position, open_brackets = last_member
+            candidate = "".join(out[:position] + open_brackets[::-1])
+        return candidate, repairs
+    if text[end + 1 :].strip():
+        repairs.append("trailing text")
+    return "".join(out), repairs
+
+
+def _is_json(text: str) -> bool:
+    try:
+        json.loads(text)
+    except json.JSONDecodeError:
+        return False
+    return True
+
+
+def _drop_trailing_comma(out: list[str]) -> bool:
+    i = len(out) - 1
+    while i >= 0 and out[i].isspace():
+        i -= 1
+    if i >= 0 and out[i] == ",":
+        del out[i]
+        return True
+    return False
+
+
+@dataclass(slots=True)
+class ParsedOutput:
+    """An agent's answer checked against its output schema."""
+
+    value: BaseModel | None
+    repairs: list[str] = field(default_factory=list)
+    error: str | None = None
+
+
+class OutputSchema(BaseModel):
+    """
+    Used to validate the final answers of an agent against a pydantic model.
+
+    Answers with a JSON object are parsed and validated, repaired locally when
+    possible (see `repair_json`), and otherwise sent back to the LLM with a short
+    repair prompt, up to `max_llm_repairs` times, without the conversation. Answers
+    without a JSON object, e.g. questions to the user, pass as they are unless
+    `required`. An answer that could not be repaired is returned unchanged.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    model: type[BaseModel]
+    required: bool = False
+    max_llm_repairs: int = 1
+    repair_prompt: str = DEFAULT_REPAIR_PROMPT
+
+    _stats: Counter = PrivateAttr(default_factory=Counter)
+
+    def parse(self, text: str) -> ParsedOutput | None:
+        """Validates `text`; None if it has no JSON object and none is required."""
+        candidate, repairs = repair_json(text)
+        if candidate is None:
+            if "{" not in text and not self.required:
+                return None
+            return ParsedOutput(
+                None, repairs, "the answer has no well-formed JSON object"
+            )
+        try:
+            data = json.loads(candidate)
+            return ParsedOutput(self.model.model_validate(data), repairs)
+        except json.JSONDecodeError as e:
+            return ParsedOutput(None, repairs, f"invalid JSON: {e}")
+        except ValidationError as e:
+            errors = "; ".join(
+                f"{'.'.join(map(str, error['loc'])) or 'value'}: {error['msg']}"
+                for error in e.errors()
+            )
+            return ParsedOutput(None, repairs, errors)
+
+    def repair_input(self, text: str, error: str) -> list[ChatMessage]:
+        """The LLM input of a repair call: the schema, the answer and its errors."""
+        schema = json.dumps(self.model.model_json_schema(), separators=(",", ":"))
+        return [
+            ChatMessage(
+                role="system", content=self.repair_prompt.format(schema=schema)
+            ),
+            ChatMessage(role="user", content=f"Output:\n{text}\n\nErrors:\n{error}"),
+        ]
+
+    def record(self, outcome: str, repairs: Iterable[str] = ()) -> None:
+        """Counts an answer by its outcome (`OUTCOMES`) and the repairs it needed."""
+        self._stats[outcome] += 1
+        for repair in repairs:
+            self._stats[f"repair: {repair}"] += 1
+
+    def stats(self) -> dict[str, Any]:
+        stats = {outcome: 0 for outcome in OUTCOMES} | self._stats
+        checked = sum(stats[outcome] for outcome in OUTCOMES[:4])
+        repaired = stats["repaired_locally"] + stats["repaired_by_llm"]
+        return {
+            **stats,
+            "checked": checked,
+            "repair_rate": repaired / checked if checked else 0.0,
+            "failure_rate": stats["failed"] / checked if checked else 0.0,
+        }
@@ -0,0 +1,70 @@
+import asyncio
+
+from approvals import APPROVAL_CANCELLED_REASON, APPROVAL_TIMEOUT_REASON, ApprovalBroker
+from benchmarks.mock_llm import MockFunctionCallingLLM
+from benchmarks.stub_server import UserInfoStub
+from main import get_agent_configs, get_health_coach_tools
+from serving import SessionManager
+from session_state import get_session_state
+from workflow import SystemAgent
+
+
+def _park(broker: ApprovalBroker, *tool_names: str, timeout: float | None = None):
+    return broker.park(
+        "session",
+        "batch",
+        [(f"call-{name}", name, {}) for name in tool_names],
+        timeouts={name: timeout for name in tool_names},
+    )
+
+
+def test_cancel_session_rejects_only_undecided_calls():
+    broker = ApprovalBroker()
+    _, approved, rejected = _park(broker, "pending", "approved", "rejected")
+    _park(broker, "expired", timeout=-1)
+    broker.resolve_many(
+        {approved.approval_id: True, rejected.approval_id: False}, reason="no"
+    )
+
+    cancelled = {a.tool_name: a for a in broker.cancel_session("session")}
+
+    assert cancelled["pending"].status == "rejected"
+    assert cancelled["pending"].reason == APPROVAL_CANCELLED_REASON
+    assert cancelled["approved"].status == "approved"
+    assert cancelled["approved"].reason is None
+    assert cancelled["rejected"].reason == "no"
+    assert cancelled["expired"].status == "expired"
+    assert cancelled["expired"].reason == APPROVAL_TIMEOUT_REASON
+    assert broker.pending("session") == []
+    assert broker.cancel_session("session") == []
+
+
+def test_approved_call_runs_when_the_user_moves_on():
+    async def main() -> None:
+        broker = ApprovalBroker()
+        with UserInfoStub(latency=0) as stub:
+            agent_configs = get_agent_configs()
+            agent_configs[0].tools = get_health_coach_tools(user_info_url=stub.url)
+            workflow = SystemAgent(timeout=None, approval_broker=broker)
+            async with SessionManager(
+                workflow, agent_configs, MockFunctionCallingLLM()
+            ) as manager:
+                # parked for approval, which arrives without resuming the turn
+                assert await manager.chat("session", "start health coaching") is None
+                (approval,) = broker.pending("session")
+                broker.resolve_many({approval.approval_id: True})
+
+                await manager.chat("session", "gain muscle")
+
+                ctx = manager._sessions["session"].ctx
+                state = await get_session_state(ctx)
+                (tool_message,) = [
+                    m
+                    for m in state.chat_history
+                    if m.additional_kwargs.get("tool_call_id") == approval.tool_id
+                ]
+            assert stub.num_requests == 1
+        assert tool_message.content.startswith("The user information is")
+        assert "user_persona" in state.user_state
+
+    asyncio.run(main())
@@ -0,0 +1,96 @@
+import asyncio
+import functools
+import os
+import signal
+import time
+
+import pytest
+
+from benchmarks.bench_workers import make_manager
+from benchmarks.stub_server import UserInfoStub
+from cluster import HashRing, WorkerError, WorkerPool
+from serving import SessionManager
+
+
+def test_adding_a_node_moves_about_one_nth_of_the_keys():
+    keys = [f"session-{i}" for i in range(4000)]
+    ring = HashRing(range(4))
+    before = {key: ring.node_for(key) for key in keys}
+    assert before == {key: HashRing(range(4)).node_for(key) for key in keys}
+
+    ring.add(4)
+    after = {key: ring.node_for(key) for key in keys}
+    moved = [key for key in keys if after[key] != before[key]]
+    # only to the new node, about a fifth of the keys
+    assert {after[key] for key in moved} == {4}
+    assert 0.1 < len(moved) / len(keys) < 0.3
+
+    ring.remove(4)
+    assert {key: ring.node_for(key) for key in keys} == before
+
+
+def test_empty_ring_has_no_node():
+    with pytest.raises(ValueError):
+        HashRing().node_for("session")
+
+
+def _manager_unless(marker: str, user_info_url: str) -> SessionManager:
+    """A worker's manager; fails to build while `marker` exists."""
+    if os.path.exists(marker):
+        raise RuntimeError("broken deployment")
+    return make_manager(user_info_url, llm_latency=0)
+
+
+def test_killed_worker_is_replaced_or_fails_its_requests(tmp_path):
+    marker = str(tmp_path / "broken")
+
+    async def main() -> None:
+        with UserInfoStub(latency=0) as stub:
+            pool = WorkerPool(
+                functools.partial(_manager_unless, marker, stub.url),
+                num_workers=1,
+                restart_attempts=2,
+                restart_backoff=0.1,
+            )
+            async with pool:
+                assert await pool.chat("session", "Hello!")
+
+                # replaced, the next request waits for the new worker
+                os.kill(pool._workers[0].process.pid, signal.SIGKILL)
+                await asyncio.sleep(0.1)
+                assert await asyncio.wait_for(pool.chat("session", "Hello!"), 60)
+
+                # no replacement starts, the requests fail instead of waiting
+                open(marker, "w").close()
+                os.kill(pool._workers[0].process.pid, signal.SIGKILL)
+                await asyncio.sleep(0.1)
+                with pytest.raises(WorkerError, match="could not be restarted"):
+                    await asyncio.wait_for(pool.chat("session", "Hello!"), 60)
+                assert pool._workers[0].replace_task is None
+
+                os.unlink(marker)
+                await pool.restart_worker(0)
+                assert await pool.chat("session", "Hello!")
+
+    asyncio.run(main())
+
+
+def test_worker_still_busy_after_the_drain_timeout_is_killed():
+    async def main() -> float:
+        with UserInfoStub(latency=0) as stub:
+            pool = WorkerPool(
+                functools.partial(make_manager, stub.url, 60),
+                num_workers=1,
+                drain_timeout=0.5,
+            )
+            async with pool:
+                turn = asyncio.create_task(pool.chat("session", "Hello!"))
+                await asyncio.sleep(0.5)
+                start = time.monotonic()
+                await pool.restart_worker(0)
+                elapsed = time.monotonic() - start
+                with pytest.raises(WorkerError):
+                    await turn
+        return elapsed
+
+    assert asyncio.run(main()) < 10
@@ -0,0 +1,71 @@
+import asyncio
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from benchmarks.stub_server import USER_INFO, UserInfoStub
+from http_client import AsyncHttpClient
+
+
+def test_get_json_reuses_one_session():
+    async def main() -> None:
+        with UserInfoStub(latency=0) as stub:
+            async with AsyncHttpClient() as client:
+                results = await asyncio.gather(
+                    *(client.get_json(stub.url) for _ in range(5))
+                )
+                session = client._session
+                await client.get_json(stub.url)
+                assert client._session is session
+            assert client.closed
+        assert results == [USER_INFO] * 5
+
+    asyncio.run(main())
+
+
+async def _flaky_server(failures: int, status: int) -> tuple[TestServer, list[int]]:
+    calls = []
+
+    async def handler(request: web.Request) -> web.Response:
+        calls.append(1)
+        if len(calls) <= failures:
+            return web.Response(status=status)
+        return web.json_response({"ok": True})
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    server = TestServer(app)
+    await server.start_server()
+    return server, calls
+
+
+def test_retries_retryable_statuses():
+    async def main() -> None:
+        server, calls = await _flaky_server(failures=2, status=503)
+        try:
+            async with AsyncHttpClient(max_retries=2, backoff=0.001) as client:
+                assert await client.get_json(str(server.make_url("/"))) == {"ok": True}
+        finally:
+            await server.close()
+        assert len(calls) == 3
+
+    asyncio.run(main())
+
+
+def test_gives_up_after_max_retries_and_on_other_errors():
+    async def main() -> None:
+        for status, max_retries, expected_calls in ((503, 1, 2), (404, 3, 1)):
+            server, calls = await _flaky_server(failures=10, status=status)
+            try:
+                async with AsyncHttpClient(
+                    max_retries=max_retries, backoff=0.001
+                ) as client:
+                    with pytest.raises(aiohttp.ClientResponseError):
+                        await client.get_json(str(server.make_url("/")))
+            finally:
+                await server.close()
+            assert len(calls) == expected_calls
+
+    asyncio.run(main())
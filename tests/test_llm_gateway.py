@@ -0,0 +1,102 @@
+import asyncio
+import time
+
+import pytest
+from llama_index.core.llms import ChatMessage
+
+from benchmarks.mock_llm import MockFunctionCallingLLM
+from cache import LRUCache
+from llm_gateway import LLMGateway, LLMLimits, _FairLimiter
+
+
+def test_waiter_wakes_up_once_the_budget_refills():
+    async def main() -> float:
+        # 10 tokens per second
+        limiter = _FairLimiter(LLMLimits(tokens_per_minute=600))
+        await limiter.acquire("session", 600)
+        limiter.release(600)
+        start = time.monotonic()
+        await asyncio.wait_for(limiter.acquire("session", 5), timeout=5)
+        return time.monotonic() - start
+
+    assert 0.3 < asyncio.run(main()) < 2
+
+
+def test_waiters_are_served_round_robin_by_session():
+    async def main() -> list[str]:
+        limiter = _FairLimiter(LLMLimits(max_concurrency=1))
+        await limiter.acquire("busy", 1)
+        order = []
+
+        async def request(key: str) -> None:
+            await limiter.acquire(key, 1)
+            order.append(key)
+            limiter.release(1)
+
+        tasks = [asyncio.create_task(request(key)) for key in ["a"] * 3 + ["b"]]
+        await asyncio.sleep(0)
+        limiter.release(1)
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(main()) == ["a", "b", "a", "a"]
+
+
+def test_sequential_calls_past_the_token_budget_complete():
+    async def main() -> float:
+        gateway = LLMGateway(tokens_per_minute=6000, coalesce=False)
+        llm = MockFunctionCallingLLM()
+        # the first call empties the bucket, the next ones wait for it to refill
+        await gateway.achat(llm, [ChatMessage(role="user", content="x " * 12000)])
+        start = time.monotonic()
+        for i in range(3):
+            message = ChatMessage(role="user", content=f"{i} " + "x " * 200)
+            await asyncio.wait_for(gateway.achat(llm, [message]), timeout=10)
+        return time.monotonic() - start
+
+    # about 100 tokens each at 100 tokens per second
+    assert 1 < asyncio.run(main()) < 8
+
+
+class _BrokenStreamLLM(MockFunctionCallingLLM):
+    """Drops the connection after the first chunk of its streams while `broken`."""
+
+    broken: bool = True
+
+    async def astream_chat(self, messages, **kwargs):
+        stream = await super().astream_chat(messages, **kwargs)
+        if not self.broken:
+            return stream
+
+        async def gen():
+            yield await anext(stream)
+            raise ConnectionError("connection reset")
+
+        return gen()
+
+
+def test_failed_stream_is_not_cached():
+    async def main() -> list[str]:
+        gateway = LLMGateway(response_cache=LRUCache(max_size=16))
+        llm = _BrokenStreamLLM()
+        messages = [ChatMessage(role="user", content="what is a healthy breakfast")]
+        with pytest.raises(ConnectionError):
+            async for _ in gateway.astream_chat_with_tools(llm, [], messages):
+                pass
+        llm.broken = False
+        answers = []
+        for _ in range(2):
+            async for response in gateway.astream_chat_with_tools(llm, [], messages):
+                pass
+            answers.append(response.message.content)
+            # the response is cached once the stream's task is done
+            await asyncio.sleep(0)
+        assert gateway.stats()["cache_hits"] == 1
+        return answers
+
+    answers = asyncio.run(main())
+    assert (
+        answers[0]
+        == answers[1]
+        == "Here is a mock answer to: what is a healthy breakfast"
+    )
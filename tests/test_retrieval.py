@@ -0,0 +1,92 @@
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from retrieval import HashingEmbedding, Retriever, VectorIndex, ingest
+
+DOCUMENTS = [
+    ("sleep.md", "Adults need seven to nine hours of sleep every night."),
+    ("protein.md", "Protein after a workout helps muscles recover and grow."),
+    ("water.md", "Drink water through the day to stay hydrated."),
+]
+
+
+def _retriever(path: str, **kwargs) -> Retriever:
+    embed_model = HashingEmbedding()
+    index = VectorIndex.create(path, embed_model.dim, embed_model.model_name)
+    asyncio.run(ingest(DOCUMENTS, index, embed_model))
+    return Retriever(index, embed_model, top_k=1, **kwargs)
+
+
+def test_concurrent_queries_find_their_documents(tmp_path):
+    retriever = _retriever(str(tmp_path))
+
+    async def main() -> list[str]:
+        results = await asyncio.gather(
+            retriever.aretrieve("how many hours of sleep"),
+            retriever.aretrieve("muscles recover after a workout"),
+            retriever.aretrieve("stay hydrated"),
+        )
+        return [chunk.source for chunks in results for chunk in chunks]
+
+    assert asyncio.run(main()) == ["sleep.md", "protein.md", "water.md"]
+
+
+class _BlockingExecutor(ThreadPoolExecutor):
+    """Runs each search once `release` is set."""
+
+    def __init__(self):
+        super().__init__(max_workers=1)
+        self.release = threading.Event()
+
+    def submit(self, fn, /, *args, **kwargs):
+        def run():
+            self.release.wait(timeout=10)
+            return fn(*args, **kwargs)
+
+        return super().submit(run)
+
+
+def test_cancelled_search_does_not_block_later_queries(tmp_path):
+    executor = _BlockingExecutor()
+    retriever = _retriever(str(tmp_path), executor=executor)
+
+    async def main() -> list[str]:
+        query = asyncio.create_task(retriever.aretrieve("stay hydrated"))
+        await asyncio.sleep(0.05)
+        retriever._searching.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.wait_for(query, 5)
+        assert retriever._searching is None
+        executor.release.set()
+        chunks = await asyncio.wait_for(retriever.aretrieve("hours of sleep"), 5)
+        return [chunk.source for chunk in chunks]
+
+    assert asyncio.run(main()) == ["sleep.md"]
+
+
+def test_add_after_a_crashed_ingestion(tmp_path):
+    path = str(tmp_path)
+    index = VectorIndex.create(path, 4, "hashing")
+    records = [{"text": f"chunk {i}", "source": "a.md"} for i in range(3)]
+    vectors = np.eye(3, 4, dtype=np.float32)
+    index.add(vectors[:2], records[:2])
+    # a crash before index.json was written leaves a chunk past the committed count
+    for name, data in (
+        ("vectors.f32", vectors[2].tobytes()),
+        ("offsets.i64", np.int64(10**6).tobytes()),
+        ("records.bin", json.dumps({"text": "lost", "source": "b.md"}).encode()),
+    ):
+        with open(tmp_path / name, "ab") as f:
+            f.write(data)
+
+    index = VectorIndex.open(path)
+    index.add(vectors[2:], records[2:])
+
+    index = VectorIndex.open(path)
+    assert [index.record(i) for i in range(3)] == records
+    assert index.search(vectors[2])[0][0] == 2
@@ -0,0 +1,91 @@
+import asyncio
+
+from benchmarks.load_generator import auto_approve
+from benchmarks.mock_llm import MockFunctionCallingLLM
+from benchmarks.stub_server import UserInfoStub
+from main import get_agent_configs, get_health_coach_tools
+from routing import KeywordRouter, RoutingCache, RoutingPolicy
+from serving import SessionManager
+from session_state import get_session_state
+from workflow import UNKNOWN_AGENT_RESPONSE, SystemAgent
+
+
+def _chat(
+    llm: MockFunctionCallingLLM,
+    workflow: SystemAgent,
+    *turns: tuple[str, str],
+) -> list[str]:
+    """Runs `(session_id, user_msg)` turns and returns the active agent after each."""
+
+    async def main() -> list[str]:
+        with UserInfoStub(latency=0) as stub:
+            agent_configs = get_agent_configs()
+            agent_configs[0].tools = get_health_coach_tools(user_info_url=stub.url)
+            async with SessionManager(
+                workflow, agent_configs, llm, approval_handler=auto_approve
+            ) as manager:
+                active_agents = []
+                for session_id, user_msg in turns:
+                    await manager.chat(session_id, user_msg)
+                    ctx = manager._sessions[session_id].ctx
+                    state = await get_session_state(ctx)
+                    active_agents.append(state.active_speaker)
+                return active_agents
+
+    return asyncio.run(main())
+
+
+def test_unknown_agent_is_reprompted_then_answered_without_transfer():
+    llm = MockFunctionCallingLLM(routes={"bogus": "Nonexistent Agent"})
+    routing_cache = RoutingCache()
+    workflow = SystemAgent(timeout=None, routing_cache=routing_cache)
+
+    async def main() -> str | None:
+        async with SessionManager(
+            workflow, get_agent_configs(), llm, approval_handler=auto_approve
+        ) as manager:
+            return await manager.chat("session", "a bogus question")
+
+    assert asyncio.run(main()) == UNKNOWN_AGENT_RESPONSE
+    # the first pick and the re-prompt
+    assert llm.num_routing_calls == 2
+    assert len(routing_cache.exact) == 0
+
+
+def test_transfer_is_routed_by_the_llm_not_the_cache():
+    # a confident classifier that would send the message back to the Information Agent
+    router = KeywordRouter({"Information Agent": ["i want health coaching"]})
+    routing_cache = RoutingCache(classifier=router)
+    workflow = SystemAgent(timeout=None, routing_cache=routing_cache)
+
+    active_agents = _chat(
+        MockFunctionCallingLLM(),
+        workflow,
+        ("session", "Hello!"),
+        ("session", "I want health coaching"),
+    )
+
+    assert active_agents == ["Information Agent", "Health Coach Agent"]
+    assert routing_cache.classifier_hits == 0
+
+
+def test_only_opening_messages_are_cached():
+    routing_cache = RoutingCache()
+    workflow = SystemAgent(
+        timeout=None,
+        routing_cache=routing_cache,
+        routing_policy=RoutingPolicy(sticky=False),
+    )
+
+    _chat(
+        MockFunctionCallingLLM(),
+        workflow,
+        ("first", "Hello!"),
+        ("first", "yes"),
+        ("second", "Hello!"),
+        ("second", "yes"),
+    )
+
+    assert len(routing_cache.exact) == 1
+    stats = routing_cache.stats()
+    assert stats["exact_hits"] == 1
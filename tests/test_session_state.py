@@ -0,0 +1,55 @@
+import asyncio
+
+from llama_index.core.workflow import Context
+
+from prompts import update_user_state
+from session_state import get_session_state
+from workflow import SystemAgent
+
+
+def _slow_context(workflow: SystemAgent) -> Context:
+    """A context whose reads and writes yield to the event loop, like a busy lock."""
+    ctx = Context(workflow)
+    get, set_ = ctx.get, ctx.set
+
+    async def slow_get(*args, **kwargs):
+        await asyncio.sleep(0)
+        return await get(*args, **kwargs)
+
+    async def slow_set(*args, **kwargs):
+        await asyncio.sleep(0)
+        return await set_(*args, **kwargs)
+
+    ctx.get, ctx.set = slow_get, slow_set
+    return ctx
+
+
+def test_no_lost_updates_across_concurrent_sessions():
+    async def main() -> list[tuple[int, int]]:
+        workflow = SystemAgent(timeout=None)
+        contexts = [_slow_context(workflow) for _ in range(8)]
+
+        async def worker(ctx: Context, i: int) -> None:
+            # the first access of every worker races to create the session state
+            await update_user_state(ctx, **{f"field_{i}": i})
+            await asyncio.sleep(0)
+            await update_user_state(ctx, **{f"field_{i}": i + 1})
+
+        await asyncio.gather(*(worker(ctx, i) for ctx in contexts for i in range(32)))
+        results = []
+        for ctx in contexts:
+            user_state = (await get_session_state(ctx)).user_state
+            assert user_state == {f"field_{i}": i + 1 for i in range(32)}
+            results.append((len(user_state), user_state.version))
+        return results
+
+    assert asyncio.run(main()) == [(32, 64)] * 8
+
+
+def test_session_state_is_created_once():
+    async def main() -> bool:
+        ctx = _slow_context(SystemAgent(timeout=None))
+        states = await asyncio.gather(*(get_session_state(ctx) for _ in range(16)))
+        return all(state is states[0] for state in states)
+
+    assert asyncio.run(main())
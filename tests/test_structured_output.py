@@ -0,0 +1,54 @@
+import json
+
+import pytest
+from pydantic import BaseModel
+
+from structured_output import OutputSchema, repair_json
+
+
+@pytest.mark.parametrize(
+    ("text", "expected", "repairs"),
+    [
+        ('{"a": 1}', {"a": 1}, []),
+        ('Sure! Here it is: {"a": 1}', {"a": 1}, ["leading text"]),
+        ('```json\n{"a": 1}\n```', {"a": 1}, ["leading text", "trailing text"]),
+        ('{"a": [1, 2,], "b": 3,}', {"a": [1, 2], "b": 3}, ["trailing comma"] * 2),
+        ('{"a": "line one\nline two"}', {"a": "line one\nline two"}, []),
+        ('{"a": {"b": "unfinished', {"a": {"b": "unfinished"}}, ["truncated"]),
+        ('{"a": 1, "b":', {"a": 1, "b": None}, ["truncated"]),
+        ('{"a": 1, "unfinished ke', {"a": 1}, ["truncated"]),
+        ('{"a": [1, 2', {"a": [1, 2]}, ["truncated"]),
+    ],
+)
+def test_repair_json(text, expected, repairs):
+    candidate, found = repair_json(text)
+    assert json.loads(candidate) == expected
+    assert found == repairs
+
+
+@pytest.mark.parametrize("text", ["no object here", '{"a": [1, 2}'])
+def test_repair_json_gives_up(text):
+    assert repair_json(text)[0] is None
+
+
+class _Plan(BaseModel):
+    goal: str
+    days: int
+
+
+def test_output_schema_parse():
+    schema = OutputSchema(model=_Plan)
+
+    parsed = schema.parse('Your plan: {"goal": "run", "days": 3,}')
+    assert parsed.value == _Plan(goal="run", days=3)
+    assert parsed.repairs == ["leading text", "trailing comma"]
+    assert parsed.error is None
+
+    parsed = schema.parse('{"goal": "run"}')
+    assert parsed.value is None
+    assert parsed.error.startswith("days:")
+
+    # a question to the user passes unless an object is required
+    assert schema.parse("What is your goal?") is None
+    parsed = OutputSchema(model=_Plan, required=True).parse("What is your goal?")
+    assert parsed.error == "the answer has no well-formed JSON object"
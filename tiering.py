@@ -0,0 +1,176 @@
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Collection
+
+from llama_index.core.llms import LLM, ChatMessage, ChatResponse
+from llama_index.core.tools import BaseTool, ToolSelection
+from pydantic import BaseModel, ValidationError
+
+from llm_gateway import estimate_tokens
+
+
+class ModelPrice(BaseModel):
+    """USD per million prompt and completion tokens of a model."""
+
+    prompt: float
+    completion: float
+
+
+# list prices at the time of writing; pass your own to `ModelTiering(prices=...)`
+DEFAULT_PRICES = {
+    "gpt-4o": ModelPrice(prompt=2.5, completion=10.0),
+    "gpt-4o-mini": ModelPrice(prompt=0.15, completion=0.6),
+}
+
+
+def model_name(llm: LLM) -> str:
+    return getattr(llm, "model", None) or llm.metadata.model_name
+
+
+def invalid_tool_call(
+    tool_call: ToolSelection,
+    tools: list[BaseTool],
+    agent_names: Collection[str] | None = None,
+) -> str | None:
+    """Why `tool_call` cannot be run with `tools`, or None if it can."""
+    tool = next(
+        (t for t in tools if t.metadata.get_name() == tool_call.tool_name), None
+    )
+    if tool is None:
+        return f"unknown tool {tool_call.tool_name!r}"
+    fn_schema = tool.metadata.fn_schema
+    if fn_schema is not None:
+        try:
+            fn_schema.model_validate(tool_call.tool_kwargs)
+        except ValidationError as e:
+            return (
+                f"invalid arguments for {tool_call.tool_name}: {e.errors()[0]['msg']}"
+            )
+    if agent_names is not None:
+        agent_name = tool_call.tool_kwargs.get("agent_name")
+        if agent_name not in agent_names:
+            return f"unknown agent {agent_name!r}"
+    return None
+
+
+def invalid_response(
+    llm: LLM,
+    response: ChatResponse,
+    tools: list[BaseTool],
+    agent_names: Collection[str] | None = None,
+) -> str | None:
+    """Why the tool calls of `response` cannot be run, or None if they all can."""
+    try:
+        tool_calls = llm.get_tool_calls_from_response(
+            response, error_on_no_tool_call=False
+        )
+    except ValueError as e:
+        return f"unparsable tool calls: {e}"
+    for tool_call in tool_calls:
+        reason = invalid_tool_call(tool_call, tools, agent_names)
+        if reason is not None:
+            return reason
+    return None
+
+
+@dataclass
+class TierStats:
+    """The LLM calls made with one model."""
+
+    calls: int = 0
+    # calls whose response was dropped and re-sent to the run's LLM
+    escalations: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency: float = 0.0
+    latencies: deque = field(default_factory=lambda: deque(maxlen=1024))
+
+
+class ModelTiering:
+    """
+    Runs routing and simple agents on a smaller, faster model and keeps the full
+    model, the `llm` passed to the run, for the rest.
+
+    The orchestrator calls `router_llm` and the merge of a fan-out calls `merge_llm`;
+    agents call their `AgentConfig.llm`. Each falls back to the run's LLM when None.
+    With `escalate`, a response of another model than the run's whose tool calls
+    cannot be run (an unknown tool or agent, or arguments that don't match the
+    tool's schema) is dropped and the call is re-sent to the run's LLM.
+
+    Every LLM call of the workflow is accounted per model: calls, escalations,
+    latency, tokens and their cost at `prices`. Calls served by the gateway's
+    coalescing or response cache are counted for every session that made them.
+    """
+
+    def __init__(
+        self,
+        router_llm: LLM | None = None,
+        merge_llm: LLM | None = None,
+        escalate: bool = True,
+        prices: dict[str, ModelPrice] | None = None,
+    ):
+        self.router_llm = router_llm
+        self.merge_llm = merge_llm
+        self.escalate = escalate
+        self.prices = DEFAULT_PRICES if prices is None else prices
+        self._tiers: dict[str, TierStats] = {}
+
+    def _tier(self, llm: LLM) -> TierStats:
+        name = model_name(llm)
+        tier = self._tiers.get(name)
+        if tier is None:
+            tier = self._tiers[name] = TierStats()
+        return tier
+
+    def record(
+        self,
+        llm: LLM,
+        started_at: float,
+        messages: list[ChatMessage],
+        response: ChatResponse,
+    ) -> None:
+        """Accounts a call made with `llm`, estimating the tokens it did not report."""
+        tier = self._tier(llm)
+        latency = time.perf_counter() - started_at
+        usage = response.additional_kwargs
+        tier.calls += 1
+        tier.latency += latency
+        tier.latencies.append(latency)
+        tier.prompt_tokens += usage.get("prompt_tokens") or estimate_tokens(messages)
+        tier.completion_tokens += usage.get("completion_tokens") or estimate_tokens(
+            [response.message]
+        )
+
+    def record_escalation(self, llm: LLM) -> None:
+        self._tier(llm).escalations += 1
+
+    def cost(self, name: str) -> float:
+        """USD spent on the model called `name`, 0 if it has no price."""
+        tier, price = self._tiers.get(name), self.prices.get(name)
+        if tier is None or price is None:
+            return 0.0
+        return (
+            tier.prompt_tokens * price.prompt
+            + tier.completion_tokens * price.completion
+        ) / 1e6
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        """The accounting of every model called so far, by model name."""
+        stats = {}
+        for name, tier in self._tiers.items():
+            calls = tier.calls or 1
+            # of the recent calls
+            ordered = sorted(tier.latencies) or [0.0]
+            stats[name] = {
+                "calls": tier.calls,
+                "escalations": tier.escalations,
+                "escalation_rate": tier.escalations / calls,
+                "latency_mean": tier.latency / calls,
+                "latency_p50": ordered[len(ordered) // 2],
+                "latency_p90": ordered[int(0.9 * (len(ordered) - 1))],
+                "prompt_tokens": tier.prompt_tokens,
+                "completion_tokens": tier.completion_tokens,
+                "cost": self.cost(name),
+            }
+        return stats
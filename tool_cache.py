@@ -0,0 +1,83 @@
+import hashlib
+import json
+import uuid
+from typing import Any
+
+from llama_index.core.workflow import Context
+
+from cache import DiskCache, LRUCache
+from scheduler import ToolPolicy
+from session_state import get_session_state
+
+
+def _digest(value: Any) -> str:
+    """Hashes a JSON-like value independently of dict key order."""
+    canonical = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()[:32]
+
+
+class ToolCache:
+    """
+    Memoizes the results of tools whose `ToolPolicy` sets `cache_ttl`.
+
+    An entry is keyed on the tool name, its canonicalized kwargs, its scope (the
+    session for `cache_scope="session"`, every session for `"global"`) and the values
+    of the policy's `cache_state_keys` in `user_state`, so a result that depends on
+    the user's state is recomputed once that state changes. A tool that mutates data
+    other tools read lists them in its `invalidates`; `invalidate` can also be called
+    directly.
+
+    Only successful results are cached. The backend is an in-memory `LRUCache` by
+    default, or a `DiskCache` to keep results across restarts.
+    """
+
+    def __init__(self, backend: LRUCache | DiskCache | None = None):
+        self.backend = backend if backend is not None else LRUCache(max_size=4096)
+
+    @property
+    def hit_ratio(self) -> float:
+        return self.backend.hit_ratio
+
+    async def key(
+        self,
+        ctx: Context,
+        tool_name: str,
+        tool_kwargs: dict[str, Any],
+        policy: ToolPolicy,
+    ) -> str:
+        scope = ""
+        if policy.cache_scope == "session":
+            scope = await ctx.get("tool_cache_scope", default=None)
+            if scope is None:
+                scope = uuid.uuid4().hex
+                await ctx.set("tool_cache_scope", scope)
+
+        state = {}
+        if policy.cache_state_keys:
+            user_state = (await get_session_state(ctx)).user_state
+            state = {key: user_state.get(key) for key in policy.cache_state_keys}
+
+        return f"{tool_name}:{_digest(tool_kwargs)}:{scope}:{_digest(state)}"
+
+    def get(self, key: str) -> str | None:
+        return self.backend.get(key)
+
+    def set(self, key: str, content: str, policy: ToolPolicy) -> None:
+        self.backend.set(key, content, ttl=policy.cache_ttl)
+
+    def invalidate(
+        self, tool_name: str, tool_kwargs: dict[str, Any] | None = None
+    ) -> int:
+        """Drops the cached results of a tool, or only those for `tool_kwargs`."""
+        prefix = f"{tool_name}:"
+        if tool_kwargs is not None:
+            prefix += f"{_digest(tool_kwargs)}:"
+        return self.backend.invalidate_prefix(prefix)
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "hits": self.backend.hits,
+            "misses": self.backend.misses,
+            "hit_ratio": self.hit_ratio,
+            "size": len(self.backend),
+        }
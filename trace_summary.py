@@ -0,0 +1,42 @@
+import argparse
+import json
+
+from tracing import summarize
+
+
+def main() -> None:
+    """Prints latency percentiles per step, tool and LLM call from a JSONL trace."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("path", help="a trace written by tracing.JSONLExporter")
+    parser.add_argument("--kind", choices=["step", "tool", "llm"])
+    args = parser.parse_args()
+
+    with open(args.path, encoding="utf-8") as f:
+        spans = [json.loads(line) for line in f if line.strip()]
+    if args.kind:
+        spans = [span for span in spans if span["kind"] == args.kind]
+
+    print(
+        f"{'kind':<5} {'name':<24} {'count':>7} {'errors':>6} {'total s':>9} "
+        f"{'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'wait p99':>8} "
+        f"{'gets':>5} {'sets':>5} {'tokens in/out':>15}"
+    )
+    for row in summarize(spans):
+        queue_wait = row["queue_wait_p99"]
+        tokens = (
+            f"{row['prompt_tokens']}/{row['completion_tokens']}"
+            if row["kind"] == "llm"
+            else ""
+        )
+        print(
+            f"{row['kind']:<5} {row['name'][:24]:<24} {row['count']:>7} "
+            f"{row['errors']:>6} {row['total']:>9.2f} "
+            f"{row['p50'] * 1000:>8.1f} {row['p90'] * 1000:>8.1f} "
+            f"{row['p99'] * 1000:>8.1f} "
+            f"{'' if queue_wait is None else f'{queue_wait * 1000:.1f}':>8} "
+            f"{row['ctx_gets']:>5.1f} {row['ctx_sets']:>5.1f} {tokens:>15}"
+        )
+
+
+if __name__ == "__main__":
+    main()
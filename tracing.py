@@ -0,0 +1,360 @@
+import functools
+import json
+import random
+import time
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Protocol
+from weakref import WeakKeyDictionary
+
+from llama_index.core.workflow import Context, Event, StartEvent
+
+# set on events when they are sent, so the step receiving them can tell how long they
+# waited for a free worker; kept out of the event fields so it is never serialized
+_SENT_AT = "_trace_sent_at"
+# built once; `json.dumps` with arguments builds a new encoder per call
+_encoder = json.JSONEncoder(separators=(",", ":"), default=str)
+
+
+@dataclass(slots=True)
+class Span:
+    """A timed operation of a turn: a workflow step, a tool call or an LLM call."""
+
+    name: str
+    kind: str
+    trace_id: str
+    span_id: str
+    parent_id: str | None
+    start_time: float
+    duration: float = 0.0
+    error: str | None = None
+    # context reads and writes made while this was the innermost span
+    ctx_gets: int = 0
+    ctx_sets: int = 0
+    attributes: dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "duration": self.duration,
+            "error": self.error,
+            "ctx_gets": self.ctx_gets,
+            "ctx_sets": self.ctx_sets,
+            "attributes": self.attributes,
+        }
+
+
+_current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+def _new_id(bits: int) -> str:
+    # trace and span ids in the W3C/OpenTelemetry format
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+def current_span() -> Span | None:
+    return _current_span.get()
+
+
+def mark_sent(event: Event) -> Event:
+    """Stamps `event` with its send time, for the queue wait of the step receiving it."""
+    event.__dict__[_SENT_AT] = time.perf_counter()
+    return event
+
+
+# ---- exporters ----
+
+
+class SpanExporter(Protocol):
+    def export(self, spans: list[Span]) -> None: ...
+
+    def close(self) -> None: ...
+
+
+class InMemoryExporter:
+    """Keeps the last `max_spans` spans in memory, e.g. for tests and benchmarks."""
+
+    def __init__(self, max_spans: int = 100_000):
+        self.spans: deque[Span] = deque(maxlen=max_spans)
+
+    def export(self, spans: list[Span]) -> None:
+        self.spans.extend(spans)
+
+    def close(self) -> None:
+        pass
+
+
+class JSONLExporter:
+    """Appends spans to a file, one JSON object per line; see `trace_summary.py`."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+
+    def export(self, spans: list[Span]) -> None:
+        self._file.write(
+            "".join(_encoder.encode(span.to_dict()) + "\n" for span in spans)
+        )
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def _otlp_value(value: Any) -> dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OTLPJSONExporter:
+    """
+    Appends spans to a file in the OpenTelemetry OTLP/JSON format, one export request
+    per line, as read by the OpenTelemetry Collector's `otlpjsonfile` receiver.
+    """
+
+    def __init__(self, path: str, service_name: str = "multi-agent-concierge"):
+        self.path = path
+        self.service_name = service_name
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _otlp_span(self, span: Span) -> dict[str, Any]:
+        start = int(span.start_time * 1e9)
+        attributes = {
+            "span.kind": span.kind,
+            "ctx.gets": span.ctx_gets,
+            "ctx.sets": span.ctx_sets,
+            **span.attributes,
+        }
+        otlp_span = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            # SPAN_KIND_INTERNAL
+            "kind": 1,
+            "startTimeUnixNano": str(start),
+            "endTimeUnixNano": str(start + int(span.duration * 1e9)),
+            "attributes": [
+                {"key": key, "value": _otlp_value(value)}
+                for key, value in attributes.items()
+                if value is not None
+            ],
+            # STATUS_CODE_ERROR or STATUS_CODE_OK
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+        }
+        if span.parent_id is not None:
+            otlp_span["parentSpanId"] = span.parent_id
+        return otlp_span
+
+    def export(self, spans: list[Span]) -> None:
+        request = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {
+                                "key": "service.name",
+                                "value": {"stringValue": self.service_name},
+                            }
+                        ]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": "tracing"},
+                            "spans": [self._otlp_span(span) for span in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+        self._file.write(_encoder.encode(request) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+# ---- tracer ----
+
+
+class Tracer:
+    """
+    Records spans for the steps, tool calls and LLM calls of `SystemAgent` runs.
+
+    Each run is a trace. Step spans carry the time the triggering event waited for a
+    free step worker (`queue_wait`) and the context reads and writes of the step; LLM
+    spans carry the token usage. Finished spans are buffered and handed to the
+    exporter in batches of `batch_size`; call `flush` to export the rest.
+    """
+
+    def __init__(self, exporter: SpanExporter | None = None, batch_size: int = 256):
+        self.exporter = exporter or InMemoryExporter()
+        self.batch_size = batch_size
+        self._buffer: list[Span] = []
+        self._trace_ids: WeakKeyDictionary[Context, str] = WeakKeyDictionary()
+
+    def span(
+        self, name: str, kind: str, ctx: Context | None = None, **attributes: Any
+    ) -> "_SpanScope":
+        """Times the `with` block as a child span of the current span."""
+        parent = _current_span.get()
+        if ctx is not None:
+            trace_id = self._trace_ids.get(ctx) or self.start_trace(ctx)
+        elif parent is not None:
+            trace_id = parent.trace_id
+        else:
+            trace_id = _new_id(128)
+        return _SpanScope(
+            self,
+            Span(
+                name=name,
+                kind=kind,
+                trace_id=trace_id,
+                span_id=_new_id(64),
+                parent_id=parent.span_id if parent is not None else None,
+                start_time=time.time(),
+                attributes=attributes,
+            ),
+        )
+
+    def _finish(self, span: Span) -> None:
+        self._buffer.append(span)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def start_trace(self, ctx: Context) -> str:
+        """Starts a new trace for the run on `ctx` and counts its context reads and writes."""
+        if ctx not in self._trace_ids:
+            self._count_context_access(ctx)
+        trace_id = self._trace_ids[ctx] = _new_id(128)
+        return trace_id
+
+    @staticmethod
+    def _count_context_access(ctx: Context) -> None:
+        get, set_ = ctx.get, ctx.set
+
+        async def counted_get(key: str, default: Any = Ellipsis) -> Any:
+            span = _current_span.get()
+            if span is not None:
+                span.ctx_gets += 1
+            return await get(key, default=default)
+
+        async def counted_set(key: str, value: Any, make_private: bool = False) -> None:
+            span = _current_span.get()
+            if span is not None:
+                span.ctx_sets += 1
+            await set_(key, value, make_private=make_private)
+
+        ctx.get = counted_get
+        ctx.set = counted_set
+
+    def flush(self) -> None:
+        spans, self._buffer = self._buffer, []
+        if spans:
+            self.exporter.export(spans)
+
+    def close(self) -> None:
+        self.flush()
+        self.exporter.close()
+
+
+class _SpanScope:
+    """Makes a span the current one while the `with` block runs."""
+
+    __slots__ = ("_tracer", "_span", "_token", "_start")
+
+    def __init__(self, tracer: Tracer, span: Span):
+        self._tracer = tracer
+        self._span = span
+
+    def __enter__(self) -> Span:
+        self._token = _current_span.set(self._span)
+        self._start = time.perf_counter()
+        return self._span
+
+    def __exit__(
+        self, exc_type: type | None, exc: BaseException | None, tb: Any
+    ) -> None:
+        span = self._span
+        span.duration = time.perf_counter() - self._start
+        if exc_type is not None:
+            span.error = exc_type.__name__
+        _current_span.reset(self._token)
+        self._tracer._finish(span)
+
+
+def traced(func):
+    """
+    Records a span for every run of a `SystemAgent` step when the agent has a tracer.
+    Goes under `@step`.
+    """
+
+    @functools.wraps(func)
+    async def wrapper(self, ctx: Context, ev: Event) -> Any:
+        tracer: Tracer | None = self.tracer
+        if tracer is None:
+            return await func(self, ctx, ev)
+
+        if isinstance(ev, StartEvent):
+            tracer.start_trace(ctx)
+        sent_at = ev.__dict__.get(_SENT_AT)
+        queue_wait = time.perf_counter() - sent_at if sent_at is not None else None
+        with tracer.span(
+            func.__name__, "step", ctx, event=type(ev).__name__, queue_wait=queue_wait
+        ):
+            result = await func(self, ctx, ev)
+        if isinstance(result, Event):
+            mark_sent(result)
+        return result
+
+    return wrapper
+
+
+# ---- summaries ----
+
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, round(q / 100 * len(ordered)) - 1))]
+
+
+def summarize(spans: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Aggregates exported spans (as dicts) by kind and name, slowest first."""
+    groups: dict[tuple[str, str], list[dict[str, Any]]] = {}
+    for span in spans:
+        groups.setdefault((span["kind"], span["name"]), []).append(span)
+
+    rows = []
+    for (kind, name), group in groups.items():
+        durations = [span["duration"] for span in group]
+        queue_waits = [
+            span["attributes"]["queue_wait"]
+            for span in group
+            if span["attributes"].get("queue_wait") is not None
+        ]
+        row = {
+            "kind": kind,
+            "name": name,
+            "count": len(group),
+            "errors": sum(1 for span in group if span["error"]),
+            "total": sum(durations),
+            **{f"p{q}": _percentile(durations, q) for q in (50, 90, 99)},
+            "queue_wait_p99": _percentile(queue_waits, 99) if queue_waits else None,
+            "ctx_gets": sum(span["ctx_gets"] for span in group) / len(group),
+            "ctx_sets": sum(span["ctx_sets"] for span in group) / len(group),
+        }
+        for key in ("prompt_tokens", "completion_tokens"):
+            tokens = [span["attributes"].get(key) for span in group]
+            row[key] = sum(t for t in tokens if t is not None)
+        rows.append(row)
+    return sorted(rows, key=lambda row: row["total"], reverse=True)
@@ -1,7 +1,25 @@
-from inspect import signature
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from inspect import Parameter, Signature, signature
 from pydantic import BaseModel, create_model
 from pydantic.fields import FieldInfo
-from typing import Any, Awaitable, Optional, Callable, Type, List, Tuple, Union, cast
+from typing import (
+    Any,
+    Awaitable,
+    Collection,
+    Dict,
+    Hashable,
+    Mapping,
+    Optional,
+    Callable,
+    Type,
+    List,
+    Tuple,
+    Union,
+    cast,
+)
 
 from llama_index.core.tools import (
     FunctionTool,
@@ -12,22 +30,76 @@ from llama_index.core.workflow import (
     Context,
 )
 
+from http_client import AsyncHttpClient
+from prompts import CachedToolMetadata
+
 AsyncCallable = Callable[..., Awaitable[Any]]
 
 
+@dataclass(frozen=True)
+class InjectedParams:
+    """The parameters of a tool function filled in by the workflow rather than the LLM."""
+
+    context: Optional[str] = None
+    http: Optional[str] = None
+
+    @property
+    def names(self) -> Tuple[str, ...]:
+        return tuple(name for name in (self.context, self.http) if name is not None)
+
+
+def _is_annotated_as(annotation: Any, cls: type) -> bool:
+    if isinstance(annotation, str):
+        # postponed annotations, e.g. with `from __future__ import annotations`
+        return annotation.rsplit(".", 1)[-1] == cls.__name__
+    return isinstance(annotation, type) and issubclass(annotation, cls)
+
+
+def get_injected_params(fn_signature: Signature) -> InjectedParams:
+    """
+    Finds the injected parameters by position and type annotation.
+
+    The context is passed as the first positional argument, so it goes to the first
+    parameter, which must be annotated as `Context` if it is annotated at all. The
+    workflow's http client goes to the parameter annotated as `AsyncHttpClient`.
+    """
+    params = list(fn_signature.parameters.values())
+    context = None
+    if params:
+        first = params[0]
+        if first.annotation is not Parameter.empty and not _is_annotated_as(
+            first.annotation, Context
+        ):
+            raise ValueError(
+                f"The first parameter of a tool with context must be the context, "
+                f"got {first.name}: {first.annotation}"
+            )
+        context = first.name
+    http = next(
+        (
+            param.name
+            for param in params
+            if _is_annotated_as(param.annotation, AsyncHttpClient)
+        ),
+        None,
+    )
+    return InjectedParams(context=context, http=http)
+
+
 def create_schema_from_function(
     name: str,
     func: Union[Callable[..., Any], Callable[..., Awaitable[Any]]],
     additional_fields: Optional[
         List[Union[Tuple[str, Type, Any], Tuple[str, Type]]]
     ] = None,
+    skip_params: Collection[str] = (),
+    params: Optional[Mapping[str, Parameter]] = None,
 ) -> Type[BaseModel]:
-    """Create schema from function."""
+    """Create schema from function, without the `skip_params` (e.g. injected ones)."""
     fields = {}
-    params = signature(func).parameters
+    params = params if params is not None else signature(func).parameters
     for param_name in params:
-        # TODO: Very hacky way to remove the ctx parameter from the signature
-        if param_name == "ctx":
+        if param_name in skip_params:
             continue
 
         param_type = params[param_name].annotation
@@ -65,13 +137,214 @@ def create_schema_from_function(
     return create_model(name, **fields)  # type: ignore
 
 
+class PersistedToolMetadata(CachedToolMetadata):
+    """
+    Tool metadata restored from a persisted JSON schema. The pydantic `fn_schema` is
+    only built if something asks for it; LLM calls only need the JSON schema.
+    """
+
+    def __init__(
+        self,
+        parameters: dict,
+        build_fn_schema: Callable[[], Type[BaseModel]],
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(fn_schema=None, **kwargs)
+        self.__dict__["_parameters"] = parameters
+        self.__dict__["_build_fn_schema"] = build_fn_schema
+
+    @property
+    def fn_schema(self) -> Optional[Type[BaseModel]]:
+        build_fn_schema = self.__dict__.pop("_build_fn_schema", None)
+        if build_fn_schema is not None:
+            self.__dict__["_fn_schema"] = build_fn_schema()
+        return self.__dict__["_fn_schema"]
+
+    @fn_schema.setter
+    def fn_schema(self, fn_schema: Optional[Type[BaseModel]]) -> None:
+        self.__dict__["_fn_schema"] = fn_schema
+
+
+class ToolRegistry:
+    """
+    Builds the metadata of `FunctionToolWithContext`s once per tool function.
+
+    Metadata is cached by function identity: the code object, so the closures that
+    `get_*_tools()` re-create on every call share one entry, plus the defaults and
+    the name/description overrides. With `schema_path`, the generated JSON schemas
+    and descriptions are also persisted (see `save`), keyed on the function's
+    qualified name, parameters, annotations, defaults and docstring, so a cold
+    process builds its tools without `inspect.signature` or `create_model`.
+    """
+
+    def __init__(self, schema_path: Optional[str] = None) -> None:
+        self.schema_path = schema_path
+        self._metadata: Dict[Hashable, ToolMetadata] = {}
+        self._injected_params: Dict[Hashable, InjectedParams] = {}
+        self._schemas: Dict[str, dict] = {}
+        self._num_new_schemas = 0
+        if schema_path is not None and os.path.exists(schema_path):
+            with open(schema_path) as f:
+                self._schemas = json.load(f)
+
+    @staticmethod
+    def _fn_key(fn: Callable[..., Any]) -> Optional[Hashable]:
+        code = getattr(fn, "__code__", None)
+        if code is None:
+            return None
+        kwdefaults = tuple(sorted((fn.__kwdefaults__ or {}).items()))
+        key = (code, fn.__defaults__, kwdefaults)
+        try:
+            hash(key)
+        except TypeError:
+            # unhashable defaults, don't cache
+            return None
+        return key
+
+    def get_injected_params(self, fn: Callable[..., Any]) -> InjectedParams:
+        key = self._fn_key(fn)
+        injected = self._injected_params.get(key) if key is not None else None
+        if injected is None:
+            injected = get_injected_params(signature(fn))
+            if key is not None:
+                self._injected_params[key] = injected
+        return injected
+
+    def get_metadata(
+        self,
+        fn: Callable[..., Any],
+        name: Optional[str] = None,
+        description: Optional[str] = None,
+        return_direct: bool = False,
+        fn_schema: Optional[Type[BaseModel]] = None,
+    ) -> ToolMetadata:
+        fn_key = self._fn_key(fn)
+        key = (
+            (fn_key, name, description, return_direct, fn_schema)
+            if fn_key is not None
+            else None
+        )
+        metadata = self._metadata.get(key) if key is not None else None
+        if metadata is None:
+            metadata, injected = self._build_metadata(
+                fn, name, description, return_direct, fn_schema
+            )
+            if key is not None:
+                self._metadata[key] = metadata
+                self._injected_params[fn_key] = injected
+        return metadata
+
+    @staticmethod
+    def _schema_key(
+        fn: Callable[..., Any], name: str, description: Optional[str]
+    ) -> Optional[str]:
+        """Identifies everything the schema and description derive from, without `signature`."""
+        code = getattr(fn, "__code__", None)
+        if code is None:
+            return None
+        num_params = code.co_argcount + code.co_kwonlyargcount
+        parts = (
+            f"{fn.__module__}.{fn.__qualname__}",
+            name,
+            description or "",
+            repr(code.co_varnames[:num_params]),
+            repr(fn.__annotations__),
+            repr(fn.__defaults__),
+            repr(fn.__kwdefaults__),
+            fn.__doc__ or "",
+        )
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+    def _build_metadata(
+        self,
+        fn: Callable[..., Any],
+        name: Optional[str],
+        description: Optional[str],
+        return_direct: bool,
+        fn_schema: Optional[Type[BaseModel]],
+    ) -> Tuple[ToolMetadata, InjectedParams]:
+        name = name or fn.__name__
+        schema_key = None
+        if self.schema_path is not None and fn_schema is None:
+            schema_key = self._schema_key(fn, name, description)
+
+        entry = self._schemas.get(schema_key) if schema_key is not None else None
+        if entry is not None:
+            injected = InjectedParams(context=entry["context"], http=entry["http"])
+            metadata = PersistedToolMetadata(
+                parameters=entry["parameters"],
+                build_fn_schema=lambda: create_schema_from_function(
+                    name, fn, skip_params=injected.names
+                ),
+                name=name,
+                description=entry["description"],
+                return_direct=return_direct,
+            )
+            return metadata, injected
+
+        fn_signature = signature(fn)
+        injected = get_injected_params(fn_signature)
+        if description is None:
+            visible_signature = fn_signature.replace(
+                parameters=[
+                    param
+                    for param in fn_signature.parameters.values()
+                    if param.name not in injected.names
+                ]
+            )
+            description = f"{name}{visible_signature}\n{fn.__doc__}"
+        if fn_schema is None:
+            fn_schema = create_schema_from_function(
+                name, fn, skip_params=injected.names, params=fn_signature.parameters
+            )
+        metadata = CachedToolMetadata(
+            name=name,
+            description=description,
+            fn_schema=fn_schema,
+            return_direct=return_direct,
+        )
+
+        if schema_key is not None:
+            self._schemas[schema_key] = {
+                "description": description,
+                "parameters": metadata.get_parameters_dict(),
+                "context": injected.context,
+                "http": injected.http,
+            }
+            self._num_new_schemas += 1
+        return metadata, injected
+
+    def save(self) -> None:
+        """Writes the JSON schemas generated since the last save to `schema_path`."""
+        if self.schema_path is None or not self._num_new_schemas:
+            return
+        tmp_path = f"{self.schema_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._schemas, f)
+        os.replace(tmp_path, self.schema_path)
+        self._num_new_schemas = 0
+
+
 class FunctionToolWithContext(FunctionTool):
     """
     A function tool that also includes passing in workflow context.
 
-    Only overrides the call methods to include the context.
+    Only overrides the call methods to include the context. If the function has a
+    parameter annotated as `AsyncHttpClient`, the workflow's shared client is passed
+    in as well. Metadata is built through a `ToolRegistry`, once per tool function.
     """
 
+    def __init__(
+        self,
+        fn: Optional[Callable[..., Any]] = None,
+        metadata: Optional[ToolMetadata] = None,
+        async_fn: Optional[AsyncCallable] = None,
+        registry: Optional[ToolRegistry] = None,
+    ) -> None:
+        super().__init__(fn=fn, metadata=metadata, async_fn=async_fn)
+        registry = registry or default_tool_registry
+        self._http_param = registry.get_injected_params(fn or async_fn).http
+
     @classmethod
     def from_defaults(
         cls,
@@ -82,34 +355,41 @@ class FunctionToolWithContext(FunctionTool):
         fn_schema: Optional[Type[BaseModel]] = None,
         async_fn: Optional[AsyncCallable] = None,
         tool_metadata: Optional[ToolMetadata] = None,
+        registry: Optional[ToolRegistry] = None,
     ) -> "FunctionTool":
+        registry = registry or default_tool_registry
         if tool_metadata is None:
             fn_to_parse = fn or async_fn
             assert fn_to_parse is not None, "fn or async_fn must be provided."
-            name = name or fn_to_parse.__name__
-            docstring = fn_to_parse.__doc__
-
-            # TODO: Very hacky way to remove the ctx parameter from the signature
-            signature_str = str(signature(fn_to_parse))
-            signature_str = signature_str.replace(
-                "ctx: llama_index.core.workflow.context.Context, ", ""
-            )
-            description = description or f"{name}{signature_str}\n{docstring}"
-            if fn_schema is None:
-                fn_schema = create_schema_from_function(
-                    f"{name}", fn_to_parse, additional_fields=None
-                )
-            tool_metadata = ToolMetadata(
+            tool_metadata = registry.get_metadata(
+                fn_to_parse,
                 name=name,
                 description=description,
-                fn_schema=fn_schema,
                 return_direct=return_direct,
+                fn_schema=fn_schema,
+            )
+        return cls(fn=fn, metadata=tool_metadata, async_fn=async_fn, registry=registry)
+
+    def _with_injected(
+        self, kwargs: dict[str, Any], http: Optional[AsyncHttpClient]
+    ) -> dict[str, Any]:
+        if self._http_param is None:
+            return kwargs
+        if http is None:
+            raise ValueError(
+                f"Tool {self.metadata.name} requires an http client, but none was provided."
             )
-        return cls(fn=fn, metadata=tool_metadata, async_fn=async_fn)
+        return {**kwargs, self._http_param: http}
 
-    def call(self, ctx: Context, *args: Any, **kwargs: Any) -> ToolOutput:
+    def call(
+        self,
+        ctx: Context,
+        *args: Any,
+        http: Optional[AsyncHttpClient] = None,
+        **kwargs: Any,
+    ) -> ToolOutput:
         """Call."""
-        tool_output = self._fn(ctx, *args, **kwargs)
+        tool_output = self._fn(ctx, *args, **self._with_injected(kwargs, http))
         return ToolOutput(
             content=str(tool_output),
             tool_name=self.metadata.name,
@@ -117,12 +397,24 @@ class FunctionToolWithContext(FunctionTool):
             raw_output=tool_output,
         )
 
-    async def acall(self, ctx: Context, *args: Any, **kwargs: Any) -> ToolOutput:
+    async def acall(
+        self,
+        ctx: Context,
+        *args: Any,
+        http: Optional[AsyncHttpClient] = None,
+        **kwargs: Any,
+    ) -> ToolOutput:
         """Call."""
-        tool_output = await self._async_fn(ctx, *args, **kwargs)
+        tool_output = await self._async_fn(
+            ctx, *args, **self._with_injected(kwargs, http)
+        )
         return ToolOutput(
             content=str(tool_output),
             tool_name=self.metadata.name,
             raw_input={"args": args, "kwargs": kwargs},
             raw_output=tool_output,
         )
+
+
+# used by `FunctionToolWithContext.from_defaults` unless another registry is passed
+default_tool_registry = ToolRegistry()
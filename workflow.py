@@ -1,7 +1,12 @@
-from typing import Any
-from pydantic import BaseModel, ConfigDict, Field
-
-from llama_index.core.llms import ChatMessage, LLM
+import asyncio
+import contextlib
+import time
+import uuid
+from functools import partial
+from typing import Any, Callable
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr
+
+from llama_index.core.llms import ChatMessage, ChatResponse, LLM
 from llama_index.core.program.function_program import get_function_tool
 from llama_index.core.tools import (
     BaseTool,
@@ -16,9 +21,36 @@ from llama_index.core.workflow import (
     Context,
 )
 from llama_index.core.workflow.events import InputRequiredEvent, HumanResponseEvent
-from llama_index.llms.openai import OpenAI
 
-from utils import FunctionToolWithContext
+from approvals import APPROVAL_CANCELLED_REASON, ApprovalBroker, PendingApproval
+from cache import LRUCache
+from checkpoint import SQLiteCheckpointer
+from conversation import ConversationStore
+from fanout import (
+    FAN_OUT_APPROVAL_REASON,
+    BranchResult,
+    FanOutPolicy,
+    concat_branches,
+    merge_input,
+)
+from history import HistoryManager
+from http_client import AsyncHttpClient
+from llm_gateway import LLMGateway
+from prompts import (
+    CompiledOrchestratorPrompt,
+    compile_tools,
+    get_user_state_prompt,
+    render_user_state,
+    set_user_state,
+)
+from routing import RoutingCache, RoutingPolicy
+from scheduler import ToolPolicy, ToolScheduler
+from session_state import get_session_state
+from speculation import Speculator
+from structured_output import OutputSchema
+from tiering import ModelTiering, invalid_response, model_name
+from tool_cache import ToolCache
+from tracing import Tracer, current_span, mark_sent, traced
 
 
 # ---- Pydantic models for config/llm prediction ----
@@ -34,6 +66,31 @@ class AgentConfig(BaseModel):
     system_prompt: str | None = None
     tools: list[BaseTool] | None = None
     tools_requiring_human_confirmation: list[str] = Field(default_factory=list)
+    max_history_tokens: int | None = None
+    tool_policies: dict[str, ToolPolicy] = Field(default_factory=dict)
+    # the agent's model, e.g. a smaller one for simple agents; the run's LLM if None
+    llm: LLM | None = None
+    # validates and repairs the agent's final answers
+    output_schema: OutputSchema | None = None
+
+    _static_system_prompt: str | None = PrivateAttr(default=None)
+
+    def compile(self) -> "AgentConfig":
+        """Precomputes the parts of the agent's LLM input that don't change between turns."""
+        if self._static_system_prompt is None:
+            self._static_system_prompt = (self.system_prompt or "").strip()
+            compile_tools(self.tools or [])
+        return self
+
+    @property
+    def static_system_prompt(self) -> str:
+        return self.compile()._static_system_prompt
+
+    def requires_approval(self, tool_name: str) -> bool:
+        policy = self.tool_policies.get(tool_name)
+        return tool_name in self.tools_requiring_human_confirmation and not (
+            policy is not None and policy.auto_approve
+        )
 
 
 class TransferToAgent(BaseModel):
@@ -62,30 +119,58 @@ class OrchestratorEvent(Event):
 class ToolCallEvent(Event):
     tool_call: ToolSelection
     tools: list[BaseTool]
+    batch_id: str
+    policy: ToolPolicy | None = None
 
 
 class ToolCallResultEvent(Event):
     chat_message: ChatMessage
+    batch_id: str
 
 
 class ToolRequestEvent(InputRequiredEvent):
     tool_name: str
     tool_id: str
     tool_kwargs: dict
+    batch_id: str
+    # set when the request is parked in the `ApprovalBroker`
+    approval_id: str | None = None
 
 
 class ToolApprovedEvent(HumanResponseEvent):
     tool_name: str
     tool_id: str
     tool_kwargs: dict
+    batch_id: str
     approved: bool
     response: str | None = None
 
 
+class ResumeApprovalsEvent(Event):
+    approvals: list[PendingApproval]
+
+
+class FanOutEvent(Event):
+    agent_names: list[str]
+    user_msg: str | None = None
+
+
 class ProgressEvent(Event):
     msg: str
 
 
+class AgentStreamEvent(Event):
+    delta: str
+    agent_name: str
+
+
+class PromptTokensEvent(Event):
+    agent_name: str
+    prompt_tokens: int
+    history_tokens: int
+    num_dropped: int
+
+
 # ---- Workflow ----
 
 DEFAULT_ORCHESTRATOR_PROMPT = (
@@ -97,6 +182,17 @@ DEFAULT_ORCHESTRATOR_PROMPT = (
     "Please assist the user and transfer them as needed."
 )
 DEFAULT_TOOL_REJECT_STR = "The tool call was not approved, likely due to a mistake or preconditions not being met."
+UNKNOWN_AGENT_PROMPT = (
+    "There is no agent named {agent_name!r}. Transfer to one of: {agent_names}."
+)
+UNKNOWN_AGENT_RESPONSE = (
+    "I'm not sure which of my agents can help with that. Could you rephrase it?"
+)
+DEFAULT_TRANSFER_PROMPT = (
+    "You are the {agent_name}. If the user asks for something you don't have the tools "
+    "or instructions for, or you have finished your task, call RequestTransfer so "
+    "another agent can take over."
+)
 
 
 class SystemAgent(Workflow):
@@ -104,121 +200,815 @@ class SystemAgent(Workflow):
         self,
         orchestrator_prompt: str | None = None,
         default_tool_reject_str: str | None = None,
+        http_client: AsyncHttpClient | None = None,
+        max_concurrent_llm_calls: int | None = None,
+        routing_cache: RoutingCache | None = None,
+        stream: bool = False,
+        history_manager: HistoryManager | None = None,
+        tool_scheduler: ToolScheduler | None = None,
+        tool_cache: ToolCache | None = None,
+        checkpointer: SQLiteCheckpointer | None = None,
+        approval_broker: ApprovalBroker | None = None,
+        llm_gateway: LLMGateway | None = None,
+        tracer: Tracer | None = None,
+        speculator: Speculator | None = None,
+        routing_policy: RoutingPolicy | None = None,
+        transfer_prompt: str | None = None,
+        fan_out: FanOutPolicy | None = None,
+        tiering: ModelTiering | None = None,
         **kwargs: Any,
     ):
         super().__init__(**kwargs)
         self.orchestrator_prompt = orchestrator_prompt or DEFAULT_ORCHESTRATOR_PROMPT
+        # lets the orchestrator hand a turn to several agents running concurrently
+        self.fan_out = fan_out
+        self._fan_out_slots = None
+        if fan_out is not None:
+            self.orchestrator_prompt += "\n" + fan_out.orchestrator_prompt
+            if fan_out.max_concurrent_branches is not None:
+                self._fan_out_slots = asyncio.Semaphore(
+                    fan_out.max_concurrent_branches
+                )
         self.default_tool_reject_str = (
             default_tool_reject_str or DEFAULT_TOOL_REJECT_STR
         )
+        # shared by every tool call of every session run on this workflow
+        self.http_client = http_client or AsyncHttpClient()
+        # every LLM call of every session run on this workflow goes through the gateway,
+        # which applies the rate limits, retries and hedging
+        self.llm_gateway = llm_gateway or LLMGateway(
+            max_concurrency=max_concurrent_llm_calls
+        )
+        # routes repeated opening messages without an orchestrator LLM call
+        self.routing_cache = routing_cache
+        # keeps follow-up turns with the active agent until it requests a transfer
+        self.routing_policy = routing_policy or RoutingPolicy()
+        self.transfer_prompt = transfer_prompt or DEFAULT_TRANSFER_PROMPT
+        # stream LLM tokens as `AgentStreamEvent`s and start tool calls while streaming
+        self.stream = stream
+        # applies per-tool concurrency limits, timeouts and worker pools
+        self.tool_scheduler = tool_scheduler or ToolScheduler()
+        # memoizes the results of tools whose policy sets `cache_ttl`
+        self.tool_cache = tool_cache or ToolCache()
+        # tool calls started by `speak_with_sub_agent`, awaited by `handle_tool_call`; keyed
+        # by context too, as sessions sharing a coalesced LLM response share tool ids
+        self._running_tool_calls: dict[tuple[int, str], asyncio.Task] = {}
+        # keeps the history sent to the LLM within each agent's token budget
+        self.history_manager = history_manager
+        if history_manager is not None and history_manager.llm_gateway is None:
+            history_manager.llm_gateway = self.llm_gateway
+        # the orchestrator prompt and tool are built once per set of agent configs
+        self._orchestrator_prompts = LRUCache(max_size=64)
+        self._transfer_tool = compile_tools([get_function_tool(TransferToAgent)])[0]
+        self._request_transfer_tool = compile_tools(
+            [get_function_tool(RequestTransfer)]
+        )[0]
+        self._default_llm: LLM | None = None
+        # persists sessions run with a `session_id` after every step that changes them
+        self.checkpointer = checkpointer
+        # parks the tool calls of sessions run with a `session_id` that need approval,
+        # ending the turn until `approvals` are passed to a later run
+        self.approval_broker = approval_broker
+        # records spans of the steps, tool calls and LLM calls of every run
+        self.tracer = tracer
+        # starts the likely sub-agent's LLM call while the orchestrator decides
+        self.speculator = speculator
+        # routes on a smaller model, escalates its invalid tool calls and accounts
+        # every LLM call per model
+        self.tiering = tiering
+
+    async def aclose(self) -> None:
+        """Releases the resources owned by the workflow."""
+        await self.http_client.aclose()
+        self.tool_scheduler.shutdown()
+        if self.tracer is not None:
+            self.tracer.flush()
+
+    def _get_default_llm(self) -> LLM:
+        """Builds the LLM used when `run` is not given one, on first use."""
+        if self._default_llm is None:
+            # the OpenAI integration is slow to import, only load it when needed
+            from llama_index.llms.openai import OpenAI
+
+            # retries are left to the gateway
+            self._default_llm = OpenAI(model="gpt-4o", temperature=0.1, max_retries=0)
+        return self._default_llm
+
+    async def get_conversation(self, ctx: Context) -> ConversationStore:
+        """Returns the conversation of the session run with `ctx`."""
+        return (await get_session_state(ctx)).conversation or ConversationStore()
+
+    async def _build_llm_input(
+        self,
+        ctx: Context,
+        system_prompt: str,
+        chat_history: list[ChatMessage],
+        llm: LLM,
+        agent_name: str,
+        token_budget: int | None = None,
+        state_prompt: str | None = None,
+    ) -> list[ChatMessage]:
+        """
+        Wraps the history in the system prompt and the state prompt, trimmed to the token
+        budget if a history manager is set.
+
+        The static system prompt goes first and the per-turn state last, so the prompt
+        prefix stays stable for provider-side prompt caching.
+        """
+        if self.history_manager is None:
+            llm_input = [ChatMessage(role="system", content=system_prompt)] + chat_history
+            if state_prompt:
+                llm_input.append(ChatMessage(role="system", content=state_prompt))
+            return llm_input
+
+        window = await self.history_manager.window(
+            ctx,
+            system_prompt,
+            chat_history,
+            llm,
+            token_budget=token_budget,
+            state_prompt=state_prompt,
+        )
+        ctx.write_event_to_stream(
+            PromptTokensEvent(
+                agent_name=agent_name,
+                prompt_tokens=window.prompt_tokens,
+                history_tokens=window.history_tokens,
+                num_dropped=window.num_dropped,
+            )
+        )
+        return window.messages
+
+    async def _checkpoint(self, ctx: Context, turn_complete: bool = False) -> None:
+        if self.checkpointer is None:
+            return
+        session_id = (await get_session_state(ctx)).session_id
+        if session_id is not None:
+            await self.checkpointer.save(ctx, session_id, turn_complete=turn_complete)
+
+    def _get_orchestrator_prompt(
+        self, agent_configs: dict[str, AgentConfig]
+    ) -> CompiledOrchestratorPrompt:
+        key = tuple(id(agent_config) for agent_config in agent_configs.values())
+        compiled = self._orchestrator_prompts.get(key)
+        if compiled is None:
+            compiled = CompiledOrchestratorPrompt.compile(
+                self.orchestrator_prompt, agent_configs
+            )
+            self._orchestrator_prompts.set(key, compiled)
+        return compiled
+
+    async def _achat_with_tools(
+        self,
+        ctx: Context,
+        llm: LLM,
+        tools: list[BaseTool],
+        chat_history: list[ChatMessage],
+        agent_name: str,
+        on_tool_call: Callable[[ToolSelection], None] | None = None,
+        speculative: bool = False,
+        streamed: bool = True,
+        allow_parallel_tool_calls: bool = False,
+    ) -> ChatResponse:
+        """Calls the LLM through the gateway, queued fairly with the other sessions."""
+        session = (await get_session_state(ctx)).session_id or id(ctx)
+        # a speculative response is not streamed, the agent may not get to speak
+        stream = self.stream and streamed and not speculative
+        llm_kwargs = (
+            {"allow_parallel_tool_calls": True} if allow_parallel_tool_calls else {}
+        )
+        if self.tracer is None:
+            return await self._request_llm(
+                ctx,
+                llm,
+                tools,
+                chat_history,
+                agent_name,
+                on_tool_call,
+                session,
+                stream,
+                llm_kwargs,
+            )
+        with self.tracer.span(
+            "llm",
+            "llm",
+            agent=agent_name,
+            model=getattr(llm, "model", None),
+            speculative=speculative or None,
+        ) as span:
+            response = await self._request_llm(
+                ctx,
+                llm,
+                tools,
+                chat_history,
+                agent_name,
+                on_tool_call,
+                session,
+                stream,
+                llm_kwargs,
+            )
+            for key in ("prompt_tokens", "completion_tokens"):
+                span.attributes[key] = response.additional_kwargs.get(key)
+        return response
+
+    async def _request_llm(
+        self,
+        ctx: Context,
+        llm: LLM,
+        tools: list[BaseTool],
+        chat_history: list[ChatMessage],
+        agent_name: str,
+        on_tool_call: Callable[[ToolSelection], None] | None,
+        session: Any,
+        stream: bool,
+        llm_kwargs: dict[str, Any],
+    ) -> ChatResponse:
+        started_at = time.perf_counter()
+        if not stream:
+            response = await self.llm_gateway.achat_with_tools(
+                llm,
+                tools,
+                chat_history,
+                agent_name=agent_name,
+                session=session,
+                **llm_kwargs,
+            )
+        else:
+            response = await self._astream_chat_with_tools(
+                ctx,
+                llm,
+                tools,
+                chat_history,
+                agent_name,
+                on_tool_call,
+                session,
+                llm_kwargs,
+            )
+        if self.tiering is not None:
+            self.tiering.record(llm, started_at, chat_history, response)
+        return response
+
+    def _escalates(self, llm: LLM, run_llm: LLM) -> bool:
+        """Whether invalid tool calls of `llm` are re-sent to the run's LLM."""
+        return self.tiering is not None and self.tiering.escalate and llm is not run_llm
+
+    async def _escalate(
+        self,
+        ctx: Context,
+        llm: LLM,
+        reason: str,
+        tools: list[BaseTool],
+        llm_input: list[ChatMessage],
+        agent_name: str,
+        **kwargs: Any,
+    ) -> tuple[LLM, ChatResponse]:
+        """Re-sends a call answered by a smaller model with invalid tool calls to the
+        run's LLM."""
+        run_llm = (await get_session_state(ctx)).llm
+        self.tiering.record_escalation(llm)
+        ctx.write_event_to_stream(
+            ProgressEvent(
+                msg=f"Escalating {agent_name} from {model_name(llm)} to "
+                f"{model_name(run_llm)}: {reason}"
+            )
+        )
+        response = await self._achat_with_tools(
+            ctx, run_llm, tools, llm_input, agent_name=agent_name, **kwargs
+        )
+        return run_llm, response
+
+    async def _astream_chat_with_tools(
+        self,
+        ctx: Context,
+        llm: LLM,
+        tools: list[BaseTool],
+        chat_history: list[ChatMessage],
+        agent_name: str,
+        on_tool_call: Callable[[ToolSelection], None] | None,
+        session: Any,
+        llm_kwargs: dict[str, Any],
+    ) -> ChatResponse:
+        """Streams the response as `AgentStreamEvent`s and reports each tool call to
+        `on_tool_call` as soon as its arguments are complete."""
+        response = None
+        num_reported = 0
+        async for response in self.llm_gateway.astream_chat_with_tools(
+            llm,
+            tools,
+            chat_history,
+            agent_name=agent_name,
+            session=session,
+            **llm_kwargs,
+        ):
+            if response.delta:
+                ctx.write_event_to_stream(
+                    AgentStreamEvent(delta=response.delta, agent_name=agent_name)
+                )
+            if on_tool_call is None:
+                continue
+
+            # a tool call is complete once the next one starts streaming
+            tool_calls = llm.get_tool_calls_from_response(
+                response, error_on_no_tool_call=False
+            )
+            for tool_call in tool_calls[num_reported : len(tool_calls) - 1]:
+                on_tool_call(tool_call)
+            num_reported = max(num_reported, len(tool_calls) - 1)
+
+        if response is None:
+            raise ValueError(f"LLM returned an empty stream for {agent_name}!")
+
+        if on_tool_call is not None:
+            tool_calls = llm.get_tool_calls_from_response(
+                response, error_on_no_tool_call=False
+            )
+            for tool_call in tool_calls[num_reported:]:
+                on_tool_call(tool_call)
+
+        return response
 
     @step
+    @traced
     async def setup(
         self, ctx: Context, ev: StartEvent
-    ) -> OrchestratorEvent:
+    ) -> OrchestratorEvent | ResumeApprovalsEvent:
         """Sets up the workflow, validates inputs, and stores them in the context."""
-        active_speaker = await ctx.get("active_speaker", default="")
+        state = await get_session_state(ctx)
+        session_id = ev.get("session_id", default=None)
+        restored = False
+        if session_id is not None:
+            # a new context for a checkpointed session resumes where the session left off
+            if self.checkpointer is not None and state.session_id is None:
+                restored = await self.checkpointer.restore(ctx, session_id)
+            state.session_id = session_id
+
+        active_speaker = state.active_speaker
         user_msg = ev.get("user_msg")
+        approvals: list[PendingApproval] | None = ev.get("approvals", default=None)
         agent_configs = ev.get("agent_configs", default=[])
-        llm: LLM = ev.get("llm", default=OpenAI(model="gpt-4o", temperature=0.1))
-        chat_history = ev.get("chat_history", default=[])
-        initial_state = ev.get("initial_state", default={})
-        if (
-            user_msg is None
-            or agent_configs is None
-            or llm is None
-            or chat_history is None
-        ):
+        llm: LLM = ev.get("llm", default=None) or self._get_default_llm()
+        chat_history = ev.get("chat_history", default=None)
+        initial_state = ev.get("initial_state", default=None)
+        if (not user_msg and not approvals) or agent_configs is None or llm is None:
             raise ValueError(
-                "User message, agent configs, llm, and chat_history are required!"
+                "User message (or approvals to resume), agent configs, and llm are required!"
             )
 
         if not llm.metadata.is_function_calling_model:
             raise ValueError("LLM must be a function calling model!")
 
-        # store the agent configs in the context
-        agent_configs_dict = {ac.name: ac for ac in agent_configs}
-        await ctx.set("agent_configs", agent_configs_dict)
-        await ctx.set("llm", llm)
-
-        chat_history.append(ChatMessage(role="user", content=user_msg))
-        await ctx.set("chat_history", chat_history)
-
-        await ctx.set("user_state", initial_state)
-
-        # if there is an active speaker, we need to transfer forward the user to them
-        # if active_speaker:
-        #     return ActiveAgentEvent()
+        # store the agent configs in the session state
+        agent_configs_dict = {ac.name: ac.compile() for ac in agent_configs}
+        state.agent_configs = agent_configs_dict
+        state.llm = llm
+
+        # resume the session's conversation unless the caller passes a history explicitly
+        conversation = state.conversation
+        if approvals:
+            if conversation is None:
+                raise ValueError(
+                    "Cannot resume approvals, the session's conversation is not in the "
+                    "context nor in a checkpoint!"
+                )
+            return ResumeApprovalsEvent(approvals=approvals)
+
+        if chat_history is not None or conversation is None:
+            conversation = ConversationStore(chat_history)
+            state.conversation = conversation
+        # the LLM expects an answer to every tool call before the next user message
+        if self.approval_broker is not None and session_id is not None:
+            for approval in self.approval_broker.cancel_session(session_id):
+                conversation.append(await self._settle_approval(ctx, approval))
+        conversation.begin_turn(ChatMessage(role="user", content=user_msg))
+
+        if not restored and initial_state is not None:
+            await set_user_state(ctx, initial_state)
+
+        # follow-up turns go straight to the active agent unless the policy says otherwise
+        state.turn_transfers = 0
+        agent_turns = state.agent_turns
+        agent_name = self.routing_policy.next_agent(
+            user_msg, active_speaker, agent_turns, agent_configs_dict
+        )
+        if agent_name is not None:
+            state.set_active_speaker(
+                agent_name, agent_turns + 1 if agent_name == active_speaker else 1
+            )
+        await self._checkpoint(ctx)
+        if agent_name is not None:
+            return ActiveAgentEvent()
 
         # otherwise, we need to decide who the next active speaker is
         return OrchestratorEvent(user_msg=user_msg)
 
     @step
+    @traced
     async def speak_with_sub_agent(
         self, ctx: Context, ev: ActiveAgentEvent
-    ) -> ToolCallEvent | ToolRequestEvent | StopEvent:
+    ) -> ToolCallEvent | ToolRequestEvent | OrchestratorEvent | StopEvent:
         """Speaks with the active sub-agent and handles tool calls (if any)."""
         # Setup the agent for the active speaker
-        active_speaker = await ctx.get("active_speaker")
-
-        agent_config: AgentConfig = (await ctx.get("agent_configs"))[active_speaker]
-        chat_history = await ctx.get("chat_history")
-        llm = await ctx.get("llm")
-
-        user_state = await ctx.get("user_state")
-        user_state_str = "\n".join([f"{k}: {v}" for k, v in user_state.items()])
-        system_prompt = (
-            agent_config.system_prompt.strip()
-            + f"\n\nHere is the current user state:\n{user_state_str}"
-        )
+        state = await get_session_state(ctx)
+        active_speaker = state.active_speaker
 
-        llm_input = [ChatMessage(role="system", content=system_prompt)] + chat_history
+        agent_config = state.agent_config()
+        chat_history = state.chat_history
+        llm = agent_config.llm or state.llm
+        escalates = self._escalates(llm, state.llm)
 
-        tools = agent_config.tools
+        tools = await self._sub_agent_tools(ctx, agent_config)
+        start_tool_call = partial(self._start_tool_call, ctx, agent_config)
 
-        response = await llm.achat_with_tools(tools, chat_history=llm_input)
+        speculation = None
+        if self.speculator is not None:
+            speculation = self.speculator.take(
+                id(ctx), active_speaker, len(chat_history)
+            )
+        if speculation is not None:
+            # started by the orchestrator; its tool calls are started below
+            response = await self.speculator.result(speculation)
+            if self.stream and response.message.content:
+                ctx.write_event_to_stream(
+                    AgentStreamEvent(
+                        delta=response.message.content, agent_name=active_speaker
+                    )
+                )
+        else:
+            response = await self._achat_with_tools(
+                ctx,
+                llm,
+                tools,
+                await self._sub_agent_input(
+                    ctx, agent_config, chat_history, llm, tools
+                ),
+                agent_name=active_speaker,
+                # the calls of a model that may be escalated start once validated
+                on_tool_call=None if escalates else start_tool_call,
+            )
+        if escalates:
+            reason = invalid_response(llm, response, tools)
+            if reason is not None:
+                llm, response = await self._escalate(
+                    ctx,
+                    llm,
+                    reason,
+                    tools,
+                    await self._sub_agent_input(
+                        ctx, agent_config, chat_history, state.llm, tools
+                    ),
+                    agent_name=active_speaker,
+                    on_tool_call=start_tool_call,
+                )
 
         tool_calls: list[ToolSelection] = llm.get_tool_calls_from_response(
             response, error_on_no_tool_call=False
         )
         if len(tool_calls) == 0:
-            chat_history.append(response.message)
-            await ctx.set("chat_history", chat_history)
+            message = response.message
+            if agent_config.output_schema is not None:
+                message = await self._validate_output(ctx, agent_config, llm, message)
+            state.append_message(message)
+            await self._checkpoint(ctx, turn_complete=True)
             return StopEvent(
                 result={
-                    "response": response.message.content,
+                    "response": message.content,
                     "chat_history": chat_history,
                 }
             )
 
-        await ctx.set("num_tool_calls", len(tool_calls))
+        if any(tc.tool_name == "RequestTransfer" for tc in tool_calls):
+            return await self._request_transfer(ctx, active_speaker, tool_calls)
+
+        state.append_message(response.message)
+        await self._checkpoint(ctx)
+
+        # with a broker, the calls that need approval are parked and the turn ends
+        # once the other calls of the batch are done
+        session_id = state.session_id
+        parked_calls = []
+        if self.approval_broker is not None and session_id is not None:
+            parked_calls = [
+                tool_call
+                for tool_call in tool_calls
+                if agent_config.requires_approval(tool_call.tool_name)
+            ]
+
+        # the results of this batch are collected by `aggregate_tool_results`
+        batch_id = uuid.uuid4().hex
+        parked = self._park_tool_calls(
+            ctx, agent_config, session_id, batch_id, parked_calls
+        )
+        tool_ids = [
+            tool_call.tool_id
+            for tool_call in tool_calls
+            if tool_call not in parked_calls
+        ]
+        if not tool_ids:
+            return await self._park_turn(ctx, chat_history, parked)
+        state.start_batch(batch_id, tool_ids, parked)
 
         for tool_call in tool_calls:
-            if tool_call.tool_name in agent_config.tools_requiring_human_confirmation:
+            if tool_call in parked_calls:
+                continue
+            if agent_config.requires_approval(tool_call.tool_name):
                 ctx.write_event_to_stream(
                     ToolRequestEvent(
                         prefix=f"Tool {tool_call.tool_name} requires human approval.",
                         tool_name=tool_call.tool_name,
                         tool_kwargs=tool_call.tool_kwargs,
                         tool_id=tool_call.tool_id,
+                        batch_id=batch_id,
                     )
                 )
             else:
+                # start every call of the batch now, so they all run concurrently
+                if (id(ctx), tool_call.tool_id) not in self._running_tool_calls:
+                    start_tool_call(tool_call)
                 ctx.send_event(
-                    ToolCallEvent(tool_call=tool_call, tools=agent_config.tools)
+                    mark_sent(
+                        ToolCallEvent(
+                            tool_call=tool_call,
+                            tools=agent_config.tools,
+                            batch_id=batch_id,
+                            policy=agent_config.tool_policies.get(tool_call.tool_name),
+                        )
+                    )
                 )
 
-        chat_history.append(response.message)
-        await ctx.set("chat_history", chat_history)
+    async def _validate_output(
+        self, ctx: Context, agent_config: AgentConfig, llm: LLM, message: ChatMessage
+    ) -> ChatMessage:
+        """
+        Checks the agent's answer against its output schema, repairing it locally
+        or, failing that, with a short LLM call without the conversation.
+
+        A repaired answer replaces the message as the schema's JSON; with streaming,
+        the deltas of the original answer were already sent.
+        """
+        output_schema = agent_config.output_schema
+        content = message.content or ""
+        parsed = output_schema.parse(content)
+        if parsed is None:
+            output_schema.record("unstructured")
+            return message
+        outcome = "repaired_locally" if parsed.repairs else "valid"
+        repairs = list(parsed.repairs)
+        for _ in range(output_schema.max_llm_repairs):
+            if parsed.error is None:
+                break
+            outcome = "repaired_by_llm"
+            repairs.append("llm")
+            response = await self._achat_with_tools(
+                ctx,
+                llm,
+                [],
+                output_schema.repair_input(content, parsed.error),
+                agent_name=agent_config.name,
+                streamed=False,
+            )
+            parsed = output_schema.parse(response.message.content or "")
+            if parsed is None:
+                break
+        if parsed is None or parsed.error is not None:
+            output_schema.record("failed", repairs)
+            return message
+        output_schema.record(outcome, repairs)
+        if outcome == "valid":
+            return message
+        return ChatMessage(
+            role="assistant",
+            content=parsed.value.model_dump_json(indent=4),
+            additional_kwargs=message.additional_kwargs,
+        )
+
+    async def _sub_agent_tools(
+        self, ctx: Context, agent_config: AgentConfig
+    ) -> list[BaseTool]:
+        """The agent's tools, plus `RequestTransfer` while it may still hand the turn off."""
+        tools = agent_config.tools or []
+        if (
+            self.routing_policy.sticky
+            and (await get_session_state(ctx)).turn_transfers
+            < self.routing_policy.max_transfers_per_turn
+        ):
+            tools = [*tools, self._request_transfer_tool]
+        return tools
+
+    async def _sub_agent_input(
+        self,
+        ctx: Context,
+        agent_config: AgentConfig,
+        chat_history: list[ChatMessage],
+        llm: LLM,
+        tools: list[BaseTool],
+    ) -> list[ChatMessage]:
+        system_prompt = agent_config.static_system_prompt
+        if self._request_transfer_tool in tools:
+            system_prompt += "\n\n" + self.transfer_prompt.format(
+                agent_name=agent_config.name
+            )
+        return await self._build_llm_input(
+            ctx,
+            system_prompt,
+            chat_history,
+            llm,
+            agent_name=agent_config.name,
+            token_budget=agent_config.max_history_tokens,
+            state_prompt=await get_user_state_prompt(ctx),
+        )
+
+    async def _speculate(
+        self,
+        ctx: Context,
+        agent_configs: dict[str, AgentConfig],
+        chat_history: list[ChatMessage],
+        user_msg: str | None,
+    ) -> None:
+        """Starts the LLM calls of the sub-agents the orchestrator is likely to pick."""
+        state = await get_session_state(ctx)
+        last_agent = state.active_speaker or None
+        for agent_name in self.speculator.candidates(
+            user_msg, last_agent, list(agent_configs)
+        ):
+            agent_config = agent_configs[agent_name]
+            llm = agent_config.llm or state.llm
+            tools = await self._sub_agent_tools(ctx, agent_config)
+            llm_input = await self._sub_agent_input(
+                ctx, agent_config, chat_history, llm, tools
+            )
+            self.speculator.start(
+                id(ctx),
+                agent_name,
+                llm_input,
+                self._achat_with_tools(
+                    ctx,
+                    llm,
+                    tools,
+                    llm_input,
+                    agent_name=agent_name,
+                    speculative=True,
+                ),
+                num_messages=len(chat_history),
+            )
+
+    async def _request_transfer(
+        self, ctx: Context, agent_name: str, tool_calls: list[ToolSelection]
+    ) -> OrchestratorEvent:
+        """Hands the turn back to the orchestrator when the agent calls `RequestTransfer`."""
+        # the agent's message is not kept, so the next agent answers the user message;
+        # the other calls of the message, started while streaming, are not needed
+        for tool_call in tool_calls:
+            running = self._running_tool_calls.pop((id(ctx), tool_call.tool_id), None)
+            if running is not None:
+                running.cancel()
+        state = await get_session_state(ctx)
+        state.turn_transfers += 1
+        state.set_active_speaker("", agent_turns=0)
+        await self._checkpoint(ctx)
+        ctx.write_event_to_stream(
+            ProgressEvent(msg=f"Agent {agent_name} requested a transfer")
+        )
+        user_msg = next(
+            (m.content for m in reversed(state.chat_history) if m.role == "user"),
+            None,
+        )
+        return OrchestratorEvent(user_msg=user_msg, transferred_from=agent_name)
+
+    def _park_tool_calls(
+        self,
+        ctx: Context,
+        agent_config: AgentConfig,
+        session_id: str | None,
+        batch_id: str,
+        tool_calls: list[ToolSelection],
+    ) -> list[PendingApproval]:
+        """Stores the tool calls in the approval broker and asks for their approval."""
+        if not tool_calls:
+            return []
+        timeouts = {
+            tool_name: policy.approval_timeout
+            for tool_name, policy in agent_config.tool_policies.items()
+            if policy.approval_timeout is not None
+        }
+        parked = self.approval_broker.park(
+            session_id,
+            batch_id,
+            [(tc.tool_id, tc.tool_name, tc.tool_kwargs) for tc in tool_calls],
+            timeouts=timeouts,
+        )
+        for approval in parked:
+            ctx.write_event_to_stream(
+                ToolRequestEvent(
+                    prefix=f"Tool {approval.tool_name} requires human approval.",
+                    tool_name=approval.tool_name,
+                    tool_kwargs=approval.tool_kwargs,
+                    tool_id=approval.tool_id,
+                    batch_id=batch_id,
+                    approval_id=approval.approval_id,
+                )
+            )
+        return parked
+
+    async def _park_turn(
+        self,
+        ctx: Context,
+        chat_history: list[ChatMessage],
+        parked: list[PendingApproval],
+    ) -> StopEvent:
+        # not a partial turn: the session resumes from here once the approvals arrive
+        await self._checkpoint(ctx, turn_complete=True)
+        return StopEvent(
+            result={
+                "response": None,
+                "chat_history": chat_history,
+                "pending_approvals": parked,
+            }
+        )
+
+    async def _settle_approval(
+        self, ctx: Context, approval: PendingApproval
+    ) -> ChatMessage:
+        """The tool message of a call still in the broker when the user moved on: the
+        result of an approved call, which runs now, or the rejection."""
+        if approval.status != "approved":
+            return self._rejected_tool_message(
+                approval.tool_id,
+                approval.tool_name,
+                approval.reason or APPROVAL_CANCELLED_REASON,
+            )
+        # the agent that asked for it, unless the agent configs changed since
+        state = await get_session_state(ctx)
+        agent_config = state.agent_configs.get(state.active_speaker)
+        return await self._call_tool(
+            ctx,
+            ToolSelection(
+                tool_id=approval.tool_id,
+                tool_name=approval.tool_name,
+                tool_kwargs=approval.tool_kwargs,
+            ),
+            agent_config.tools if agent_config is not None else [],
+            policy=agent_config.tool_policies.get(approval.tool_name)
+            if agent_config is not None
+            else None,
+        )
+
+    def _rejected_tool_message(
+        self, tool_id: str, tool_name: str, reason: str | None
+    ) -> ChatMessage:
+        return ChatMessage(
+            role="tool",
+            content=self.default_tool_reject_str + f"user reason: {reason}",
+            additional_kwargs={"tool_call_id": tool_id, "name": tool_name},
+        )
 
     @step
+    @traced
+    async def resume_approvals(
+        self, ctx: Context, ev: ResumeApprovalsEvent
+    ) -> ToolCallEvent | ToolCallResultEvent:
+        """Runs or rejects the parked tool calls of a batch once they are all decided."""
+        state = await get_session_state(ctx)
+        agent_config = state.agent_config()
+
+        batch_id = ev.approvals[0].batch_id
+        state.start_batch(batch_id, [approval.tool_id for approval in ev.approvals])
+
+        for approval in ev.approvals:
+            if approval.status == "approved":
+                ctx.send_event(
+                    mark_sent(
+                        ToolCallEvent(
+                            tools=agent_config.tools,
+                            tool_call=ToolSelection(
+                                tool_id=approval.tool_id,
+                                tool_name=approval.tool_name,
+                                tool_kwargs=approval.tool_kwargs,
+                            ),
+                            batch_id=batch_id,
+                            policy=agent_config.tool_policies.get(approval.tool_name),
+                        )
+                    )
+                )
+            else:
+                ctx.send_event(
+                    mark_sent(
+                        ToolCallResultEvent(
+                            chat_message=self._rejected_tool_message(
+                                approval.tool_id, approval.tool_name, approval.reason
+                            ),
+                            batch_id=batch_id,
+                        )
+                    )
+                )
+
+    @step
+    @traced
     async def handle_tool_approval(
         self, ctx: Context, ev: ToolApprovedEvent
     ) -> ToolCallEvent | ToolCallResultEvent:
         """Handles the approval or rejection of a tool call."""
         if ev.approved:
-            active_speaker = await ctx.get("active_speaker")
-            agent_config = (await ctx.get("agent_configs"))[active_speaker]
+            agent_config = (await get_session_state(ctx)).agent_config()
             return ToolCallEvent(
                 tools=agent_config.tools,
                 tool_call=ToolSelection(
@@ -226,116 +1016,268 @@ class SystemAgent(Workflow):
                     tool_name=ev.tool_name,
                     tool_kwargs=ev.tool_kwargs,
                 ),
+                batch_id=ev.batch_id,
+                policy=agent_config.tool_policies.get(ev.tool_name),
             )
         else:
             return ToolCallResultEvent(
-                chat_message=ChatMessage(
-                    role="tool",
-                    content=self.default_tool_reject_str + f"user reason: {ev.response}",
-                    additional_kwargs ={"tool_call_id": ev.tool_id, "name": ev.tool_name},
-                )
+                chat_message=self._rejected_tool_message(
+                    ev.tool_id, ev.tool_name, ev.response
+                ),
+                batch_id=ev.batch_id,
             )
 
-    @step(num_workers=4)
-    async def handle_tool_call(
-        self, ctx: Context, ev: ToolCallEvent
-    ) -> ActiveAgentEvent:
-        """Handles the execution of a tool call."""
-        tool_call = ev.tool_call
-        tools_by_name = {tool.metadata.get_name(): tool for tool in ev.tools}
-
-        tool_msg = None
+    async def _call_tool(
+        self,
+        ctx: Context,
+        tool_call: ToolSelection,
+        tools: list[BaseTool],
+        policy: ToolPolicy | None = None,
+    ) -> ChatMessage:
+        """Runs a single tool call and wraps its output in a tool message."""
+        if self.tracer is None:
+            return await self._run_tool(ctx, tool_call, tools, policy)
+        with self.tracer.span(tool_call.tool_name, "tool"):
+            return await self._run_tool(ctx, tool_call, tools, policy)
+
+    async def _run_tool(
+        self,
+        ctx: Context,
+        tool_call: ToolSelection,
+        tools: list[BaseTool],
+        policy: ToolPolicy | None,
+    ) -> ChatMessage:
+        tools_by_name = {tool.metadata.get_name(): tool for tool in tools}
 
         tool = tools_by_name.get(tool_call.tool_name)
         additional_kwargs = {
             "tool_call_id": tool_call.tool_id,
-            "name": tool.metadata.get_name(),
+            "name": tool_call.tool_name,
         }
         if not tool:
-            tool_msg = ChatMessage(
+            return ChatMessage(
                 role="tool",
                 content=f"Tool {tool_call.tool_name} does not exist",
                 additional_kwargs=additional_kwargs,
             )
 
+        cache_key = None
+        if policy is not None and policy.cache_ttl is not None:
+            cache_key = await self.tool_cache.key(
+                ctx, tool_call.tool_name, tool_call.tool_kwargs, policy
+            )
+            content = self.tool_cache.get(cache_key)
+            ctx.write_event_to_stream(
+                ProgressEvent(
+                    msg=f"Tool {tool_call.tool_name} cache {'miss' if content is None else 'hit'} "
+                    f"(hit ratio {self.tool_cache.hit_ratio:.0%})"
+                )
+            )
+            if content is not None:
+                span = current_span()
+                if span is not None:
+                    span.attributes["cached"] = True
+                return ChatMessage(
+                    role="tool", content=content, additional_kwargs=additional_kwargs
+                )
+
         try:
-            if isinstance(tool, FunctionToolWithContext):
-                tool_output = await tool.acall(ctx, **tool_call.tool_kwargs)
-            else:
-                tool_output = await tool.acall(**tool_call.tool_kwargs)
+            tool_output = await self.tool_scheduler.run(
+                ctx, tool, tool_call.tool_kwargs, policy=policy, http=self.http_client
+            )
+            if cache_key is not None:
+                self.tool_cache.set(cache_key, tool_output.content, policy)
+            if policy is not None:
+                for tool_name in policy.invalidates:
+                    self.tool_cache.invalidate(tool_name)
 
-            tool_msg = ChatMessage(
+            return ChatMessage(
                 role="tool",
                 content=tool_output.content,
                 additional_kwargs=additional_kwargs,
             )
         except Exception as e:
-            tool_msg = ChatMessage(
+            return ChatMessage(
                 role="tool",
                 content=f"Encountered error in tool call: {e}",
                 additional_kwargs=additional_kwargs,
             )
 
+    def _start_tool_call(
+        self, ctx: Context, agent_config: AgentConfig, tool_call: ToolSelection
+    ) -> None:
+        """Starts a tool call in the background, unless it needs approval."""
+        if tool_call.tool_name == "RequestTransfer" or agent_config.requires_approval(
+            tool_call.tool_name
+        ):
+            return
+        self._running_tool_calls[id(ctx), tool_call.tool_id] = asyncio.create_task(
+            self._call_tool(
+                ctx,
+                tool_call,
+                agent_config.tools,
+                policy=agent_config.tool_policies.get(tool_call.tool_name),
+            )
+        )
+
+    @step(num_workers=4)
+    @traced
+    async def handle_tool_call(
+        self, ctx: Context, ev: ToolCallEvent
+    ) -> ActiveAgentEvent:
+        """Handles the execution of a tool call."""
+        tool_call = ev.tool_call
+
+        # calls of a batch are started by `speak_with_sub_agent`, approved calls start here
+        running = self._running_tool_calls.pop((id(ctx), tool_call.tool_id), None)
+        if running is not None:
+            tool_msg = await running
+        else:
+            tool_msg = await self._call_tool(ctx, tool_call, ev.tools, policy=ev.policy)
+
         ctx.write_event_to_stream(
             ProgressEvent(
                 msg=f"Tool {tool_call.tool_name} called with {tool_call.tool_kwargs} returned {tool_msg.content}"
             )
         )
 
-        return ToolCallResultEvent(chat_message=tool_msg)
+        return ToolCallResultEvent(chat_message=tool_msg, batch_id=ev.batch_id)
 
     @step
+    @traced
     async def aggregate_tool_results(
         self, ctx: Context, ev: ToolCallResultEvent
-    ) -> ActiveAgentEvent:
-        """Collects the results of all tool calls and updates the chat history."""
-        num_tool_calls = await ctx.get("num_tool_calls")
-        results = ctx.collect_events(ev, [ToolCallResultEvent] * num_tool_calls)
-        if not results:
+    ) -> ActiveAgentEvent | StopEvent:
+        """Collects the results of all tool calls of a batch and updates the chat history."""
+        # recorded without awaiting, so the workers of this step never lose a result
+        state = await get_session_state(ctx)
+        batch = state.add_tool_result(ev.batch_id, ev.chat_message)
+        if batch is None:
             return
 
-        chat_history = await ctx.get("chat_history")
-        for result in results:
-            chat_history.append(result.chat_message)
-        await ctx.set("chat_history", chat_history)
+        # keep the results in the order the LLM made the calls
+        for message in batch.ordered_results():
+            state.append_message(message)
+        if batch.parked:
+            return await self._park_turn(ctx, state.chat_history, batch.parked)
+        await self._checkpoint(ctx)
 
         return ActiveAgentEvent()
 
     @step
+    @traced
     async def orchestrator(
         self, ctx: Context, ev: OrchestratorEvent
-    ) -> ActiveAgentEvent | StopEvent:
+    ) -> ActiveAgentEvent | FanOutEvent | StopEvent:
         """Decides which agent to run next, if any."""
-        user_state = await ctx.get("user_state")
-
-        if not user_state:
-            agent_configs = await ctx.get("agent_configs")
-            chat_history = await ctx.get("chat_history")
-
-            agent_context_str = ""
-            for agent_name, agent_config in agent_configs.items():
-                agent_context_str += f"{agent_name}: {agent_config.description}\n"
-
-            user_state = await ctx.get("user_state")
-            user_state_str = "\n".join([f"{k}: {v}" for k, v in user_state.items()])
-            system_prompt = self.orchestrator_prompt.format(
-                agent_context_str=agent_context_str, user_state_str=user_state_str
+        state = await get_session_state(ctx)
+        user_state = state.user_state
+
+        # without a sticky policy, the active agent keeps the turn once the state is set
+        if not user_state or self.routing_policy.sticky:
+            agent_configs = state.agent_configs
+            chat_history = state.chat_history
+
+            # try to route without an LLM call first; only the opening message of a
+            # conversation routes the same way without its context, and an agent that
+            # handed the turn back must not get it again from the cache
+            user_msg = ev.get("user_msg")
+            orchestrator_prompt = self._get_orchestrator_prompt(agent_configs)
+            fingerprint = orchestrator_prompt.fingerprint
+            use_routing_cache = (
+                self.routing_cache is not None
+                and bool(user_msg)
+                and state.conversation.is_first_turn
+                and not ev.get("transferred_from")
             )
+            if use_routing_cache:
+                selected_agent = self.routing_cache.lookup(user_msg, fingerprint)
+                if selected_agent in agent_configs:
+                    state.set_active_speaker(selected_agent)
+                    await self._checkpoint(ctx)
+                    ctx.write_event_to_stream(
+                        ProgressEvent(msg=f"Transferring to agent {selected_agent}")
+                    )
+                    return ActiveAgentEvent()
 
-            llm_input = [ChatMessage(role="system", content=system_prompt)] + chat_history
-            llm = await ctx.get("llm")
-
-            # convert the TransferToAgent pydantic model to a tool
-            tools = [get_function_tool(TransferToAgent)]
+            system_prompt = orchestrator_prompt.format(render_user_state(user_state))
 
-            response = await llm.achat_with_tools(tools, chat_history=llm_input)
-            tool_calls = llm.get_tool_calls_from_response(
-                response, error_on_no_tool_call=False
+            llm = state.llm
+            if self.tiering is not None and self.tiering.router_llm is not None:
+                llm = self.tiering.router_llm
+            llm_input = await self._build_llm_input(
+                ctx, system_prompt, chat_history, llm, agent_name="orchestrator"
             )
 
-            # if no tool calls were made, the orchestrator probably needs more information
-            if len(tool_calls) == 0:
-                chat_history.append(response.message)
+            tools = [self._transfer_tool]
+
+            if self.speculator is not None:
+                await self._speculate(ctx, agent_configs, chat_history, user_msg)
+            selected_agent = None
+            fan_out_agents = []
+            try:
+                response = await self._achat_with_tools(
+                    ctx,
+                    llm,
+                    tools,
+                    llm_input,
+                    agent_name="orchestrator",
+                    allow_parallel_tool_calls=self.fan_out is not None,
+                )
+                if self._escalates(llm, state.llm):
+                    reason = invalid_response(llm, response, tools, agent_configs)
+                    if reason is not None:
+                        llm, response = await self._escalate(
+                            ctx,
+                            llm,
+                            reason,
+                            tools,
+                            llm_input,
+                            agent_name="orchestrator",
+                            allow_parallel_tool_calls=self.fan_out is not None,
+                        )
+                tool_calls = llm.get_tool_calls_from_response(
+                    response, error_on_no_tool_call=False
+                )
+                selected_agent = self._transfer_target(tool_calls, agent_configs)
+                if tool_calls and selected_agent is None:
+                    # re-prompt once, naming the agents that exist
+                    correction = UNKNOWN_AGENT_PROMPT.format(
+                        agent_name=tool_calls[0].tool_kwargs.get("agent_name"),
+                        agent_names=", ".join(agent_configs),
+                    )
+                    response = await self._achat_with_tools(
+                        ctx,
+                        llm,
+                        tools,
+                        llm_input + [ChatMessage(role="system", content=correction)],
+                        agent_name="orchestrator",
+                        allow_parallel_tool_calls=self.fan_out is not None,
+                    )
+                    tool_calls = llm.get_tool_calls_from_response(
+                        response, error_on_no_tool_call=False
+                    )
+                    selected_agent = self._transfer_target(tool_calls, agent_configs)
+                    if tool_calls and selected_agent is None:
+                        response = ChatResponse(
+                            message=ChatMessage(
+                                role="assistant", content=UNKNOWN_AGENT_RESPONSE
+                            )
+                        )
+                if selected_agent is not None:
+                    fan_out_agents = self._fan_out_agents(tool_calls, agent_configs)
+            finally:
+                # the picked agent's call is kept for `speak_with_sub_agent`; branches
+                # of a fan-out are offered other tools, so their calls are dropped
+                if self.speculator is not None:
+                    self.speculator.resolve(
+                        id(ctx), None if fan_out_agents else selected_agent
+                    )
+
+            # if no agent was picked, the orchestrator probably needs more information
+            if selected_agent is None:
+                state.append_message(response.message)
+                await self._checkpoint(ctx, turn_complete=True)
                 return StopEvent(
                     result={
                         "response": response.message.content,
@@ -343,12 +1285,183 @@ class SystemAgent(Workflow):
                     }
                 )
 
-            tool_call = tool_calls[0]
-            selected_agent = tool_call.tool_kwargs["agent_name"]
-            await ctx.set("active_speaker", selected_agent)
+            if fan_out_agents:
+                ctx.write_event_to_stream(
+                    ProgressEvent(
+                        msg=f"Fanning out to agents {', '.join(fan_out_agents)}"
+                    )
+                )
+                return FanOutEvent(agent_names=fan_out_agents, user_msg=user_msg)
+
+            state.set_active_speaker(selected_agent)
+
+            if use_routing_cache:
+                self.routing_cache.store(user_msg, fingerprint, selected_agent)
 
             ctx.write_event_to_stream(
                 ProgressEvent(msg=f"Transferring to agent {selected_agent}")
             )
+            await self._checkpoint(ctx)
 
         return ActiveAgentEvent()
+
+    @staticmethod
+    def _transfer_target(
+        tool_calls: list[ToolSelection], agent_configs: dict[str, AgentConfig]
+    ) -> str | None:
+        """The agent of the first transfer to a configured agent, if any."""
+        for tool_call in tool_calls:
+            agent_name = tool_call.tool_kwargs.get("agent_name")
+            if agent_name in agent_configs:
+                return agent_name
+        return None
+
+    # ---- fan-out ----
+
+    def _fan_out_agents(
+        self, tool_calls: list[ToolSelection], agent_configs: dict[str, AgentConfig]
+    ) -> list[str]:
+        """The agents to fan out to, or an empty list to transfer to the first one."""
+        if self.fan_out is None:
+            return []
+        agent_names = []
+        for tool_call in tool_calls:
+            agent_name = tool_call.tool_kwargs.get("agent_name")
+            if agent_name in agent_configs and agent_name not in agent_names:
+                agent_names.append(agent_name)
+        agent_names = agent_names[: self.fan_out.max_agents]
+        return agent_names if len(agent_names) > 1 else []
+
+    @step(num_workers=1)
+    @traced
+    async def fan_out_turn(self, ctx: Context, ev: FanOutEvent) -> StopEvent:
+        """Runs the agents picked by the orchestrator concurrently, each on its own
+        branch of the history, and merges their answers into one response."""
+        # one step for both stages: every step costs each session's context a queue,
+        # a lock and its workers
+        state = await get_session_state(ctx)
+        try:
+            async with asyncio.TaskGroup() as group:
+                tasks = [
+                    group.create_task(
+                        self._run_branch(ctx, state.agent_config(agent_name))
+                    )
+                    for agent_name in ev.agent_names
+                ]
+        except ExceptionGroup as e:
+            # the other branches were cancelled; fail like a single agent would
+            raise e.exceptions[0]
+        branches = [task.result() for task in tasks]
+        content = await self._merge_branches(ctx, branches, ev.user_msg)
+
+        state.append_message(ChatMessage(role="assistant", content=content))
+        # with a sticky policy the next turn goes back to the orchestrator, which may
+        # fan out again; otherwise the first agent keeps the conversation
+        if self.routing_policy.sticky:
+            state.set_active_speaker("", agent_turns=0)
+        else:
+            state.set_active_speaker(branches[0].agent_name)
+        await self._checkpoint(ctx, turn_complete=True)
+        return StopEvent(
+            result={
+                "response": content,
+                "chat_history": state.chat_history,
+                "branches": {branch.agent_name: branch.content for branch in branches},
+            }
+        )
+
+    async def _run_branch(
+        self, ctx: Context, agent_config: AgentConfig
+    ) -> BranchResult:
+        slots = self._fan_out_slots or contextlib.nullcontext()
+        async with slots, asyncio.timeout(self.fan_out.branch_timeout):
+            state = await get_session_state(ctx)
+            llm = agent_config.llm or state.llm
+            # the branch shares the messages of the history, not the list
+            chat_history = list(state.chat_history)
+            start = len(chat_history)
+            for num_calls in range(1, self.fan_out.max_llm_calls + 1):
+                tools = agent_config.tools or []
+                if num_calls == self.fan_out.max_llm_calls:
+                    tools = []
+                llm_input = await self._sub_agent_input(
+                    ctx, agent_config, chat_history, llm, tools
+                )
+                response = await self._achat_with_tools(
+                    ctx,
+                    llm,
+                    tools,
+                    llm_input,
+                    agent_name=agent_config.name,
+                    streamed=False,
+                )
+                if self._escalates(llm, state.llm):
+                    reason = invalid_response(llm, response, tools)
+                    if reason is not None:
+                        # the rest of the branch stays on the run's LLM
+                        llm, response = await self._escalate(
+                            ctx,
+                            llm,
+                            reason,
+                            tools,
+                            llm_input,
+                            agent_name=agent_config.name,
+                            streamed=False,
+                        )
+                chat_history.append(response.message)
+                tool_calls = llm.get_tool_calls_from_response(
+                    response, error_on_no_tool_call=False
+                )
+                if not tool_calls:
+                    break
+                chat_history.extend(
+                    await asyncio.gather(
+                        *[
+                            self._call_branch_tool(ctx, agent_config, tool_call)
+                            for tool_call in tool_calls
+                        ]
+                    )
+                )
+            return BranchResult(
+                agent_name=agent_config.name,
+                content=response.message.content or "",
+                messages=chat_history[start:],
+            )
+
+    async def _call_branch_tool(
+        self, ctx: Context, agent_config: AgentConfig, tool_call: ToolSelection
+    ) -> ChatMessage:
+        if agent_config.requires_approval(tool_call.tool_name):
+            return self._rejected_tool_message(
+                tool_call.tool_id, tool_call.tool_name, FAN_OUT_APPROVAL_REASON
+            )
+        return await self._call_tool(
+            ctx,
+            tool_call,
+            agent_config.tools,
+            policy=agent_config.tool_policies.get(tool_call.tool_name),
+        )
+
+    async def _merge_branches(
+        self, ctx: Context, branches: list[BranchResult], user_msg: str | None
+    ) -> str:
+        """Combines the answers of a fan-out into one response to the user."""
+        branches = [branch for branch in branches if branch.content] or branches
+        if self.fan_out.merge == "concat" or len(branches) == 1:
+            content = concat_branches(branches)
+            if self.stream:
+                ctx.write_event_to_stream(
+                    AgentStreamEvent(delta=content, agent_name="merge")
+                )
+            return content
+        llm = (await get_session_state(ctx)).llm
+        if self.tiering is not None and self.tiering.merge_llm is not None:
+            llm = self.tiering.merge_llm
+        response = await self._achat_with_tools(
+            ctx,
+            llm,
+            [],
+            merge_input(self.fan_out.merge_prompt, user_msg, branches),
+            agent_name="merge",
+        )
+        return response.message.content or ""